@@ -9,7 +9,6 @@ import sys
 import calendar
 import os
 import numpy
-import matplotlib.pyplot as plt
 import time
 import traceback
 import readline
@@ -23,6 +22,10 @@ import plot
 import edb
 import stocks
 import ops
+import bench
+import perf
+import log
+import batch
 
 
 """
@@ -45,6 +48,9 @@ Usage scenario
 
 gbDEBUG = False
 FINFOOLSERRAND_BASE = None
+# Set using --batch commandline argument, to run a .ffe script without any user interaction
+gbBatch = False
+plt = hlpr.LazyModule('matplotlib.pyplot')
 
 
 
@@ -73,17 +79,17 @@ def setup():
 
 def session_save(sessionName):
     """
-    Save current gEntDB.data-gEntDB.meta into a pickle, so that it can be restored fast later.
+    Save current gEntDB.data-gEntDB.meta into a snapshot directory, so that it can be restored fast later.
     """
     edb.session_save(sessionName)
 
 
-def session_restore(sessionName):
+def session_restore(sessionName, dataKeys=None):
     """
-    Restore a previously saved gEntDB.data-gEntDB.meta fast from a pickle.
-    Also setup the modules used by the main logic.
+    Restore a previously saved gEntDB.data-gEntDB.meta fast from a snapshot directory.
+    dataKeys: If a list of data keys is passed, only those are restored.
     """
-    edb.session_restore(sessionName)
+    edb.session_restore(sessionName, dataKeys)
 
 
 def input_multi(prompt="OO>", altPrompt="...", theFile=None):
@@ -182,11 +188,29 @@ def do_run(theFile=None):
             traceback.print_exc()
 
 
+def handle_flags():
+    """
+    Handle the commandline flags (if any) and remove them from sys.argv
+        --batch: Dont wait for user input wrt the disclaimer or other prompts, run the
+            given .ffe script(s) one statement after the other, and quit at the end,
+            rather than falling back to interactive mode.
+    """
+    global gbBatch
+    if '--batch' in sys.argv:
+        gbBatch = True
+        sys.argv.remove('--batch')
+
+
 def handle_args():
     """
     Logic to handle the commandline arguments
     """
-    if sys.argv[1].endswith(".ffe"):
+    if gbBatch and sys.argv[1].endswith(".ffe"):
+        hlpr.gbInteractive = False
+        for scriptFile in sys.argv[1:]:
+            print("INFO:Running ", scriptFile)
+            batch.run_script(scriptFile, globals())
+    elif sys.argv[1].endswith(".ffe"):
         print("INFO:Running ", sys.argv[1])
         f = open(sys.argv[1])
         do_run(f)
@@ -203,7 +227,11 @@ def handle_args():
 print("FinFoolsErrandKVC: A stupid exploration of multiple sets of numbers (MFs/Indexes/...) data")
 print("License: GPL")
 print("This is ONLY for EXPERIMENTING and WASTING some FREE TIME and NOTHING MORE...")
-input("PLEASE DO NOT USE THIS PROGRAM TO MAKE ANY DECISIONS OR INFERENCES OR ...")
+handle_flags()
+if gbBatch:
+    print("PLEASE DO NOT USE THIS PROGRAM TO MAKE ANY DECISIONS OR INFERENCES OR ...")
+else:
+    input("PLEASE DO NOT USE THIS PROGRAM TO MAKE ANY DECISIONS OR INFERENCES OR ...")
 
 setup()
 if len(sys.argv) > 1:
@@ -0,0 +1,177 @@
+# Backtest signals (boolean entities x dates matrices) over the Entities DB
+# HanishKVC, 2021
+# GPL
+
+import numpy
+import edb
+import hlpr
+
+
+DEFAULT_HORIZONS = [ '1W', '1M', '3M', '6M', '1Y' ]
+
+
+def _entDB(entDB=None):
+    if entDB == None:
+        return edb.gEntDB
+    return entDB
+
+
+def _signal(signal, entTypeTmpls, entDB):
+    """
+    Get the signal as a boolean matrix of shape [entities, dates] wrt the entities db.
+
+    signal: either a boolean (or 0/1) array of shape [entities, dates] or the data key
+        in the entities db, which contains the signal (ex: saved by screener.backfill).
+    entTypeTmpls: If given, the signal is retained only wrt members of matching entTypes.
+    """
+    if type(signal) == str:
+        signal = entDB.data[signal]
+    bSig = numpy.asarray(signal)[:entDB.nxtEntIndex, :entDB.nxtDateIndex] != 0
+    if bSig.shape != (entDB.nxtEntIndex, entDB.nxtDateIndex):
+        raise ValueError("Backtest:Signal shape {} doesnt match entities db".format(bSig.shape))
+    if entTypeTmpls != None:
+        bSig = bSig & entDB.type_mask(entTypeTmpls).reshape(-1,1)
+    return bSig
+
+
+def _days(horizon, entDB):
+    if type(horizon) == str:
+        return hlpr.days_in(horizon, entDB.bSkipWeekends)
+    return int(horizon)
+
+
+def forward_returns(signal, horizons=DEFAULT_HORIZONS, entTypeTmpls=None, dataKey='data', entDB=None):
+    """
+    Calculate the distribution of the forward returns (absolute %), at each of the given
+    horizons, after the signal fires. All entities and dates are handled in one go, wrt
+    each horizon.
+
+    signal: look at _signal.
+    horizons: list of durations (ex: '1W', '3M', '1Y' or number of days).
+
+    Returns a dict of horizon: stats, with the stats being a dict containing
+        count, mean, median, std, p10, p90: wrt the forward returns after the signal,
+        hitRate: the percentage of the forward returns which are positive,
+        baseMean, baseHitRate: the same wrt all entity-dates (with valid data), to compare.
+            If entTypeTmpls is given, the baseline is also restricted to their members.
+    """
+    entDB = _entDB(entDB)
+    bSig = _signal(signal, entTypeTmpls, entDB)
+    tData = entDB.data[dataKey][:entDB.nxtEntIndex, :entDB.nxtDateIndex]
+    if entTypeTmpls != None:
+        bRows = entDB.type_mask(entTypeTmpls)
+    else:
+        bRows = numpy.ones(entDB.nxtEntIndex, dtype=bool)
+    stats = {}
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        for horizon in horizons:
+            days = _days(horizon, entDB)
+            if (days <= 0) or (days >= tData.shape[1]):
+                continue
+            tStart = tData[:, :-days]
+            tEnd = tData[:, days:]
+            tFwd = (tEnd/tStart-1)*100
+            bValid = (tStart > 0) & (tEnd > 0)
+            tVals = tFwd[bSig[:, :-days] & bValid]
+            tBase = tFwd[bValid & bRows.reshape(-1,1)]
+            hStats = { 'count': len(tVals) }
+            if len(tVals) > 0:
+                hStats['mean'] = numpy.mean(tVals)
+                hStats['median'], hStats['p10'], hStats['p90'] = numpy.percentile(tVals, [50, 10, 90])
+                hStats['std'] = numpy.std(tVals)
+                hStats['hitRate'] = numpy.count_nonzero(tVals > 0)*100/len(tVals)
+            else:
+                for k in [ 'mean', 'median', 'p10', 'p90', 'std', 'hitRate' ]:
+                    hStats[k] = numpy.nan
+            hStats['baseMean'] = numpy.mean(tBase) if len(tBase) > 0 else numpy.nan
+            hStats['baseHitRate'] = numpy.count_nonzero(tBase > 0)*100/len(tBase) if len(tBase) > 0 else numpy.nan
+            stats[horizon] = hStats
+    return stats
+
+
+def print_forward_returns(stats):
+    """
+    Print the forward returns stats returned by forward_returns.
+    """
+    keys = [ 'count', 'mean', 'median', 'std', 'p10', 'p90', 'hitRate', 'baseMean', 'baseHitRate' ]
+    print("{:>8} {}".format("Horizon", " ".join([ "{:>11}".format(k) for k in keys ])))
+    for horizon in stats:
+        print("{:>8} {:11} {}".format(horizon, stats[horizon]['count'], " ".join([ "{:11.2f}".format(stats[horizon][k]) for k in keys[1:] ])))
+
+
+def _periods(rebalance, entDB):
+    """
+    Map each date in the entities db to a rebalancing period number (0, 1, ...).
+    rebalance: 'D', 'W', 'M' for calendar day/week/month, or a number of days.
+    """
+    if type(rebalance) == str:
+        pids = hlpr.dateints2periodids(entDB.dates[:entDB.nxtDateIndex], rebalance)
+    else:
+        pids = numpy.arange(entDB.nxtDateIndex)//int(rebalance)
+    bNew = numpy.ones(len(pids), dtype=bool)
+    bNew[1:] = pids[1:] != pids[:-1]
+    return numpy.cumsum(bNew)-1
+
+
+def equity_curve(signal, rebalance='M', bAnyInPeriod=True, entTypeTmpls=None, dataKey='data', entDB=None):
+    """
+    Simulate a equal weight portfolio of the entities selected by the signal, which is
+    rebalanced at the end of each period, and return its equity curve (starting at 1).
+
+    signal: look at _signal.
+    rebalance: 'D', 'W' or 'M' to rebalance at the end of each calendar day/week/month,
+        or a number of days.
+    bAnyInPeriod: If True, the entities wrt which the signal fired on any date in a period
+        are held over the next period, else only those for which it fired on the last date
+        of the period (ex: for state like signals such as close > mas200).
+
+    Within a period, the positions are held (not rebalanced daily). If nothing is selected
+    wrt a period, the portfolio is in cash over the next period. The whole logic works on
+    matrices of entities x dates, without looping over the trades.
+
+    Returns a dict containing dates, equity, numHeld (wrt each date), cagr and maxDD (%).
+    """
+    entDB = _entDB(entDB)
+    bSig = _signal(signal, entTypeTmpls, entDB)
+    tData = numpy.nan_to_num(entDB.data[dataKey][:entDB.nxtEntIndex, :entDB.nxtDateIndex])
+    periods = _periods(rebalance, entDB)
+    numPeriods = periods[-1]+1
+    firstIdx = numpy.flatnonzero(numpy.diff(periods, prepend=-1))
+    lastIdx = numpy.append(firstIdx[1:]-1, len(periods)-1)
+    # The entities selected at the end of each period, with equal weights (in units).
+    if bAnyInPeriod:
+        bSel = numpy.logical_or.reduceat(bSig, firstIdx, axis=1)
+    else:
+        bSel = bSig[:, lastIdx]
+    tRebalData = tData[:, lastIdx]
+    bSel = bSel & (tRebalData > 0)
+    numSel = numpy.count_nonzero(bSel, axis=0)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        tUnits = numpy.where(bSel, 1/(tRebalData*numpy.maximum(numSel, 1)), 0)
+    # Value (relative to the start of its period) wrt each date, holding the positions from
+    # the previous period's end
+    prevPeriods = numpy.maximum(periods-1, 0)
+    tRel = numpy.einsum('ij,ij->j', tUnits[:, prevPeriods], tData)
+    bCash = (periods == 0) | (numSel[prevPeriods] == 0)
+    tRel[bCash] = 1
+    # Chain the periods
+    tPeriodRet = tRel[lastIdx]
+    tPeriodStart = numpy.ones(numPeriods)
+    tPeriodStart[1:] = numpy.cumprod(tPeriodRet)[:-1]
+    tEquity = tPeriodStart[periods]*tRel
+    numHeld = numpy.where(bCash, 0, numSel[prevPeriods])
+    years = hlpr.days2year(len(tEquity)-1, entDB.bSkipWeekends)
+    cagr = ((tEquity[-1]**(1/years))-1)*100 if years > 0 else numpy.nan
+    maxDD = numpy.max(1-tEquity/numpy.maximum.accumulate(tEquity))*100
+    return { 'dates': entDB.dates[:entDB.nxtDateIndex].astype(int), 'equity': tEquity, 'numHeld': numHeld, 'cagr': cagr, 'maxDD': maxDD }
+
+
+def print_equity_curve(result, numDates=12):
+    """
+    Print a summary of the equity curve returned by equity_curve.
+    """
+    print("CAGR: {:.2f}%, MaxDrawDown: {:.2f}%, AvgHeld: {:.1f}".format(result['cagr'], result['maxDD'], numpy.mean(result['numHeld'])))
+    step = max(len(result['dates'])//numDates, 1)
+    for i in list(range(0, len(result['dates']), step)) + [ len(result['dates'])-1 ]:
+        print("{:>8} {:10.4f} {:6}".format(result['dates'][i], result['equity'][i], result['numHeld'][i]))
+
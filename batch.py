@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# Run .ffe scripts in batch mode
+# HanishKVC, 2021
+# GPL
+
+"""
+Run .ffe scripts non interactively, optionally in parallel across multiple
+worker processes, with the output of each script saved into its own file.
+
+The workers can share a session, which is saved once (say by a prep script,
+which loads the data and runs the common ops) and inturn restored by each of
+the workers as memory mapped data. The snapshot itself is never modified by
+the workers and its pages are shared across them, through the OS page cache.
+
+Usage
+    python3 batch.py [--procs N] [--session NAME] [--prep prep.ffe] [--outdir DIR] script1.ffe script2.ffe ...
+
+    batch.run(['report1.ffe', 'report2.ffe'], sessionName='nightly', prepScript='prep.ffe', outDir='/tmp/reports')
+"""
+
+import os
+import sys
+import ast
+import time
+import traceback
+import contextlib
+import concurrent.futures
+import hlpr
+import log
+import edb
+
+
+# The messages from the scripts are shown at or above this level
+gLogLevel = 'INFO'
+
+
+
+def script_globals():
+    """
+    Create the globals dictionary in which the scripts are run. This provides the same
+    modules and helpers, as is available in the interactive mode of the program.
+    """
+    import numpy
+    import datasrc
+    import loadfilters
+    import procedb
+    import plot
+    import stocks
+    import ops
+    import perf
+    import bench
+    scriptGlobals = {
+        '__name__': '__ffe__',
+        'sys': sys, 'os': os, 'time': time, 'numpy': numpy, 'hlpr': hlpr,
+        'datasrc': datasrc, 'loadfilters': loadfilters, 'procedb': procedb, 'plot': plot,
+        'edb': edb, 'stocks': stocks, 'ops': ops, 'perf': perf, 'log': log, 'bench': bench,
+        'plt': hlpr.LazyModule('matplotlib.pyplot'),
+        'session_save': edb.session_save, 'session_restore': edb.session_restore,
+        }
+    return scriptGlobals
+
+
+def run_script(scriptFile, scriptGlobals=None):
+    """
+    Run the given .ffe script, one top level statement after the other, in scriptGlobals.
+
+    If a statement raises a exception, its traceback is printed and the remaining
+    statements are run. A quit()/exit() in the script stops it.
+    Returns the number of statements which failed.
+    """
+    if scriptGlobals == None:
+        scriptGlobals = script_globals()
+    f = open(scriptFile)
+    src = f.read()
+    f.close()
+    tree = ast.parse(src, scriptFile)
+    numErrors = 0
+    for stmt in tree.body:
+        code = compile(ast.Module(body=[stmt], type_ignores=[]), scriptFile, 'exec')
+        try:
+            exec(code, scriptGlobals)
+        except SystemExit:
+            break
+        except:
+            traceback.print_exc()
+            print("ERRR:Batch:RunScript:{}:Line {}: Failed, continuing with next statement".format(scriptFile, stmt.lineno))
+            numErrors += 1
+    return numErrors
+
+
+def _outfile(scriptFile, outDir):
+    """
+    The file into which the output of the given script is saved.
+    """
+    fBase = os.path.splitext(os.path.basename(scriptFile))[0]
+    if outDir == None:
+        outDir = os.path.dirname(os.path.abspath(scriptFile))
+    return os.path.join(outDir, "{}.out".format(fBase))
+
+
+def _worker(scriptFile, outFile, basePath, sessionName, mmapMode, logLevel):
+    """
+    Run a script in a worker process, with its output redirected to outFile.
+    """
+    time1 = time.time()
+    numErrors = -1
+    f = open(outFile, "w")
+    with contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+        try:
+            hlpr.gbInteractive = False
+            log.set_level(logLevel)
+            os.environ.setdefault('MPLBACKEND', 'Agg')
+            edb.setup(basePath)
+            if sessionName != None:
+                edb.session_restore(sessionName, mmapMode=mmapMode)
+            numErrors = run_script(scriptFile)
+        except:
+            traceback.print_exc()
+    f.close()
+    return scriptFile, outFile, numErrors, time.time()-time1
+
+
+def run(scripts, sessionName=None, prepScript=None, outDir=None, numProcs=None, basePath=None, mmapMode='c', logLevel=None):
+    """
+    Run the given list of .ffe scripts in parallel, using numProcs worker processes
+    (defaults to the number of cpus).
+
+    sessionName: If given, each worker restores this session before running its script.
+    prepScript: If given, this script is run first (in this process), and the session
+        at the end of it, is saved as sessionName, for use by the workers.
+    outDir: The dir into which the <script>.out files are saved. If not given, its
+        saved in the same dir as the script.
+    basePath: Defaults to the FINFOOLSERRAND_BASE env variable or ~/.cache/ffe.
+    mmapMode: The mode used to memory map the session data in the workers.
+    logLevel: The log level used by the workers, defaults to gLogLevel.
+
+    Returns a list of [scriptFile, outFile, numOfFailedStatements, timeTaken] wrt each script.
+    NumOfFailedStatements will be -1, if the script couldnt be run.
+    """
+    if basePath == None:
+        basePath = os.path.expanduser(os.environ.get('FINFOOLSERRAND_BASE', "~/.cache/ffe"))
+    if outDir != None:
+        os.makedirs(outDir, exist_ok=True)
+    if prepScript != None:
+        if sessionName == None:
+            sessionName = "batch"
+        print("INFO:Batch:Prep:{}".format(prepScript))
+        bInteractive = hlpr.gbInteractive
+        hlpr.gbInteractive = False
+        edb.setup(basePath)
+        numErrors = run_script(prepScript)
+        hlpr.gbInteractive = bInteractive
+        if numErrors > 0:
+            print("WARN:Batch:Prep:{}:{} statements failed".format(prepScript, numErrors))
+        edb.session_save(sessionName)
+    if numProcs == None:
+        numProcs = os.cpu_count()
+    if logLevel == None:
+        logLevel = gLogLevel
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max(1, min(numProcs, len(scripts)))) as ppe:
+        futures = [ ppe.submit(_worker, s, _outfile(s, outDir), basePath, sessionName, mmapMode, logLevel) for s in scripts ]
+        for fut in futures:
+            scriptFile, outFile, numErrors, timeTaken = fut.result()
+            print("INFO:Batch:{}: Took {:8.2f} seconds, FailedStatements[{}], Output in {}".format(scriptFile, timeTaken, numErrors, outFile))
+            results.append([scriptFile, outFile, numErrors, timeTaken])
+    return results
+
+
+def main(args):
+    """
+    Handle the commandline arguments.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Run .ffe scripts in batch mode")
+    parser.add_argument("scripts", nargs="+", help=".ffe scripts to run")
+    parser.add_argument("--procs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--session", default=None, help="session restored by each worker")
+    parser.add_argument("--prep", default=None, help="script run first, whose session is shared with the workers")
+    parser.add_argument("--outdir", default=None, help="dir to save the outputs of the scripts")
+    parser.add_argument("--loglevel", default=gLogLevel, help="DBUG|INFO|WARN|ERRR")
+    opts = parser.parse_args(args)
+    log.set_level(opts.loglevel)
+    results = run(opts.scripts, opts.session, opts.prep, opts.outdir, opts.procs, logLevel=opts.loglevel)
+    return sum([ 1 for r in results if r[2] != 0 ])
+
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
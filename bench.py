@@ -0,0 +1,381 @@
+# Benchmark the load and op logics using synthetic data
+# HanishKVC, 2021
+# GPL
+
+"""
+Benchmark the core logics (parse, load, fillin4holidays, ops, anal_simple,
+session save/restore), using synthetic data generated locally. So it runs fully
+offline and the numbers can be compared across versions of the program.
+
+The synthetic data is generated in the same format as the one got from the
+remote servers, ie
+    AMFI like NAV text files (data/IMF_YYYYMMDD.csv)
+    NSE like PR bhavcopy zips containing Pd and Bc csv files (data/ISTK_YYYYMMDD.zip)
+with
+    random walk prices,
+    entities starting, stopping and getting renamed within the date range,
+    holidays (in addition to weekends wrt stocks),
+    corporate actions (bonus, split, dividend) wrt some of the stocks.
+
+Usage
+    bench.run()
+    bench.run(numMFs=4000, numStocks=2000, startDate=20150101, endDate=20201231, outFile="/tmp/bench.json")
+    python3 bench.py [outFile.json]
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import zipfile
+import tempfile
+import datetime
+import contextlib
+import subprocess
+import numpy
+import hlpr
+import edb
+import procedb
+import perf
+
+
+gOpsList = [ 'srel=srel(data)', 'roll1Y=roll1Y(data)', 'mas50=mas50(data)', 'mae50=mae50(data)',
+        'reton=reton(data)', 'block1Y=block1Y(data)', 'vol1Y=vol1Y(data)', 'mdd=mdd(data)',
+        'pivotW=pivotW(close)' ]
+gAnalList = [ ['srel', 'srel_retpa'], ['roll1Y', 'roll_avg'], ['mas50', 'normal'] ]
+
+MF_TYPES = [
+        "Open Ended Schemes ( Equity Scheme - Large Cap Fund )",
+        "Open Ended Schemes ( Equity Scheme - Mid Cap Fund )",
+        "Open Ended Schemes ( Equity Scheme - ELSS )",
+        "Open Ended Schemes ( Hybrid Scheme - Balanced Advantage )",
+        "Open Ended Schemes ( Debt Scheme - Liquid Fund )",
+        "Close Ended Schemes ( Equity Scheme - Others )",
+        ]
+MF_HDR = "Scheme Code;Scheme Name;ISIN Div Payout/ISIN Growth;ISIN Div Reinvestment;Net Asset Value;Repurchase Price;Sale Price;Date"
+STK_PDHDR = "MKT,SERIES,SYMBOL,SECURITY,PREV_CL_PR,OPEN_PRICE,HIGH_PRICE,LOW_PRICE,CLOSE_PRICE,NET_TRDVAL,NET_TRDQTY,IND_SEC,CORP_IND,TRADES,HI_52_WK,LO_52_WK"
+STK_BCHDR = "SERIES,SYMBOL,SECURITY,RECORD_DT,BC_STRT_DT,BC_END_DT,EX_DT,ND_STRT_DT,ND_END_DT,PURPOSE"
+STK_CORPACTS = [ "BONUS 1:1", "FV SPLIT RS 10 TO RS 2", "DIVIDEND - RS 2.50 PER SHARE" ]
+STK_INDEXES = 4
+
+
+
+class Timer:
+    """
+    Accumulate the time taken by the different stages of the benchmark.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        time1 = time.time()
+        try:
+            yield
+        finally:
+            time2 = time.time()
+            self.timings[name] = round(time2-time1, 6)
+            print("INFO:Bench:{}: Took {:8.4f} seconds".format(name, time2-time1), file=sys.__stdout__)
+
+
+
+def _dates(startDate, endDate):
+    """
+    Return the list of datetime.date objects wrt the given YYYYMMDD date range.
+    """
+    start, end = edb.proc_date_startend(startDate, endDate)
+    numDays = (end - start).days + 1
+    return [ start + datetime.timedelta(days=i) for i in range(numDays) ]
+
+
+def _holidays(dates, numHolidays, rng):
+    """
+    Select some weekdays as holidays.
+    """
+    weekDays = [ d for d in dates if d.isoweekday() <= 5 ]
+    numHolidays = min(numHolidays, len(weekDays))
+    sel = rng.choice(len(weekDays), numHolidays, replace=False)
+    return set([ weekDays[i] for i in sel ])
+
+
+def _lifespans(numEnts, numDays, rng, lateStartPct=30, earlyStopPct=10):
+    """
+    Entity churn: Some entities start after the begining of the date range and
+    some stop before its end. Returns the start and end (exclusive) day indexes.
+    """
+    starts = numpy.zeros(numEnts, dtype=int)
+    ends = numpy.ones(numEnts, dtype=int)*numDays
+    lateStart = rng.random(numEnts) < (lateStartPct/100)
+    starts[lateStart] = rng.integers(1, max(numDays//2, 2), lateStart.sum())
+    earlyStop = rng.random(numEnts) < (earlyStopPct/100)
+    ends[earlyStop] = rng.integers(max(numDays//2, 2), numDays, earlyStop.sum())
+    return starts, ends
+
+
+def _randomwalk(numEnts, numDays, rng, dailyVol=0.015):
+    """
+    Generate random walk prices (with a small positive drift) wrt the given
+    number of entities and days.
+    """
+    drift = rng.normal(0.0004, 0.0002, (numEnts,1))
+    vol = rng.uniform(0.3, 1.5, (numEnts,1))*dailyVol
+    logRets = rng.normal(0, 1, (numEnts,numDays))*vol + drift
+    startPrices = rng.uniform(10, 1000, (numEnts,1))
+    return startPrices*numpy.exp(numpy.cumsum(logRets, axis=1))
+
+
+def _renames(numEnts, numDays, rng, renamePct=5):
+    """
+    Decide the day index from which some of the entities will get a new name.
+    """
+    renames = numpy.ones(numEnts, dtype=int)*numDays
+    bRename = rng.random(numEnts) < (renamePct/100)
+    renames[bRename] = rng.integers(1, numDays, bRename.sum())
+    return renames
+
+
+def gen_mfs(basePath, dates, numMFs, holidays, rng):
+    """
+    Generate AMFI like NAV text files wrt the given dates.
+    No NAVs are generated wrt weekends and holidays, but the file with the
+    MF type headers is still created, like the AMFI server does.
+    """
+    numDays = len(dates)
+    navs = _randomwalk(numMFs, numDays, rng)
+    starts, ends = _lifespans(numMFs, numDays, rng)
+    renames = _renames(numMFs, numDays, rng)
+    mfTypes = rng.integers(0, len(MF_TYPES), numMFs)
+    plans = rng.integers(0, 4, numMFs)
+    planNames = [ "Direct Plan - Growth", "Regular Plan - Growth", "Direct Plan - Dividend", "Direct Plan - IDCW" ]
+    for d in range(numDays):
+        theDate = dates[d]
+        fName = os.path.join(basePath, time.strftime(edb.india.MFS_FNAMECSV_TMPL, theDate.timetuple()))
+        bData = (theDate.isoweekday() <= 5) and (theDate not in holidays)
+        sDate = theDate.strftime("%d-%b-%Y")
+        lines = [ MF_HDR, "" ]
+        for t in range(len(MF_TYPES)):
+            lines.extend([ MF_TYPES[t], "", "Synthetic Mutual Fund {}".format(t), "" ])
+            if not bData:
+                continue
+            for i in numpy.nonzero((mfTypes == t) & (starts <= d) & (ends > d))[0]:
+                name = "Synthetic {} {}".format(MF_TYPES[t].split('- ')[1][:-2], i)
+                if d >= renames[i]:
+                    name = "{} Renamed".format(name)
+                name = "{} - {}".format(name, planNames[plans[i]])
+                lines.append("{};{};INF{:09};-;{:.4f};{:.4f};{:.4f};{}".format(100000+i, name, i, navs[i,d], navs[i,d], navs[i,d], sDate))
+            lines.append("")
+        f = open(fName, "w")
+        f.write("\n".join(lines))
+        f.close()
+
+
+def gen_stocks(basePath, dates, numStocks, holidays, rng, corpActPct=10):
+    """
+    Generate NSE like PR bhavcopy zip files wrt the given dates, skipping weekends and holidays.
+    Each zip contains the Pd (prices) csv and the Bc (corporate actions) csv.
+    Few index rows are also generated.
+    """
+    numDays = len(dates)
+    closes = _randomwalk(numStocks+STK_INDEXES, numDays, rng)
+    opens = closes*(1 + rng.normal(0, 0.005, closes.shape))
+    highs = numpy.maximum(opens, closes)*(1 + numpy.abs(rng.normal(0, 0.008, closes.shape)))
+    lows = numpy.minimum(opens, closes)*(1 - numpy.abs(rng.normal(0, 0.008, closes.shape)))
+    volumes = rng.integers(1000, 5000000, closes.shape)
+    starts, ends = _lifespans(numStocks, numDays, rng)
+    renames = _renames(numStocks, numDays, rng)
+    bCorpAct = (rng.random(numStocks) < (corpActPct/100)) & (starts == 0) & (ends == numDays)
+    tradeDays = [ d for d in range(numDays) if (dates[d].isoweekday() <= 5) and (dates[d] not in holidays) ]
+    corpActPos = rng.integers(0, len(tradeDays), numStocks)
+    corpActDays = numpy.array(tradeDays)[corpActPos]
+    corpActTypes = rng.integers(0, len(STK_CORPACTS), numStocks)
+    for j, (tName, tFName) in enumerate(edb.india.IndiaSTKDS.listFTypes):
+        fName = os.path.join(basePath, edb.india.IndiaSTKDS.pathFTypesTmpl.format(edb.india.IndiaSTKDS.tag, tFName))
+        f = open(fName, "w")
+        f.write("Company Name,Industry,Symbol,Series,ISIN Code\n")
+        for i in range(j%3, numStocks, len(edb.india.IndiaSTKDS.listFTypes)-j+1):
+            f.write("Synthetic Stock {},SYNTHETIC INDUSTRY {},SYN{:05},EQ,INE{:09}\n".format(i, i%11, i, i))
+        f.close()
+    for p, d in enumerate(tradeDays):
+        theDate = dates[d]
+        fName = os.path.join(basePath, time.strftime(edb.india.STK_FNAMECSV_TMPL, theDate.timetuple()))
+        pdLines = [ STK_PDHDR ]
+        for i in range(STK_INDEXES):
+            r = numStocks + i
+            pdLines.append("Y,,,Synthetic Index {},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},,{},,,,,".format(i, closes[r,d-1], opens[r,d], highs[r,d], lows[r,d],
+                closes[r,d], volumes[r,d]))
+        for i in numpy.nonzero((starts <= d) & (ends > d))[0]:
+            name = "Synthetic Stock {}".format(i)
+            if d >= renames[i]:
+                name = "{} Renamed".format(name)
+            pdLines.append("N,EQ,SYN{:05},{},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{},N,,{},,".format(i, name, closes[i,d-1], opens[i,d], highs[i,d], lows[i,d],
+                closes[i,d], closes[i,d]*volumes[i,d], volumes[i,d], volumes[i,d]//100))
+        bcLines = [ STK_BCHDR ]
+        # Corporate actions are announced few days before their exDate
+        for i in numpy.nonzero(bCorpAct & (corpActDays == d))[0]:
+            exDate = dates[tradeDays[min(p+3, len(tradeDays)-1)]].strftime("%d/%m/%Y")
+            bcLines.append("EQ,SYN{:05},Synthetic Stock {},,,,{},,,{}".format(i, i, exDate, STK_CORPACTS[corpActTypes[i]]))
+        z = zipfile.ZipFile(fName, "w", zipfile.ZIP_DEFLATED)
+        z.writestr(time.strftime("Pd%d%m%y.csv", theDate.timetuple()), "\n".join(pdLines))
+        z.writestr(time.strftime("Bc%d%m%y.csv", theDate.timetuple()), "\n".join(bcLines))
+        z.close()
+
+
+def generate(basePath, startDate, endDate, numMFs, numStocks, numHolidays=12, seed=2021):
+    """
+    Generate the synthetic MF and Stock data files into basePath.
+    """
+    rng = numpy.random.default_rng(seed)
+    for sDir in [ basePath, os.path.join(basePath, "data"), os.path.join(basePath, "types") ]:
+        os.makedirs(sDir, exist_ok=True)
+    dates = _dates(startDate, endDate)
+    holidays = _holidays(dates, numHolidays, rng)
+    f = open(os.path.join(basePath, edb.india.IndiaSTKDS.holiTmpl.format(edb.india.IndiaSTKDS.tag)), "w")
+    f.write("# Synthetic holidays\n")
+    for d in sorted(holidays):
+        f.write("{}\n".format(hlpr.date2dateint(d)))
+    f.close()
+    gen_mfs(basePath, dates, numMFs, holidays, rng)
+    gen_stocks(basePath, dates, numStocks, holidays, rng)
+
+
+def _versioninfo():
+    """
+    Identify the version of the program being benchmarked.
+    """
+    info = { 'python': sys.version.split()[0], 'numpy': numpy.__version__ }
+    try:
+        srcPath = os.path.dirname(os.path.abspath(__file__))
+        info['git'] = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=srcPath,
+                stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        info['git'] = None
+    return info
+
+
+def _bench(timer, basePath, startDate, endDate, opsList, analList):
+    """
+    The stages of the benchmark.
+    """
+    edb.gDS = []
+    edb.setup(basePath)
+    opts = { 'ForceLocal': True }
+    with timer.stage("parse"):
+        edb.fetch_data(startDate, endDate, opts)
+    with timer.stage("load_data"):
+        edb.load_data(startDate, endDate)
+    with timer.stage("load_data_cached"):
+        edb.load_data(startDate, endDate)
+    with timer.stage("fillin4holidays"):
+        edb.fillin4holidays()
+    with timer.stage("handle_corpacts"):
+        edb.gEntDB.handle_corpacts()
+    for op in opsList:
+        with timer.stage("ops:{}".format(op)):
+            procedb.ops([op])
+    with timer.stage("ops:all"):
+        procedb.ops(opsList)
+    for dataSrc, analType in analList:
+        with timer.stage("anal_simple:{}:{}".format(dataSrc, analType)):
+            procedb.anal_simple(dataSrc, analType, 'top')
+    with timer.stage("session_save"):
+        edb.session_save("bench")
+    with timer.stage("session_restore"):
+        edb.session_restore("bench")
+    with timer.stage("session_restore_access"):
+        for key in list(edb.gEntDB.data.keys()):
+            value = edb.gEntDB.data[key]
+            if isinstance(value, numpy.ndarray) and (value.dtype.kind in 'iuf'):
+                numpy.sum(value)
+    return { 'numEnts': int(edb.gEntDB.nxtEntIndex), 'numDates': int(edb.gEntDB.nxtDateIndex), 'numDataKeys': len(edb.gEntDB.data) }
+
+
+def run(numMFs=2000, numStocks=1000, startDate=20180101, endDate=20201231, opsList=None, analList=None,
+        outFile=None, basePath=None, seed=2021, bQuiet=True, bKeep=False):
+    """
+    Run the benchmark and return the results as a dictionary, which is also
+    saved as json into outFile, if specified.
+
+    basePath: The dir in which the synthetic data is generated. If not specified a
+        temp dir is created, which is removed at the end, unless bKeep is set.
+    bQuiet: If set, the normal messages printed by the logics being benchmarked are
+        suppressed.
+
+    NOTE: The global state of edb (gEntDB, gDS, gBasePath) is restored at the end,
+    so that one can run this from within a normal session.
+    """
+    if opsList == None:
+        opsList = gOpsList
+    if analList == None:
+        analList = gAnalList
+    bTempBase = (basePath == None)
+    if bTempBase:
+        basePath = tempfile.mkdtemp(prefix="ffebench.")
+    basePath = os.path.expanduser(basePath)
+    savedEnv = os.environ.get('FINFOOLSERRAND_BASE', None)
+    savedEDB = (edb.gEntDB, edb.gDS, edb.gBasePath, edb.gDSBasePath)
+    bPerfEnabled = perf.gbEnabled
+    os.environ['FINFOOLSERRAND_BASE'] = basePath
+    timer = Timer()
+    results = { 'version': _versioninfo(), 'when': time.strftime("%Y%m%d%H%M%S"),
+            'params': { 'numMFs': numMFs, 'numStocks': numStocks, 'startDate': startDate, 'endDate': endDate,
+                'seed': seed, 'opsList': opsList, 'cpus': os.cpu_count() },
+            'timings': timer.timings }
+    try:
+        with timer.stage("generate"):
+            generate(basePath, startDate, endDate, numMFs, numStocks, seed=seed)
+        if bQuiet:
+            fOut = open(os.devnull, "w")
+        else:
+            fOut = sys.stdout
+        with contextlib.redirect_stdout(fOut):
+            perf.reset()
+            perf.enable()
+            results['sizes'] = _bench(timer, basePath, startDate, endDate, opsList, analList)
+            results['stages'] = perf.stats()
+        if bQuiet:
+            fOut.close()
+    finally:
+        edb.gEntDB, edb.gDS, edb.gBasePath, edb.gDSBasePath = savedEDB
+        perf.enable(bPerfEnabled)
+        if savedEnv == None:
+            os.environ.pop('FINFOOLSERRAND_BASE', None)
+        else:
+            os.environ['FINFOOLSERRAND_BASE'] = savedEnv
+        if bTempBase and not bKeep:
+            shutil.rmtree(basePath, ignore_errors=True)
+    if outFile != None:
+        f = open(os.path.expanduser(outFile), "w")
+        json.dump(results, f, indent=2)
+        f.close()
+        print("INFO:Bench:Results saved to {}".format(outFile))
+    return results
+
+
+def compare(oldFile, newFile):
+    """
+    Compare the timings in two benchmark result json files.
+    """
+    f = open(os.path.expanduser(oldFile))
+    old = json.load(f)
+    f.close()
+    f = open(os.path.expanduser(newFile))
+    new = json.load(f)
+    f.close()
+    print("{:40} {:>10} {:>10} {:>8}".format("Stage", "Old", "New", "Ratio"))
+    for stage in new['timings']:
+        tOld = old['timings'].get(stage, numpy.nan)
+        tNew = new['timings'][stage]
+        print("{:40} {:10.4f} {:10.4f} {:8.2f}".format(stage[:40], tOld, tNew, tNew/tOld if tOld > 0 else numpy.nan))
+
+
+
+if __name__ == "__main__":
+    outFile = None
+    if len(sys.argv) > 1:
+        outFile = sys.argv[1]
+    results = run(outFile=outFile)
+    if outFile == None:
+        print(json.dumps(results, indent=2))
@@ -56,3 +56,42 @@ def below_ndays(dataKey='close', dataIndex=-1, cmpKey='low', cmpStartDateIndex=-
     return tEntities
 
 
+
+
+def pivot_cross(ppKey='pp', level='R1', bAbove=True, dataKey='close', startDateIndex=-14, endDateIndex=-1, entDB=None):
+    """
+    Find entities whose specified attribute's value crossed the given pivot level,
+    on any date within the given date range.
+
+    ppKey: the base key of the pivot level series generated by the pivot[D|W|M] op.
+    level: one of S2, S1, P, R1 or R2.
+    bAbove: If True, look for crossing from below to above the level, else look for
+        crossing from above to below the level.
+
+    The default argument values are setup to find entities whose close crossed above
+    the daily R1 pivot level, over the last 2 weeks. To find entities whose close
+    crossed below S1, call with level='S1', bAbove=False.
+
+    Returns a list of (entCode, entName, lastCrossDate) wrt the matching entities.
+    """
+    entDB = _entDB(entDB)
+    tLevel = entDB.data["{}.{}".format(ppKey, level)]
+    tData = entDB.data[dataKey]
+    startDateIndex, endDateIndex = numpy.arange(entDB.nxtDateIndex)[[startDateIndex, endDateIndex]]
+    startDateIndex = max(startDateIndex, 1)
+    tCur = tData[:,startDateIndex:endDateIndex+1]
+    tCurLevel = tLevel[:,startDateIndex:endDateIndex+1]
+    tPrev = tData[:,startDateIndex-1:endDateIndex]
+    tPrevLevel = tLevel[:,startDateIndex-1:endDateIndex]
+    with numpy.errstate(invalid='ignore'):
+        if bAbove:
+            tCross = (tPrev <= tPrevLevel) & (tCur > tCurLevel)
+        else:
+            tCross = (tPrev >= tPrevLevel) & (tCur < tCurLevel)
+    tAny = numpy.any(tCross, axis=1)
+    tLastCross = tCross.shape[1] - 1 - numpy.argmax(tCross[:,::-1], axis=1)
+    tDates = entDB.dates[startDateIndex + tLastCross[tAny]].astype(int).tolist()
+    tNames = entDB.meta['name'][tAny]
+    tCodes = entDB.meta['codeL'][tAny]
+    tEntities = list(zip(tCodes, tNames, tDates))
+    return tEntities
@@ -9,13 +9,17 @@ import enum
 import datetime
 import hlpr
 import todayfile
+import perf
+import log
 
 
 # The Enums used to identify the type of data source
 # It could be a Stocks related data source or
 # It could be a Mutual funds related data source
+# It could be a Index related data source
+# It could be a World (indexes/commodities) related data source
 # or Either of them.
-DSType = enum.Enum('DSType', 'Any MF Stock')
+DSType = enum.Enum('DSType', 'Any MF Stock Index World')
 
 # Enable this to ensure that weekends and holidays
 # are skipped from the entities db.
@@ -49,6 +53,13 @@ class DataSrc:
         _valid_remotefile
         _parse_file
         _valid_picklefile [This is optional]
+
+    A data source whose remote server provides data for a block of dates (say a month)
+    in a single file, can set bDateBlocks and provide fetch4daterange and load4daterange,
+    instead of working with a file per date. Such data sources are called once wrt the
+    full date range, after the other data sources have been handled date by date.
+    The blocks (ex: months or series) for which data is missing are added to listNoDataBlocks,
+    and are reported in terms of noDataBlockUnit.
     """
 
     urlTmpl = None
@@ -62,6 +73,8 @@ class DataSrc:
     bSkipWeekEnds = False
     bSkipToday = True
     earliestDate = 0
+    bDateBlocks = False
+    noDataBlockUnit = "blocks"
 
 
     def _load_holidays(self, fPath):
@@ -89,7 +102,7 @@ class DataSrc:
     def _prefix_path(self, basePath, thePath, theMsg=""):
         if (thePath != None) and (basePath != None):
             thePath = os.path.expanduser(os.path.join(basePath, thePath))
-        print("INFO:{}:{}:{}".format(self.tag, theMsg, thePath))
+        log.dbug(self.tag, "{}:{}", theMsg, thePath)
         return thePath
 
 
@@ -116,7 +129,10 @@ class DataSrc:
         self.holiTmpl = self.holiTmpl.format(self.tag)
         self.holiTmpl = self._prefix_path(basePath, self.holiTmpl, "holiTmpl")
         self.listNoDataDates = []
+        self.listNoDataBlocks = []
         self._load_holidays(self.holiTmpl)
+        self.nameDictPath = self._prefix_path(basePath, "{}.names".format(self.tag), "nameDictPath")
+        self.nameDict = todayfile.NameDict(self.nameDictPath)
 
 
     def _valid_remotefile(self, fName):
@@ -138,7 +154,7 @@ class DataSrc:
         try:
             bOk = self._valid_remotefile(fName)
         except:
-            print("ERRR:{}:ValidRemoteFile:{}".format(self.tag, sys.exc_info()))
+            log.agg("{}:ValidRemoteFile".format(self.tag), fName, "{}".format(sys.exc_info()), log.ERRR)
             bOk = False
         return bOk
 
@@ -149,7 +165,7 @@ class DataSrc:
         In case if its invalid, remove the file.
         """
         if not self.valid_remotefile(fName):
-            print(errMsg)
+            log.agg("{}:InvalidFile".format(self.tag), fName, errMsg, log.ERRR)
             try:
                 os.remove(fName)
             except FileNotFoundError:
@@ -162,7 +178,7 @@ class DataSrc:
         """
         print(url, fName)
         hlpr.wget_better(url, fName)
-        errMsg = "ERRR:{}:_FetchRemote:[{}] not a valid file, removing it".format(self.tag, fName)
+        errMsg = "_FetchRemote:[{}] not a valid file, removing it".format(fName)
         self.remove_if_invalid(fName, errMsg)
 
 
@@ -177,17 +193,16 @@ class DataSrc:
 
     def _valid_picklefile(self, fName):
         """
-        Verify that the passed local file is a pickle file containing potentially
-        valid data in it.
+        Verify that the passed local file is a TodayFrame npz or pickle file
+        containing potentially valid data in it.
         NOTE: Child classes can optionally provide a better implementation of this.
-        Returns: bValid(OrNot), bUpToDate, todayDict
-        """
-        if hlpr.pickle_ok(fName, 64):
-            bOk, today, temp = hlpr.load_pickle(fName)
-            if bOk:
-                bMarker, bUpToDate = todayfile.valid_today(today)
-                if bMarker:
-                    return True, bUpToDate, today
+        Returns: bValid(OrNot), bUpToDate, today(Dict|Frame)
+        """
+        bOk, today = todayfile.load(fName, self.nameDict)
+        if bOk:
+            bMarker, bUpToDate = todayfile.valid_today(today)
+            if bMarker:
+                return True, bUpToDate, today
         return False, False, None
 
 
@@ -242,17 +257,19 @@ class DataSrc:
             if not bForceLocal:
                 self._fetch_remote(url, fName)
             else:
-                errMsg = "ERRR:{}:Fetch4Date:{}:Available remote file not valid".format(self.tag, fName)
+                errMsg = "Fetch4Date:{}:Available remote file not valid".format(fName)
                 self.remove_if_invalid(fName, errMsg)
             bParseFile=True
         if bParseFile:
             try:
-                today = todayfile.init(dateInt, self.dataKeys)
-                self._parse_file(fName, today)
-                hlpr.save_pickle(fName, today, [], "{}:Fetch4Date".format(self.tag))
+                today = todayfile.init(dateInt, self.dataKeys, self.nameDict)
+                with perf.stage("parse:{}".format(self.tag)) as st:
+                    self._parse_file(fName, today)
+                    if st.bOn:
+                        st.count('ents', todayfile.num_ents(today))
+                todayfile.save(fName, today, "{}:Fetch4Date".format(self.tag))
             except:
-                print("ERRR:{}:Fetch4Date:{}:ForceRemote[{}], ForceLocal[{}]".format(self.tag, fName, bForceRemote, bForceLocal))
-                print(sys.exc_info())
+                log.agg("{}:Fetch4Date".format(self.tag), dateInt, "{}:ForceRemote[{}], ForceLocal[{}]:{}".format(fName, bForceRemote, bForceLocal, sys.exc_info()), log.ERRR)
 
 
     def load4date(self, theDate, entDB, opts):
@@ -274,23 +291,43 @@ class DataSrc:
             return
         fName = time.strftime(self.pathTmpl, theDate.timetuple())
         ok = False
-        for i in range(3):
-            ok, bUpToDate, today = self._valid_picklefile(fName)
-            if ok:
-                break
-            print("WARN:{}:Load4Date:Try={}: No valid data pickle found for {}".format(self.tag, i, fName))
-            if i > 0:
-                optsFD = { 'ForceRemote': True }
-                if opts.get('LoadLocalOnly'):
+        with perf.stage("load4date:{}".format(self.tag)) as st:
+            for i in range(3):
+                ok, bUpToDate, today = self._valid_picklefile(fName)
+                if ok:
                     break
+                log.dbug(self.tag, "Load4Date:Try={}: No valid data pickle found for {}", i, fName)
+                st.count('retries')
+                if i > 0:
+                    optsFD = { 'ForceRemote': True }
+                    if opts.get('LoadLocalOnly'):
+                        break
+                else:
+                    optsFD = { 'ForceLocal': True }
+                self.fetch4date(theDate, optsFD)
+            if ok:
+                todayfile.load2edb(today, entDB, self.loadFilters, self.nameCleanupMap, 'active', self.tag)
             else:
-                optsFD = { 'ForceLocal': True }
-            self.fetch4date(theDate, optsFD)
-        if ok:
-            todayfile.load2edb(today, entDB, self.loadFilters, self.nameCleanupMap, 'active', self.tag)
-        else:
-            self.listNoDataDates.append(dateInt)
-            print("WARN:{}:Load4Date:No data wrt {}, so skipping".format(self.tag, fName))
+                self.listNoDataDates.append(dateInt)
+                st.count('nodata')
+                log.dbug(self.tag, "Load4Date:No data wrt {}, so skipping", fName)
+
+
+    def fetch4daterange(self, startDate, endDate, opts):
+        """
+        Fetch data for the given date range (datetime.date objects) in one go.
+        NOTE: Child classes which set bDateBlocks need to implement this.
+        """
+        raise NotImplementedError
+
+
+    def load4daterange(self, startDate, endDate, entDB, opts):
+        """
+        Load data for the given date range (datetime.date objects) into Entities DB in one go.
+        The dates would have already been added to the Entities DB.
+        NOTE: Child classes which set bDateBlocks need to implement this.
+        """
+        raise NotImplementedError
 
 
     def _ftype_fname(self, theFName):
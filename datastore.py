@@ -0,0 +1,266 @@
+# Save and restore entities db as a snapshot directory
+# HanishKVC, 2021
+# GPL
+
+import os
+import json
+import shutil
+import numpy
+import entities
+
+
+SNAPSHOT_MARKER = "FFESNAPSHOTKVC_V01"
+MANIFEST_FNAME = "manifest.json"
+
+
+class LazyArray:
+    """
+    A placeholder for a numpy array saved in a snapshot, which hasnt been loaded yet.
+    """
+
+    __slots__ = ('fName', 'mmapMode')
+
+    def __init__(self, fName, mmapMode='c'):
+        self.fName = fName
+        self.mmapMode = mmapMode
+
+
+    def load(self):
+        return numpy.load(self.fName, mmap_mode=self.mmapMode, allow_pickle=False)
+
+
+class LazyData(dict):
+    """
+    A dictionary whose values could be LazyArray placeholders, which get loaded
+    (memory mapped by default) only when the corresponding key is accessed.
+    """
+
+    def _resolve(self, key, value):
+        if isinstance(value, LazyArray):
+            value = value.load()
+            dict.__setitem__(self, key, value)
+        return value
+
+
+    def __getitem__(self, key):
+        return self._resolve(key, dict.__getitem__(self, key))
+
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+
+    def pop(self, key, *args):
+        if key not in self:
+            return dict.pop(self, key, *args)
+        value = self[key]
+        dict.__delitem__(self, key)
+        return value
+
+
+    def values(self):
+        return [ self[k] for k in self ]
+
+
+    def items(self):
+        return [ (k, self[k]) for k in self ]
+
+
+    def loaded_keys(self):
+        """
+        Return the list of keys, whose data has been loaded.
+        """
+        return [ k for k in self if not isinstance(dict.__getitem__(self, k), LazyArray) ]
+
+
+
+def _tojson(obj):
+    """
+    Convert obj into json friendly form. Dictionaries are stored as a list of
+    [key, value] pairs, so that non string keys are retained. Numpy scalars
+    and arrays are converted to python equivalents.
+    """
+    if isinstance(obj, dict):
+        return { '__dict__': [ [_tojson(k), _tojson(v)] for k, v in obj.items() ] }
+    if isinstance(obj, tuple):
+        return { '__tuple__': [ _tojson(v) for v in obj ] }
+    if isinstance(obj, set):
+        return { '__set__': [ _tojson(v) for v in obj ] }
+    if isinstance(obj, list):
+        return [ _tojson(v) for v in obj ]
+    if isinstance(obj, numpy.ndarray):
+        return { '__array__': [ _tojson(v) for v in obj.tolist() ], 'dtype': str(obj.dtype) }
+    if isinstance(obj, numpy.generic):
+        return obj.item()
+    return obj
+
+
+def _fromjson(obj):
+    """
+    Reverse of _tojson.
+    """
+    if isinstance(obj, dict):
+        if '__dict__' in obj:
+            return { _hashable(_fromjson(k)): _fromjson(v) for k, v in obj['__dict__'] }
+        if '__tuple__' in obj:
+            return tuple([ _fromjson(v) for v in obj['__tuple__'] ])
+        if '__set__' in obj:
+            return set([ _hashable(_fromjson(v)) for v in obj['__set__'] ])
+        if '__array__' in obj:
+            tList = [ _fromjson(v) for v in obj['__array__'] ]
+            if obj['dtype'] == 'object':
+                tArray = numpy.empty(len(tList), dtype=object)
+                tArray[:] = tList
+                return tArray
+            return numpy.array(tList, dtype=obj['dtype'])
+        return { k: _fromjson(v) for k, v in obj.items() }
+    if isinstance(obj, list):
+        return [ _fromjson(v) for v in obj ]
+    return obj
+
+
+def _hashable(key):
+    if isinstance(key, list):
+        return tuple(key)
+    return key
+
+
+def _save_value(value, dirPath, fBase):
+    """
+    Save the given value into the snapshot directory and return its manifest entry.
+    Numeric numpy arrays are saved as .npy files, while other things are saved
+    inline in the manifest as json.
+    """
+    if isinstance(value, numpy.ndarray) and (value.dtype != object):
+        fName = "{}.npy".format(fBase)
+        numpy.save(os.path.join(dirPath, fName), value, allow_pickle=False)
+        return { 'kind': 'npy', 'file': fName }
+    return { 'kind': 'json', 'value': _tojson(value) }
+
+
+def _restore_value(entry, dirPath, bLazy, mmapMode):
+    if entry['kind'] == 'npy':
+        lazy = LazyArray(os.path.join(dirPath, entry['file']), mmapMode)
+        if bLazy:
+            return lazy
+        return lazy.load()
+    return _fromjson(entry['value'])
+
+
+def save(entDB, dirPath, msgTag="DataStore"):
+    """
+    Save the passed entities db as a snapshot directory at dirPath.
+
+    Each numeric numpy array (data keys, dates, meta arrays) is saved as its own
+    .npy file, while other things are stored as json within the manifest. Data
+    keys which are aliases of other data keys are recorded as such.
+
+    The snapshot is written into a temp directory, which replaces any existing
+    snapshot at dirPath, once its fully written.
+    """
+    print("INFO:{}:Save:{}".format(msgTag, dirPath))
+    tmpPath = "{}.tmp".format(dirPath)
+    if os.path.exists(tmpPath):
+        shutil.rmtree(tmpPath)
+    os.makedirs(tmpPath)
+    manifest = { 'marker': SNAPSHOT_MARKER, 'attrs': {}, 'meta': {}, 'data': {}, 'aliases': {} }
+    for attr, value in vars(entDB).items():
+        if attr in [ 'data', 'meta' ]:
+            continue
+        manifest['attrs'][attr] = _save_value(value, tmpPath, "a.{}".format(attr))
+    for i, key in enumerate(entDB.meta):
+        if key == 'codeD':
+            continue
+        manifest['meta'][key] = _save_value(entDB.meta[key], tmpPath, "m{:04}".format(i))
+    savedIds = {}
+    for i, key in enumerate(entDB.data):
+        value = entDB.data[key]
+        baseKey = savedIds.get(id(value), None)
+        if baseKey != None:
+            manifest['aliases'][key] = baseKey
+            continue
+        manifest['data'][key] = _save_value(value, tmpPath, "d{:04}".format(i))
+        if isinstance(value, numpy.ndarray):
+            savedIds[id(value)] = key
+    f = open(os.path.join(tmpPath, MANIFEST_FNAME), 'w')
+    json.dump(manifest, f)
+    f.close()
+    oldPath = "{}.old".format(dirPath)
+    if os.path.exists(dirPath):
+        os.rename(dirPath, oldPath)
+    os.rename(tmpPath, dirPath)
+    if os.path.exists(oldPath):
+        shutil.rmtree(oldPath)
+
+
+def valid_snapshot(dirPath):
+    """
+    Check if there is a valid snapshot at the given path.
+    """
+    fName = os.path.join(dirPath, MANIFEST_FNAME)
+    if not os.path.exists(fName):
+        return False
+    try:
+        f = open(fName)
+        manifest = json.load(f)
+        f.close()
+    except:
+        return False
+    return manifest.get('marker', None) == SNAPSHOT_MARKER
+
+
+def _select_keys(allKeys, dataKeys):
+    """
+    Select the given dataKeys as well as their meta keys, from allKeys.
+    """
+    selKeys = []
+    for key in allKeys:
+        for dataKey in dataKeys:
+            if (key == dataKey) or key.startswith("{}.".format(dataKey)):
+                selKeys.append(key)
+                break
+    return selKeys
+
+
+def restore(dirPath, dataKeys=None, bLazy=True, mmapMode='c', msgTag="DataStore"):
+    """
+    Restore a entities db from the snapshot directory at dirPath.
+
+    bLazy: If True, the numeric arrays wrt data keys are loaded only when the
+        corresponding data key is accessed for the 1st time.
+    mmapMode: The arrays are memory mapped using this mode. The default of 'c'
+        (copy on write) allows in memory modifications, without affecting the
+        snapshot. Set to None, to load the arrays fully into memory.
+    dataKeys: If a list of data keys is passed, only those data keys (and their
+        meta keys and aliases) are restored.
+    """
+    print("INFO:{}:Restore:{}".format(msgTag, dirPath))
+    f = open(os.path.join(dirPath, MANIFEST_FNAME))
+    manifest = json.load(f)
+    f.close()
+    if manifest.get('marker', None) != SNAPSHOT_MARKER:
+        raise ValueError("DataStore:Restore: Invalid snapshot {}".format(dirPath))
+    entDB = entities.EntitiesDB.__new__(entities.EntitiesDB)
+    for attr, entry in manifest['attrs'].items():
+        setattr(entDB, attr, _restore_value(entry, dirPath, False, mmapMode))
+    entDB.meta = {}
+    for key, entry in manifest['meta'].items():
+        entDB.meta[key] = _restore_value(entry, dirPath, False, mmapMode)
+    entDB.meta['codeD'] = {}
+    for i in range(entDB.nxtEntIndex):
+        entDB.meta['codeD'][entDB.meta['codeL'][i]] = i
+    dataKeysInSS = list(manifest['data'].keys())
+    if dataKeys != None:
+        dataKeys = dataKeys + [ manifest['aliases'][k] for k in dataKeys if k in manifest['aliases'] ]
+        dataKeysInSS = _select_keys(dataKeysInSS, dataKeys)
+    entDB.data = LazyData()
+    for key in dataKeysInSS:
+        dict.__setitem__(entDB.data, key, _restore_value(manifest['data'][key], dirPath, bLazy, mmapMode))
+    # Aliases share the same array object as their base key
+    for key, baseKey in manifest['aliases'].items():
+        if baseKey in entDB.data:
+            value = entDB.data[baseKey]
+            entDB.data[key] = value
+    return entDB
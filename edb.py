@@ -15,9 +15,14 @@ import datetime
 import hlpr
 import datasrc
 import india
+import indexes
+import world
 import entities
+import datastore
 import loadfilters
 import enttypes as et
+import perf
+import log
 
 
 gbDEBUG = False
@@ -31,6 +36,8 @@ gbNotBeyondToday = True
 gbSkipTodayAlso = True
 # Should proc_days ignore weekends.
 gbSkipWeekends = False
+# If set, the entities db data arrays are memory mapped from files in this path
+gMemmapStorePath = None
 
 #
 # Misc
@@ -45,6 +52,9 @@ gDataKeys = ['open', 'high', 'low', 'data', 'volume']
 gRootDataKey = 'data'
 gDataAliases = { gRootDataKey: [ 'nav', 'close' ] }
 gDS = []
+gDSBasePath = None
+# If set, the data sources are created only when they are required 1st time
+gbDeferDS = True
 gBasePath = "./ffe.data/"
 
 
@@ -58,12 +68,33 @@ def setup_gentdb(startDate=-1, endDate=-1):
     """
     global gEntDB
     numDates = ((int(str(endDate)[:4]) - int(str(startDate)[:4]))+2)*365
-    gEntDB = entities.EntitiesDB(gDataKeys, gDataAliases, 8192*4, numDates, gbSkipWeekends)
+    gEntDB = entities.EntitiesDB(gDataKeys, gDataAliases, 8192*4, numDates, gbSkipWeekends, gMemmapStorePath)
 
 
 def setup_modules(basePath):
-    gDS.append(india.IndiaMFDS(basePath))
-    gDS.append(india.IndiaSTKDS(basePath))
+    """
+    Setup the data sources wrt the given basePath. If gbDeferDS is set, the data
+    sources (and inturn their holiday lists, name dicts, ...) are created only
+    when they are required 1st time.
+    """
+    global gDSBasePath
+    gDSBasePath = basePath
+    gDS.clear()
+    if not gbDeferDS:
+        datasrcs()
+
+
+def datasrcs():
+    """
+    Return the list of data sources, creating them if not yet done.
+    """
+    if (len(gDS) == 0) and (gDSBasePath != None):
+        gDS.append(india.IndiaMFDS(gDSBasePath))
+        gDS.append(india.IndiaSTKDS(gDSBasePath))
+        gDS.append(indexes.BSEIndexDS(gDSBasePath))
+        gDS.append(world.WorldDS(gDSBasePath))
+        loadfilters.list()
+    return gDS
 
 
 def setup(basePath):
@@ -71,7 +102,6 @@ def setup(basePath):
     gBasePath = basePath
     setup_gentdb()
     setup_modules(basePath)
-    loadfilters.list()
 
 
 def skip_weekends(bSkipWeekends=True):
@@ -83,13 +113,30 @@ def skip_weekends(bSkipWeekends=True):
     return gbSkipWeekends
 
 
+def use_memmap(bEnable=True, storePath=None):
+    """
+    Enable or disable the memory mapped backend wrt the entities db created by
+    later loads. With it, the data arrays (raw as well as derived) are stored in
+    files within storePath (defaults to <basePath>/mmstore), and inturn only the
+    parts of them currently in use needs to be in RAM.
+    """
+    global gMemmapStorePath
+    if bEnable:
+        if storePath == None:
+            storePath = os.path.join(gBasePath, "mmstore")
+        gMemmapStorePath = os.path.expanduser(storePath)
+    else:
+        gMemmapStorePath = None
+    return gMemmapStorePath
+
+
 def proc_days(startDate, endDate, handle_date_func, opts=None, bNotBeyondToday=True, bDebug=False):
     """
     Call the passed function for each date with the given start and end range.
     startDate and endDate should be datetime.date objects.
     A datetime.date object will be passed to the handle_date_func.
     """
-    print("INFO:proc_days:from {} to {}".format(startDate, endDate))
+    log.info("proc_days", "from {} to {}", startDate, endDate)
     if bNotBeyondToday:
         endDate = hlpr.not_beyond_today(endDate, gbSkipTodayAlso)
     oneDay = datetime.timedelta(days=1)
@@ -101,9 +148,9 @@ def proc_days(startDate, endDate, handle_date_func, opts=None, bNotBeyondToday=T
             continue
         if prevMonth != curDate.month:
             prevMonth = curDate.month
-            print("INFO:proc_days:handlingmonth:{}".format(curDate))
+            log.dbug("proc_days", "handlingmonth:{}", curDate)
         if bDebug:
-            print("INFO:proc_days:handlingdate:{}".format(curDate))
+            log.info("proc_days", "handlingdate:{}", curDate)
         try:
             handle_date_func(curDate, opts)
         except:
@@ -119,7 +166,9 @@ def fetch4date(curDate, opts):
     One can call this directly by passing the year, month and date one is interested in
     as a datetime.date object.
     """
-    for ds in gDS:
+    for ds in datasrcs():
+        if ds.bDateBlocks:
+            continue
         if 'fetch4date' in dir(ds):
             ds.fetch4date(curDate, opts)
 
@@ -147,6 +196,15 @@ def fetch4daterange(startDate, endDate, opts):
     """
     start, end = proc_date_startend(startDate, endDate)
     proc_days(start, end, fetch4date, opts, gbNotBeyondToday)
+    if gbNotBeyondToday:
+        end = hlpr.not_beyond_today(end, gbSkipTodayAlso)
+    for ds in datasrcs():
+        if ds.bDateBlocks:
+            try:
+                ds.fetch4daterange(start, end, opts)
+            except:
+                traceback.print_exc()
+    log.flush()
 
 
 def fetch_data(startDate, endDate=None, opts={'ForceRemote': True}):
@@ -182,20 +240,49 @@ def load4date(curDate, opts):
     """
     gEntDB.add_date(hlpr.dateint(curDate.year, curDate.month, curDate.day))
     dataSrcTypeReqd = opts['dataSrcType']
-    for ds in gDS:
+    for ds in datasrcs():
         if dataSrcTypeReqd != ds.dataSrcType:
             if dataSrcTypeReqd != datasrc.DSType.Any:
                 #print("WARN:Load4Date:ReqdDSType[{}], so skipping [{}:{}]...".format(dataSrcTypeReqd, ds.tag, ds.dataSrcType))
                 continue
+        if ds.bDateBlocks:
+            continue
         #print("INFO:Load4Date:ReqdDSType[{}], Loading [{}:{}]...".format(dataSrcTypeReqd, ds.tag, ds.dataSrcType))
-        loadFiltersName = opts['loadFiltersName']
-        if loadFiltersName == LOADFILTERSNAME_AUTO:
-            loadFiltersName = ds.tag
-        loadfilters.activate(loadFiltersName)
+        _activate_loadfilters(ds, opts)
         if 'load4date' in dir(ds):
             ds.load4date(curDate, gEntDB, opts)
 
 
+def _activate_loadfilters(ds, opts):
+    """
+    Activate the loadFilters to use wrt the given data source.
+    """
+    loadFiltersName = opts['loadFiltersName']
+    if loadFiltersName == LOADFILTERSNAME_AUTO:
+        loadFiltersName = ds.tag
+    loadfilters.activate(loadFiltersName)
+
+
+def load4daterange_blocks(start, end, opts):
+    """
+    Load data for the given date range (datetime.date objects) wrt the data sources,
+    which work with blocks of dates. The dates should have been already added.
+    """
+    if gbNotBeyondToday:
+        end = hlpr.not_beyond_today(end, gbSkipTodayAlso)
+    dataSrcTypeReqd = opts['dataSrcType']
+    for ds in datasrcs():
+        if (dataSrcTypeReqd != ds.dataSrcType) and (dataSrcTypeReqd != datasrc.DSType.Any):
+            continue
+        if not ds.bDateBlocks:
+            continue
+        _activate_loadfilters(ds, opts)
+        try:
+            ds.load4daterange(start, end, gEntDB, opts)
+        except:
+            traceback.print_exc()
+
+
 def load4daterange(startDate, endDate, opts=None):
     """
     Load data for given date range.
@@ -215,6 +302,7 @@ def load4daterange(startDate, endDate, opts=None):
     except:
         excInfo = sys.exc_info()
         print(excInfo)
+    load4daterange_blocks(start, end, opts)
     fillin4holidays()
 
 
@@ -223,7 +311,7 @@ def load_ftypes(opts):
     Load rarely changing fixed grouping/types if any wrt any of the data sources.
     """
     dataSrcTypeReqd = opts['dataSrcType']
-    for ds in gDS:
+    for ds in datasrcs():
         if dataSrcTypeReqd != ds.dataSrcType:
             if dataSrcTypeReqd != datasrc.DSType.Any:
                 continue
@@ -238,10 +326,12 @@ def load_data(startDate, endDate = None, dataSrcType=datasrc.DSType.Any,
 
     The dates should follow one of these formats YYYY or YYYYMM or YYYYMMDD i.e YYYY[MM[DD]]
 
-    dataSrcType: Could be datasrc.DSType.Any|DSType.MF|DSType.Stock
-        Any  : then both stock or MF data sources are loaded.
+    dataSrcType: Could be datasrc.DSType.Any|DSType.MF|DSType.Stock|DSType.Index|DSType.World
+        Any  : then all of stock, MF, index and world data sources are loaded.
         MF   : Only MF related data sources are loaded.
         Stock: Only Stock related data sources are loaded.
+        Index: Only Index related data sources are loaded.
+        World: Only World indexes/commodities related data sources are loaded.
 
     bClearData if set, resets the gEntDB by calling setup_gentdb.
 
@@ -267,8 +357,9 @@ def load_data(startDate, endDate = None, dataSrcType=datasrc.DSType.Any,
         endDate = startDate
     if bClearData:
         setup_gentdb(startDate, endDate)
-    for ds in gDS:
+    for ds in datasrcs():
         ds.listNoDataDates = []
+        ds.listNoDataBlocks = []
     if opts == None:
         opts = {}
     if 'LoadLocalOnly' not in opts:
@@ -281,9 +372,12 @@ def load_data(startDate, endDate = None, dataSrcType=datasrc.DSType.Any,
     if bOptimizeSize:
         gEntDB.optimise_size(gDataKeys)
     load_ftypes(opts)
-    for ds in gDS:
+    for ds in datasrcs():
         if len(ds.listNoDataDates) > 0:
-            print("WARN:LoadData:{}:Data missing for {}".format(ds.tag, ds.listNoDataDates))
+            log.warn("LoadData", "{}:Data missing for {} dates: {}", ds.tag, len(ds.listNoDataDates), ds.listNoDataDates)
+        if len(ds.listNoDataBlocks) > 0:
+            log.warn("LoadData", "{}:Data missing for {} {}: {}", ds.tag, len(ds.listNoDataBlocks), ds.noDataBlockUnit, sorted(ds.listNoDataBlocks))
+    log.flush()
 
 
 def load_data_mfs(startDate, endDate = None, dataSrcType=datasrc.DSType.MF,
@@ -329,7 +423,7 @@ def _fillin4holidays(entIndex=-1):
     lastDataIndex = -1
     for c in range(gEntDB.nxtDateIndex):
         if gEntDB.data[gRootDataKey][entIndex,c] == 0:
-            if lastDataIndex > 0:
+            if lastDataIndex >= 0:
                 for key in gDataKeys:
                     gEntDB.data[key][entIndex,c] = gEntDB.data[key][entIndex,lastDataIndex]
         else:
@@ -343,8 +437,12 @@ def fillin4holidays():
     """
     print("INFO:EDB: Fill in Holidays (including Weekends) with prev data ...")
     time1=time.time()
-    for r in range(gEntDB.nxtEntIndex):
-        _fillin4holidays(r)
+    with perf.stage("fillin4holidays") as st:
+        for r in range(gEntDB.nxtEntIndex):
+            _fillin4holidays(r)
+        st.count('ents', gEntDB.nxtEntIndex)
+        if st.bOn:
+            st.bytes(sum([ gEntDB.data[key].nbytes for key in gDataKeys ]))
     time2=time.time()
     print("INFO:EDB:FillIn4Holidays: Took {:8.4f} seconds".format(time2-time1))
 
@@ -434,22 +532,39 @@ def list_enttype_members(entTypeTmpls=et.TYPE_MATCH_ALL, entNameTmpls=et.NAME_MA
     return gEntDB.list_type_members(entTypeTmpls, entNameTmpls)
 
 
+def enttype_mask(entTypeTmpls=et.TYPE_MATCH_ALL, entNameTmpls=et.NAME_MATCH_ALL):
+    """
+    Get a boolean mask over the entities, which selects the matching entities
+    in the matching entTypes. This can be passed as entCodes to anal_simple.
+    """
+    return gEntDB.type_mask(entTypeTmpls, entNameTmpls)
+
+
 def session_save(sessionName):
     """
-    Save current gEntDB.data-gEntDB.meta into a pickle, so that it can be restored fast later.
+    Save current gEntDB.data-gEntDB.meta into a snapshot directory, so that it can be
+    restored fast later.
     """
     fName = os.path.join(gBasePath, "SSN_{}".format(sessionName))
-    hlpr.save_pickle(fName, gEntDB, None, "Data:SessionSave")
+    datastore.save(gEntDB, fName, "Data:SessionSave")
 
 
-def session_restore(sessionName):
+def session_restore(sessionName, dataKeys=None, mmapMode='c'):
     """
-    Restore a previously saved gEntDB.data-gEntDB.meta fast from a pickle.
-    Also setup the modules used by the main logic.
+    Restore a previously saved gEntDB.data-gEntDB.meta fast from a snapshot directory.
+    The data arrays are memory mapped and inturn paged in only when used.
+    dataKeys: If a list of data keys is passed, only those (and their meta keys) are restored.
+    mmapMode: 'c' (the default) allows the restored data to be modified in memory, without
+        affecting the snapshot. 'r' maps the data read only.
+    NOTE: Sessions saved as a pickle by older versions are also supported, but wrt them
+        dataKeys and mmapMode are ignored.
     """
     global gEntDB, gbSkipWeekends
     fName = os.path.join(gBasePath, "SSN_{}".format(sessionName))
-    ok, gEntDB, tIgnore = hlpr.load_pickle(fName)
+    if datastore.valid_snapshot(fName):
+        gEntDB = datastore.restore(fName, dataKeys, mmapMode=mmapMode, msgTag="Data:SessionRestore")
+    else:
+        ok, gEntDB, tIgnore = hlpr.load_pickle(fName)
     gbSkipWeekends = gEntDB.bSkipWeekends
 
 
@@ -9,8 +9,104 @@ import os
 import numpy
 import time
 import traceback
+import tempfile
+import shutil
+import weakref
+import threading
 import hlpr
 import enttypes
+import log
+
+
+
+# Numeric arrays smaller than this are kept in memory, even with memmap backend
+gMemmapMinBytes = 1024*1024
+
+
+class MemmapData(dict):
+    """
+    A data dictionary, which stores each numeric numpy array (atleast gMemmapMinBytes
+    in size) assigned to it, as a numpy.memmap backed by a file in its store directory.
+    So both the raw data keys and the derived data keys generated by ops/procedb/...
+    get spilled to the local disk, while supporting the same data[key][ent, date]
+    indexing. Arrays which are already memory mapped from the store (including views
+    of them like the ones created by optimise_size or aliases) are stored as is.
+
+    A unique sub directory is created within storePath for each instance, and the
+    same is removed, when the instance is no longer in use.
+    """
+
+    def __init__(self, storePath):
+        super().__init__()
+        os.makedirs(storePath, exist_ok=True)
+        self.storePath = tempfile.mkdtemp(prefix="edb.", dir=storePath)
+        self.nxtFileIndex = 0
+        self.lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.storePath, True)
+        print("INFO:Entities:MemmapData:Store:", self.storePath)
+
+
+    def _in_store(self, value):
+        """
+        Check if the given array is memory mapped from a file in this store.
+        """
+        if not isinstance(value, numpy.memmap):
+            return False
+        if value.filename == None:
+            return False
+        return os.path.dirname(value.filename) == self.storePath
+
+
+    def zeros(self, shape, dtype=float):
+        """
+        Create a new zero initialised memmap array within the store.
+        """
+        with self.lock:
+            fName = os.path.join(self.storePath, "{:06}.mm".format(self.nxtFileIndex))
+            self.nxtFileIndex += 1
+        return numpy.memmap(fName, dtype=dtype, mode='w+', shape=tuple(shape))
+
+
+    def _remove_unused(self, value):
+        """
+        Remove the file backing the given array, if no other key uses it.
+        NOTE: Should be called with self.lock held.
+        """
+        if not self._in_store(value):
+            return
+        for other in list(dict.values(self)):
+            if self._in_store(other) and (other.filename == value.filename):
+                return
+        try:
+            os.remove(value.filename)
+        except FileNotFoundError:
+            pass
+
+
+    def __setitem__(self, key, value):
+        if isinstance(value, numpy.ndarray) and (value.dtype != object) \
+                and (value.nbytes >= gMemmapMinBytes) and (not self._in_store(value)):
+            mmValue = self.zeros(value.shape, value.dtype)
+            mmValue[...] = value
+            value = mmValue
+        # The ops may be run in parallel, so serialise the updates and the scan for unused files
+        with self.lock:
+            oldValue = dict.get(self, key, None)
+            dict.__setitem__(self, key, value)
+            if oldValue is not None:
+                self._remove_unused(oldValue)
+
+
+    def __delitem__(self, key):
+        with self.lock:
+            oldValue = dict.__getitem__(self, key)
+            dict.__delitem__(self, key)
+            self._remove_unused(oldValue)
+
+
+    def __reduce__(self):
+        # Save as a normal dictionary, when pickled
+        return (dict, (dict(self),))
 
 
 
@@ -53,15 +149,21 @@ class EntitiesDB:
                 self.data[alias] = self.data[key]
 
 
-    def _init_ents(self, dataKeys, aliases, entCnt, dateCnt):
+    def _init_ents(self, dataKeys, aliases, entCnt, dateCnt, storePath=None):
         """
         Create the members required to handle the data(s) related to the entities.
+        storePath: If not None, the data arrays are memory mapped from files in it.
         """
         self.nxtEntIndex = 0
-        self.data = {}
         self.meta = {}
-        for dataKey in dataKeys:
-            self.data[dataKey] = numpy.zeros([entCnt, dateCnt])
+        if storePath == None:
+            self.data = {}
+            for dataKey in dataKeys:
+                self.data[dataKey] = numpy.zeros([entCnt, dateCnt])
+        else:
+            self.data = MemmapData(storePath)
+            for dataKey in dataKeys:
+                self.data[dataKey] = self.data.zeros([entCnt, dateCnt])
         self._set_aliases(aliases)
         self.meta['name'] = numpy.empty(entCnt, dtype=object)
         self.meta['codeL'] = numpy.empty(entCnt, dtype=object)
@@ -69,9 +171,10 @@ class EntitiesDB:
         self.meta['typeId'] = numpy.empty(entCnt, dtype=object)
         self.meta['firstSeenDI'] = numpy.ones(entCnt, dtype=int)*-1
         self.meta['lastSeenDI'] = numpy.ones(entCnt, dtype=int)*-1
+        self.meta['nameId'] = numpy.ones(entCnt, dtype=int)*-1
 
 
-    def __init__(self, dataKeys, aliases, entCnt, dateCnt, bSkipWeekends=True):
+    def __init__(self, dataKeys, aliases, entCnt, dateCnt, bSkipWeekends=True, storePath=None):
         """
         Initialise a entities object.
 
@@ -88,6 +191,9 @@ class EntitiesDB:
         data in this entities db.
         bSkipWeekends: If true, its assumed that weekends is not
             maintained by this database.
+        storePath: If specified, the data arrays (including derived data added
+            later) are stored as memory mapped files in this directory, so that
+            datasets larger than the RAM can be worked with.
         """
         if type(dataKeys) != list:
             dataKeys = [ dataKeys ]
@@ -97,7 +203,7 @@ class EntitiesDB:
         self._init_types()
         self._init_dates(dateCnt)
         self._init_morecats()
-        self._init_ents(dataKeys, aliases, entCnt, dateCnt)
+        self._init_ents(dataKeys, aliases, entCnt, dateCnt, storePath)
 
 
     def add_type(self, typeName):
@@ -122,13 +228,36 @@ class EntitiesDB:
         return enttypes.list(entTypeTmpls, self)
 
 
-    def list_type_members(self, entTypeTmpls=enttypes.TYPE_MATCH_ALL, entNameTmpls=enttypes.NAME_MATCH_ALL):
+    def list_type_members(self, entTypeTmpls=enttypes.TYPE_MATCH_ALL, entNameTmpls=enttypes.NAME_MATCH_ALL, bPrint=True):
         """
         List matching members in all matching entTypes.
 
         entNameTmpls: If [], matchs all members within each matched entType.
         """
-        return enttypes._members(self, entTypeTmpls, entNameTmpls)
+        return enttypes._members(self, entTypeTmpls, entNameTmpls, bPrint)
+
+
+    def type_indexes(self, entTypeTmpls=enttypes.TYPE_MATCH_ALL, entNameTmpls=enttypes.NAME_MATCH_ALL):
+        """
+        Get the entity indexes of the matching members in all matching entTypes,
+        as a sorted numpy array.
+        """
+        return enttypes._indexes(self, entTypeTmpls, entNameTmpls)
+
+
+    def type_mask(self, entTypeTmpls=enttypes.TYPE_MATCH_ALL, entNameTmpls=enttypes.NAME_MATCH_ALL):
+        """
+        Get a boolean mask over the entities, which selects the matching members
+        in all matching entTypes.
+        """
+        return enttypes._mask(self, entTypeTmpls, entNameTmpls)
+
+
+    def type_matrix(self):
+        """
+        Get the boolean entities x entTypes membership matrix.
+        """
+        return enttypes._matrix(self)
 
 
     def add_date(self, dateInt):
@@ -254,7 +383,7 @@ class EntitiesDB:
         if entName != None:
             nameInRecord = self.meta['name'][entIndex]
             if nameInRecord != entName:
-                print("WARN:Entities:GetEntIndex:NameCheck: Existing [{}] != Passed [{}]".format(nameInRecord, entName))
+                log.agg("Entities:GetEntIndex:NameCheck", entCode, "Existing [{}] != Passed [{}]".format(nameInRecord, entName))
         return entIndex
 
 
@@ -276,7 +405,7 @@ class EntitiesDB:
             entData = { self.dataKeys[0]: entData }
         entIndex = self.get_entindex(entCode, entName, entTypeId)
         if self.nxtDateIndex == 0:
-            input("DBUG:Entities:AddData: Trying to add entity data, before date is specified")
+            hlpr.prompt("DBUG:Entities:AddData: Trying to add entity data, before date is specified")
             return
         if self.meta['firstSeenDI'][entIndex] == -1:
             self.meta['firstSeenDI'][entIndex] = self.nxtDateIndex-1
@@ -285,6 +414,91 @@ class EntitiesDB:
             self.data[dataKey][entIndex,self.nxtDateIndex-1] = entData[dataKey]
 
 
+    def add_data_block(self, entCode, dateIndexes, entData, entName=None, entTypeId=None):
+        """
+        Add the data beloning to a entity, for a block of dates in one go.
+        entCode: Specifies a unique code associated with the entity
+        dateIndexes: The indexes of the dates (already in the db) wrt which data is being added.
+        entData: is a dictionary of arrays of dataValues (matching dateIndexes) with their dataKeys.
+        entName and entTypeId: as in add_data.
+        """
+        entIndex = self.get_entindex(entCode, entName, entTypeId)
+        dateIndexes = numpy.asarray(dateIndexes, dtype=int)
+        if len(dateIndexes) == 0:
+            return entIndex
+        firstDI = dateIndexes.min()
+        lastDI = dateIndexes.max()
+        if (self.meta['firstSeenDI'][entIndex] == -1) or (firstDI < self.meta['firstSeenDI'][entIndex]):
+            self.meta['firstSeenDI'][entIndex] = firstDI
+        if lastDI > self.meta['lastSeenDI'][entIndex]:
+            self.meta['lastSeenDI'][entIndex] = lastDI
+        for dataKey in entData:
+            self.data[dataKey][entIndex, dateIndexes] = entData[dataKey]
+        return entIndex
+
+
+    def _grow_ents(self, entCnt):
+        """
+        Grow the entity related arrays (meta as well as data), if required, so that
+        atleast entCnt entities can be held. Any derived data (with a row per entity)
+        is padded with NaN (or None/empty string) wrt the new rows.
+        """
+        oldCnt = len(self.meta['name'])
+        if entCnt <= oldCnt:
+            return
+        padCnt = entCnt - oldCnt
+        for key, fill in [ ('name', None), ('codeL', None), ('typeId', None), ('firstSeenDI', -1), ('lastSeenDI', -1), ('nameId', -1) ]:
+            value = self.meta[key]
+            self.meta[key] = numpy.concatenate([value, numpy.full(padCnt, fill, dtype=value.dtype)])
+        aliasKeys = []
+        if self.aliases != None:
+            aliasKeys = [ alias for key in self.aliases for alias in self.aliases[key] ]
+        for key in list(self.data.keys()):
+            if key in aliasKeys:
+                continue
+            value = self.data[key]
+            if isinstance(value, list) and (len(value) == oldCnt):
+                value.extend([ '' ]*padCnt)
+                continue
+            if (not isinstance(value, numpy.ndarray)) or (value.ndim == 0) or (value.shape[0] != oldCnt):
+                continue
+            if key in self.dataKeys:
+                fill = 0
+            elif value.dtype == object:
+                fill = None
+            elif value.dtype.kind == 'f':
+                fill = numpy.nan
+            else:
+                fill = 0
+            self.data[key] = numpy.concatenate([value, numpy.full((padCnt,)+value.shape[1:], fill, dtype=value.dtype)])
+        self._set_aliases()
+
+
+    def add_ents_data(self, entCodes, entNames, entTypeId, entData):
+        """
+        Add (or update) a set of entities along with their data for all the dates, in one go.
+        The entity arrays are grown as required, so this can be used even after optimise_size.
+        entCodes, entNames: lists of the codes and names of the entities.
+        entTypeId: the typeId to which these entities belong.
+        entData: is a dictionary of arrays of shape [len(entCodes), nxtDateIndex] with their
+            dataKeys. The 1st of them is used to decide the firstSeen and lastSeen dates.
+        Returns the entity indexes.
+        """
+        numNew = len(set(entCodes) - set(self.meta['codeD']))
+        self._grow_ents(self.nxtEntIndex + numNew)
+        entIndexes = numpy.array([ self.get_entindex(entCode, entName, entTypeId) for entCode, entName in zip(entCodes, entNames) ], dtype=int)
+        for dataKey in entData:
+            self.data[dataKey][entIndexes, :self.nxtDateIndex] = entData[dataKey]
+        tData = numpy.asarray(entData[list(entData.keys())[0]])
+        bHas = numpy.isfinite(tData) & (tData != 0)
+        bAny = numpy.any(bHas, axis=1)
+        firstDI = numpy.argmax(bHas, axis=1)
+        lastDI = tData.shape[1] - 1 - numpy.argmax(bHas[:, ::-1], axis=1)
+        self.meta['firstSeenDI'][entIndexes] = numpy.where(bAny, firstDI, -1)
+        self.meta['lastSeenDI'][entIndexes] = numpy.where(bAny, lastDI, -1)
+        return entIndexes
+
+
     def optimise_size(self, dataKeys):
         """
         Reduce the arrays used to fit the currently loaded set of data.
@@ -292,7 +506,7 @@ class EntitiesDB:
         for dataKey in dataKeys:
             self.data[dataKey] = self.data[dataKey][:self.nxtEntIndex,:self.nxtDateIndex]
         self._set_aliases()
-        for key in [ 'firstSeenDI', 'lastSeenDI', 'name', 'codeL', 'typeId' ]:
+        for key in [ 'firstSeenDI', 'lastSeenDI', 'name', 'codeL', 'typeId', 'nameId' ]:
             self.meta[key] = self.meta[key][:self.nxtEntIndex]
         self.dates = self.dates[:self.nxtDateIndex]
 
@@ -309,7 +523,7 @@ class EntitiesDB:
             for entCode in self.more['corpActD'][theDate]:
                 entIndex = self.meta['codeD'].get(entCode, -1)
                 if entIndex == -1:
-                    input("DBUG:Entities:HandleCA:{}:{} is missing".format(theDate, entCode))
+                    hlpr.prompt("DBUG:Entities:HandleCA:{}:{} is missing".format(theDate, entCode))
                     continue
                 cAdj = 1
                 for ca in self.more['corpActD'][theDate][entCode]:
@@ -317,7 +531,7 @@ class EntitiesDB:
                     if ca == 'D':
                         newAdj = 1-(newAdj/self.data['data'][entIndex,i])
                     cAdj = cAdj * newAdj
-                print("DBUG:Entities:HandleCA:{}:{}:{}".format(theDate, entCode, cAdj))
+                log.dbug("Entities", "HandleCA:{}:{}:{}", theDate, entCode, cAdj)
                 self.data['data'][entIndex, 0:i] *= cAdj
 
 
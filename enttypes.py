@@ -2,6 +2,7 @@
 # HanishKVC, 2021
 # GPL
 
+import numpy
 import hlpr
 
 
@@ -17,6 +18,21 @@ def _init(self):
     self.typesD = {}
     self.typesL = []
     self.typeMembers = {}
+    self.typeMembersS = {}
+    self.typeIndexes = {}
+
+
+def _sets(self):
+    """
+    Return the entity type members as sets (used for fast membership checks),
+    creating them if required (ex: wrt entities dbs saved by older versions).
+    """
+    typeMembersS = getattr(self, 'typeMembersS', None)
+    if (typeMembersS == None) or (len(typeMembersS) != len(self.typeMembers)):
+        typeMembersS = { t: set(m) for t, m in self.typeMembers.items() }
+        self.typeMembersS = typeMembersS
+        self.typeIndexes = {}
+    return typeMembersS
 
 
 def _add(self, typeName):
@@ -29,6 +45,7 @@ def _add(self, typeName):
         self.typesD[typeName]=self.nxtTypeIndex
         self.typesL.append(typeName)
         self.typeMembers[typeName] = []
+        _sets(self)[typeName] = set()
         self.nxtTypeIndex += 1
     return self.typesD[typeName]
 
@@ -53,11 +70,77 @@ def _add_member(self, entTypeId, entCode):
     Add a entity to the members list associated with its entityType.
     """
     entType = self.typesL[entTypeId]
-    if entCode not in self.typeMembers[entType]:
+    typeMembersS = _sets(self)[entType]
+    if entCode not in typeMembersS:
+        typeMembersS.add(entCode)
         self.typeMembers[entType].append(entCode)
+        self.typeIndexes.pop(entType, None)
+
+
+def _type_indexes(self, entType):
+    """
+    Return the entity indexes of the members of the given entType, as a numpy array.
+    The arrays are cached, till new members get added to the entType.
+    """
+    _sets(self)
+    tIndexes = self.typeIndexes.get(entType, None)
+    if tIndexes is None:
+        codeD = self.meta['codeD']
+        members = self.typeMembers[entType]
+        tIndexes = numpy.fromiter((codeD[entCode] for entCode in members), dtype=int, count=len(members))
+        self.typeIndexes[entType] = tIndexes
+    return tIndexes
 
 
-def _members(self, entTypeTmpls, entNameTmpls=NAME_MATCH_ALL):
+def _name_select(self, entIndexes, entNameTmpls):
+    """
+    Filter the given entity indexes, to those whose names match the entNameTmpls.
+    """
+    if type(entNameTmpls) == str:
+        entNameTmpls = [ entNameTmpls ]
+    if len(entNameTmpls) == 0:
+        return entIndexes
+    bSelect = numpy.zeros(len(entIndexes), dtype=bool)
+    for i, entIndex in enumerate(entIndexes):
+        fm,pm = hlpr.matches_templates(self.meta['name'][entIndex], entNameTmpls)
+        bSelect[i] = (len(fm) > 0)
+    return entIndexes[bSelect]
+
+
+def _indexes(self, entTypeTmpls, entNameTmpls=NAME_MATCH_ALL):
+    """
+    Return the sorted unique entity indexes of the members of the matching entTypes,
+    which inturn match entNameTmpls (if any), as a numpy array.
+    """
+    lIndexes = [ _type_indexes(self, entType) for entType in _list(self, entTypeTmpls) ]
+    if len(lIndexes) == 0:
+        return numpy.zeros(0, dtype=int)
+    entIndexes = numpy.unique(numpy.concatenate(lIndexes))
+    return _name_select(self, entIndexes, entNameTmpls)
+
+
+def _mask(self, entTypeTmpls, entNameTmpls=NAME_MATCH_ALL):
+    """
+    Return a boolean mask over the entities in the entities db, which is True wrt the
+    members of the matching entTypes, which inturn match entNameTmpls (if any).
+    """
+    bMask = numpy.zeros(self.nxtEntIndex, dtype=bool)
+    bMask[_indexes(self, entTypeTmpls, entNameTmpls)] = True
+    return bMask
+
+
+def _matrix(self):
+    """
+    Return the boolean membership matrix of shape [entities, entTypes], where
+    [entIndex, typeId] is True if the entity is a member of the entType.
+    """
+    bMatrix = numpy.zeros([self.nxtEntIndex, self.nxtTypeIndex], dtype=bool)
+    for typeId, entType in enumerate(self.typesL):
+        bMatrix[_type_indexes(self, entType), typeId] = True
+    return bMatrix
+
+
+def _members(self, entTypeTmpls, entNameTmpls=NAME_MATCH_ALL, bPrint=True):
     """
     List the members of the specified entity types
 
@@ -69,27 +152,19 @@ def _members(self, entTypeTmpls, entNameTmpls=NAME_MATCH_ALL):
     The entities belonging to the selected entTypes will be filtered
     through the entNameTmpls. If entNameTmpls is empty, then all
     members of the selected entTypes will be selected.
+
+    bPrint: If True, the selected members are printed wrt each entType.
     """
-    if type(entNameTmpls) == str:
-        entNameTmpls = [ entNameTmpls ]
     entTypesList = _list(self, entTypeTmpls)
     entCodes = []
     for entType in entTypesList:
-        print("INFO:EntType: [{}] members:".format(entType))
-        for entCode in self.typeMembers[entType]:
-            entIndex = self.meta['codeD'][entCode]
-            entName = self.meta['name'][entIndex]
-            if len(entNameTmpls) == 0:
-                bEntSelect = True
-            else:
-                fm,pm = hlpr.matches_templates(entName, entNameTmpls)
-                if len(fm) > 0:
-                    bEntSelect = True
-                else:
-                    bEntSelect = False
-            if bEntSelect:
+        entIndexes = _name_select(self, _type_indexes(self, entType), entNameTmpls)
+        codes = self.meta['codeL'][entIndexes].tolist()
+        if bPrint:
+            print("INFO:EntType: [{}] members:".format(entType))
+            for entCode, entName in zip(codes, self.meta['name'][entIndexes]):
                 print("\t{:<20} {}".format(entCode, entName))
-                entCodes.append(entCode)
+        entCodes.extend(codes)
     return entCodes
 
 
@@ -10,6 +10,40 @@ import numpy
 import calendar
 import time
 import datetime
+import importlib
+import perf
+import log
+
+
+class LazyModule:
+    """
+    A placeholder for a module, which gets imported only when one of its
+    attributes is accessed for the 1st time. Used for modules like matplotlib
+    and scipy, which take long to import, and are not needed unless plotting.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+
+    def __getattr__(self, attr):
+        if self._module == None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# If False, prompt wont wait for user input, used when running scripts in batch mode
+gbInteractive = True
+def prompt(msg):
+    """
+    Show the given message and wait for the user to press enter, if running interactively.
+    Else just show the message and continue.
+    """
+    if gbInteractive:
+        return input(msg)
+    print(msg)
+    return ""
 
 
 wgetLastTime = 0
@@ -34,12 +68,17 @@ def wget_better(url, localFName):
         mtimePrev = -1
     cmd = "wget '{}' --continue --timeout=4 --tries=4 --output-document={}".format(url,localFName)
     print(cmd)
-    os.system(cmd)
-    if os.path.exists(localFName):
-        mtimeNow = os.stat(localFName).st_mtime
-        if (mtimePrev != -1) and (mtimeNow != mtimePrev):
-            os.remove(localFName)
-            os.system(cmd)
+    with perf.stage("wget") as st:
+        os.system(cmd)
+        if os.path.exists(localFName):
+            mtimeNow = os.stat(localFName).st_mtime
+            if (mtimePrev != -1) and (mtimeNow != mtimePrev):
+                os.remove(localFName)
+                os.system(cmd)
+        if st.bOn and os.path.exists(localFName):
+            fSize = os.stat(localFName).st_size
+            st.count('bytes', fSize)
+            st.bytes(fSize)
 
 
 def matches_templates(theString, matchTemplates, fullMatch=False, partialTokens=False, ignoreCase=True):
@@ -227,6 +266,26 @@ def datestr2dateint(sDate):
     return iDate
 
 
+def dateints2periodids(dateInts, period='W'):
+    """
+    Map a array of date ints (YYYYMMDD) to calendar period ids, such that all dates
+    belonging to the same calendar period get the same id.
+    period: 'D' for day, 'W' for week (Monday to Sunday) and 'M' for month.
+    """
+    dateInts = numpy.asarray(dateInts).astype(int)
+    y = dateInts//10000
+    m = (dateInts//100)%100
+    d = dateInts%100
+    if period == 'M':
+        return y*12 + m
+    days = ((y-1970)*12 + m-1).astype('datetime64[M]').astype('datetime64[D]') + (d-1)
+    days = days.astype(int)
+    if period == 'D':
+        return days
+    # 1970-01-01 was a Thursday, so shift by 3 days to start the weeks on Monday
+    return (days+3)//7
+
+
 def not_beyond_today(date, bSkipTodayAlso=True):
     """
     If passed date is beyond today, then return today, else return passed date.
@@ -287,14 +346,14 @@ def pickle_ok(fName, minSize=16e3):
             f.close()
             if pickleVer == gPICKLEVER:
                 return True
-    print("WARN:pickle_ok:Failed for", fName)
+    log.dbug("pickle_ok", "Failed for {}", fName)
     return False
 
 
 gPICKLEVER="ffe.hkvc.v01"
 def save_pickle(fName, data, meta, msgTag='SavePickle'):
     fName = "{}.pickle".format(fName)
-    print("INFO:{}:SavePickle:{}".format(msgTag, fName))
+    log.dbug(msgTag, "SavePickle:{}", fName)
     f = open(fName, 'wb+')
     pickle.dump(gPICKLEVER, f)
     pickle.dump(data, f)
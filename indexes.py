@@ -1,25 +1,26 @@
 # Module to help work with Indexes
 # HanishKVC, 2021
+# GPL
 
 import os
-import calendar
 import sys
-import datetime
-import hlpr
-import enttypes
 import time
+import calendar
+import zipfile
+import numpy
+import hlpr
+import datasrc
+import todayfile
+import loadfilters
+import perf
+import log
 
 
-ENTTYPE='Indexes'
-ENTTYPEID=99
-ENTNAME='BSE Index Sensex'
-ENTCODE=999901
-gData = None
-gMeta = None
+ENTTYPE='BSE Index'
 #
 # Fetching and Saving related
 #
-FNAMECSV_TMPL = "data/INDEX_{}_{}_{:04}{:02}.csv"
+INDEX_FNAMECSV_TMPL = "data/INDEX_{}_{}_%Y%m.csv"
 ## Index historic data
 #INDEX_BSESENSEX_URL = "https://api.bseindia.com/BseIndiaAPI/api/ProduceCSVForDate/w?strIndex=SENSEX&dtFromDate=01/01/2011&dtToDate=05/03/2021"
 INDEX_BSE_BASEURL = "https://api.bseindia.com/BseIndiaAPI/api/ProduceCSVForDate/w?strIndex={}&dtFromDate={:02}/{:02}/{:04}&dtToDate={:02}/{:02}/{:04}"
@@ -33,206 +34,214 @@ gIndexes = {
     }
 
 
-def setup_paths(basePath):
-    """
-    Setup the basepath for data files, based on path passed by main logic
-    """
-    global FNAMECSV_TMPL
-    FNAMECSV_TMPL = os.path.expanduser(os.path.join(basePath, FNAMECSV_TMPL))
-    print("INFO:Indexes:setup_paths:", FNAMECSV_TMPL)
 
-
-def setup(basePath, theGData, theGMeta, theCB, theLoadFilters):
-    global gData, gMeta
-    setup_paths(basePath)
-    gData = theGData
-    gMeta = theGMeta
-    theCB['fetch_data'].append(fetch_data)
-    theCB['load_data'].append(load_data)
-    theCB['load4date'].append(load4date)
-    print("INFO:Indexes:Setup done")
-
-
-def parse_csv(sFile):
-    """
-    Parse the specified data csv file and load it into a local data dictionary.
-    """
-    tFile = open(sFile)
-    today = { }
-    for l in tFile:
-        l = l.strip()
-        if l == '':
-            continue
-        if l.startswith('Date,Open'):
-            continue
-        la = l.split(',')
-        sDate = la[0]
-        val = float(la[4])
-        date = time.strptime(sDate, "%d-%B-%Y")
-        date = hlpr.dateint(date.tm_year, date.tm_mon, date.tm_mday)
-        today[date] = val
-    tFile.close()
-    return today
-
-
-def _fetch_datafile(url, fName):
+class BSEIndexDS(datasrc.DataSrc):
     """
-    Fetch give url to specified file, and check its valid.
+    The historic data of the BSE indexes. The remote server provides a csv file wrt
+    each index and month, which inturn contains the data for all the days in it.
+
+    So unlike the other data sources, which work with a file per date, this works
+    with a block of dates (a month) at a time. Each month's csv is parsed once into
+    a compact npz cache (dates and the open/high/low/close columns), and loading a
+    date range reads the month blocks wrt each index and inserts them into the
+    entities db in one go, for all the dates.
     """
-    print(url, fName)
-    hlpr.wget_better(url, fName)
-    f = open(fName)
-    l = f.readline()
-    if not l.startswith("Date,Open,High"):
-        print("ERRR:fetch4date:Not a valid index file, removing it")
-        os.remove(fName)
-    f.close()
 
-
-def fetch_data4month(indexSrc, index, y, m, opts=None):
-    """
-    Fetch data for the given year and month.
-
-    opts: a list of options supported by this logic
-        'ForceLocal': When the logic decides that it has to fetch
-            data file from the internet, it will cross check, if
-            ForceLocal is True. If True, then the logic wont try
-            to redownload
-        'ForceRemote': If true, then the logic will try to fetch
-            the data file again from the internet, irrespective
-            of the local data pickle file is ok or not.
-        'ForcePickle': If true, pickle file is recreated, even if
-            the pickle file appears ok for the simple pickle check
-            logic.
-        NOTE: ForceRemote takes precedence over ForceLocal.
-    """
-    url = gIndexes[indexSrc]['url'].format(index,1,m,y,calendar.monthlen(y,m),m,y)
-    fName = FNAMECSV_TMPL.format(indexSrc,index,y,m)
-    bParseCSV=False
-    if opts == None:
-        opts = {}
-    bForceRemote = opts.get('ForceRemote', False)
-    bForceLocal = opts.get('ForceLocal', False)
-    bForcePickle = opts.get('ForcePickle', False)
-    if bForceRemote:
-        _fetch_datafile(url, fName)
-        bParseCSV=True
-    elif not hlpr.pickle_ok(fName,128):
-        if not bForceLocal:
-            _fetch_datafile(url, fName)
-        bParseCSV=True
-    if bParseCSV or bForcePickle:
-        try:
-            today = parse_csv(fName)
-            hlpr.save_pickle(fName, today, [], "Indexes:fetch_data4month")
-        except:
-            print("ERRR:Indexes:fetch_data4month:{}:ForceRemote[{}], ForceLocal[{}]".format(fName, bForceRemote, bForceLocal))
-            print(sys.exc_info())
-
-
-def fetch_data(startDate, endDate, opts=None):
-    """
-    Fetch data for the given date range.
-
-    opts: a list of options supported by this logic
-        'ForceLocal': When the logic decides that it has to fetch
-            data file from the internet, it will cross check, if
-            ForceLocal is True. If True, then the logic wont try
-            to redownload
-        'ForceRemote': If true, then the logic will try to fetch
-            the data file again from the internet, irrespective
-            of the local data pickle file is ok or not.
-        NOTE: ForceRemote takes precedence over ForceLocal.
-    """
-    sY,sM,sD = hlpr.dateintparts(startDate)
-    eY,eM,eD = hlpr.dateintparts(endDate, False)
-    for y in range(sY, eY+1):
-        for m in range(1, 12+1):
-            if (y == sY) and (m < sM):
+    urlTmpl = INDEX_BSE_BASEURL
+    pathTmpl = INDEX_FNAMECSV_TMPL
+    dataKeys = [ 'open', 'high', 'low', 'close' ]
+    tag = "BSEIndexDS"
+    bSkipWeekEnds = True
+    bDateBlocks = True
+    noDataBlockUnit = "months"
+
+    def __init__(self, basePath="~/", loadFilters=None, nameCleanupMap=None):
+        super().__init__(basePath, loadFilters, nameCleanupMap)
+        self.dataSrcType = datasrc.DSType.Index
+        loadfilters.setup(self.tag, None, None, None, loadFilters)
+
+
+    def _months(self, startDate, endDate):
+        """
+        Return the list of [year, month] which overlap the given date range.
+        startDate and endDate are datetime.date objects.
+        """
+        months = []
+        y, m = startDate.year, startDate.month
+        while (y*100+m) <= (endDate.year*100+endDate.month):
+            if ((y*100+m)*100+31) >= self.earliestDate:
+                months.append([y, m])
+            m += 1
+            if m > 12:
+                y += 1
+                m = 1
+        return months
+
+
+    def _month_paths(self, indexSrc, index, y, m):
+        """
+        Return the url and local file name wrt the given index and month.
+        """
+        url = gIndexes[indexSrc]['url'].format(index, 1, m, y, calendar.monthrange(y,m)[1], m, y)
+        fName = time.strftime(self.pathTmpl.format(indexSrc, index), (y, m, 1, 0, 0, 0, 0, 1, -1))
+        return url, fName
+
+
+    def _valid_remotefile(self, fName):
+        f = open(fName)
+        l = f.readline()
+        f.close()
+        return l.startswith("Date,Open,High")
+
+
+    def _parse_file(self, fName, today=None):
+        """
+        Parse the given month csv file.
+        Returns the dates (as YYYYMMDD ints) and the values (open, high, low, close) wrt each date.
+        """
+        dates = []
+        values = []
+        tFile = open(fName)
+        for l in tFile:
+            l = l.strip()
+            if (l == '') or l.startswith('Date,Open'):
                 continue
-            if (y == eY) and (m > eM):
-                break
-            print("DBUG:Indexes:FetchData:",y,m)
+            la = l.split(',')
+            date = time.strptime(la[0], "%d-%B-%Y")
+            dates.append(hlpr.dateint(date.tm_year, date.tm_mon, date.tm_mday))
+            values.append([ float(v) for v in la[1:5] ])
+        tFile.close()
+        return numpy.array(dates, dtype=int), numpy.array(values, dtype=float).reshape(-1, 4)
+
+
+    def _load_cache(self, fName):
+        """
+        Load the npz cache of a parsed month csv file.
+        Returns bOk, dates, values
+        """
+        cacheName = "{}.npz".format(fName)
+        if not os.path.exists(cacheName):
+            return False, None, None
+        try:
+            with numpy.load(cacheName, allow_pickle=False) as npz:
+                return True, npz['dates'], npz['values']
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            log.warn(self.tag, "LoadCache:Ignoring invalid cache {}:{}", cacheName, e)
+            return False, None, None
+
+
+    def fetch4month(self, indexSrc, index, y, m, opts=None):
+        """
+        Fetch and cache the data for the given index and month.
+
+        opts: ForceLocal and ForceRemote, as in fetch4date.
+        """
+        url, fName = self._month_paths(indexSrc, index, y, m)
+        bParseFile=False
+        if opts == None:
+            opts = {}
+        bForceRemote = opts.get('ForceRemote', False)
+        bForceLocal = opts.get('ForceLocal', False)
+        if bForceRemote:
+            self._fetch_remote(url, fName)
+            bParseFile=True
+        elif not self._load_cache(fName)[0]:
+            if not bForceLocal:
+                self._fetch_remote(url, fName)
+            else:
+                if not os.path.exists(fName):
+                    # Missing months are reported through listNoDataBlocks by the caller
+                    log.dbug(self.tag, "Fetch4Month:ForceLocal:No local file {}", fName)
+                    return
+                errMsg = "Fetch4Month:{}:Available remote file not valid".format(fName)
+                self.remove_if_invalid(fName, errMsg)
+            bParseFile=True
+        if bParseFile:
+            try:
+                with perf.stage("parse:{}".format(self.tag)) as st:
+                    dates, values = self._parse_file(fName)
+                    st.count('dates', len(dates))
+                numpy.savez("{}.npz".format(fName), dates=dates, values=values)
+            except:
+                log.agg("{}:Fetch4Month".format(self.tag), fName, "{}:ForceRemote[{}], ForceLocal[{}]:{}".format(fName, bForceRemote, bForceLocal, sys.exc_info()), log.ERRR)
+
+
+    def fetch4daterange(self, startDate, endDate, opts=None):
+        """
+        Fetch the data wrt all the indexes, for all the months in the given date range.
+        """
+        for y, m in self._months(startDate, endDate):
+            log.dbug(self.tag, "FetchDateRange:{}{:02}", y, m)
             for indexSrc in gIndexes:
                 for index in gIndexes[indexSrc]['id']:
-                    fetch_data4month(indexSrc, index, y, m, opts)
-
-
-
-gToday = {}
-def load_data(startDate, endDate, opts=None):
-    global gToday, ENTTYPEID
-    gToday = {}
-    for indexSrc in gIndexes:
-        gToday[indexSrc] = {}
-        for index in gIndexes[indexSrc]['id']:
-            gToday[indexSrc][index] = {}
-            gToday[indexSrc][index]['lastLoadedYear'] = -1
-            gToday[indexSrc][index]['lastLoadedMonth'] = -1
-    ENTTYPEID = enttypes.add(ENTTYPE)
-
-
-
-def load_data4month(indexSrc, index, y, m, opts):
-    """
-    Parse the specified data csv file and load it into global data dictionary.
-
-    NOTE: It uses the white and black lists wrt MFTypes and MFNames, if any
-    specified in gData, to decide whether a given MF should be added to the
-    dataset or not. User can control this in the normal usage flow by either
-    passing these lists explicitly to load_data and or by setting related
-    global variables before calling load_data.
-    """
-    global gToday
-    if (gToday[indexSrc][index]['lastLoadedYear'] == y) and (gToday[indexSrc][index]['lastLoadedMonth'] == m):
-        return
-    fName = FNAMECSV_TMPL.format(indexSrc, index, y, m)
-    ok = False
-    for i in range(3):
-        ok,gToday[indexSrc][index]['data'],tIgnore = hlpr.load_pickle(fName)
-        if ok:
-            gToday[indexSrc][index]['lastLoadedYear'] = y
-            gToday[indexSrc][index]['lastLoadedMonth'] = m
-            break
-        else:
-            print("WARN:Indexes:load_data4month:Try={}: No data pickle found for {}".format(i, fName))
+                    self.fetch4month(indexSrc, index, y, m, opts)
+
+
+    def _load4month(self, indexSrc, index, y, m, opts):
+        """
+        Get the data wrt the given index and month, from the local cache. If required,
+        it is parsed from the local csv file or else fetched from the remote server
+        (unless LoadLocalOnly).
+        Returns bOk, dates, values
+        """
+        url, fName = self._month_paths(indexSrc, index, y, m)
+        for i in range(3):
+            bOk, dates, values = self._load_cache(fName)
+            if bOk:
+                break
+            log.dbug(self.tag, "Load4Month:Try={}: No valid data cache found for {}", i, fName)
             if i > 0:
-                opts = { 'ForceRemote': True }
+                if opts.get('LoadLocalOnly'):
+                    break
+                optsFD = { 'ForceRemote': True }
             else:
-                opts = { 'ForceLocal': True }
-            fetch_data4month(indexSrc, index, y, m, opts)
-
-
-
-def load4date(y, m, d, opts):
-    """
-    Load data for the given date.
-
-    NOTE: If loading pickled data fails, then it will try to load
-    the data corresponding to given date, from the locally downloaded
-    csv file if possible, else it will try to fetch it freshly from
-    the internet/remote server.
-
-    NOTE: This logic wont fill in prev nav for holidays,
-    you will have to call fillin4holidays explicitly.
-    """
-    iIS = -1
-    for indexSrc in gIndexes:
-        iIS += 1
-        iI = -1
-        for index in gIndexes[indexSrc]['id']:
-            iI += 1
-            name = gIndexes[indexSrc]['name'][iI]
-            load_data4month(indexSrc, index, y,m,opts)
-            if gToday[indexSrc][index] != None:
-                date = hlpr.dateint(y,m,d)
-                try:
-                    val = gToday[indexSrc][index]['data'][date]
-                except:
-                    val = 0
-                entCode = 999900+iIS*10+iI
-                entName = "{} {} {}".format(indexSrc, index, name)
-                hlpr.gdata_add(gData, gMeta, ENTTYPEID, ENTTYPE, entCode, entName, val, date, "Indexes:Load4Date")
-
-
-
+                optsFD = { 'ForceLocal': True }
+            self.fetch4month(indexSrc, index, y, m, optsFD)
+        return bOk, dates, values
+
+
+    def load4daterange(self, startDate, endDate, entDB, opts):
+        """
+        Load the data wrt all the indexes, for the given date range, into the entities db.
+        The dates should have already been added to the entities db. The month blocks wrt
+        each index are mapped to the date indexes of the entities db and inturn inserted
+        in one go.
+
+        NOTE: This logic wont fill in missing data wrt holidays,
+        you will have to call fillin4holidays explicitly.
+        """
+        loadFilters = loadfilters.get('active', self.loadFilters)
+        entTypeId = entDB.add_type(ENTTYPE)
+        if todayfile._skip_enttype(ENTTYPE, loadFilters):
+            return
+        dbDates = entDB.dates[:entDB.nxtDateIndex].astype(int)
+        months = self._months(startDate, endDate)
+        with perf.stage("load4daterange:{}".format(self.tag)) as st:
+            for iIS, indexSrc in enumerate(gIndexes):
+                for iI, index in enumerate(gIndexes[indexSrc]['id']):
+                    entCode = 999900+iIS*10+iI
+                    entName = "{} {} {}".format(indexSrc, index, gIndexes[indexSrc]['name'][iI])
+                    if todayfile._skip_entname(entName, loadFilters):
+                        continue
+                    lDates = []
+                    lValues = []
+                    for y, m in months:
+                        bOk, dates, values = self._load4month(indexSrc, index, y, m, opts)
+                        if not bOk:
+                            if (y*100+m) not in self.listNoDataBlocks:
+                                self.listNoDataBlocks.append(y*100+m)
+                            st.count('nodata')
+                            continue
+                        lDates.append(dates)
+                        lValues.append(values)
+                    if len(lDates) == 0:
+                        continue
+                    dates = numpy.concatenate(lDates)
+                    values = numpy.concatenate(lValues)
+                    # Map the dates to the date indexes of the entities db
+                    dateIndexes = numpy.searchsorted(dbDates, dates)
+                    bValid = dateIndexes < len(dbDates)
+                    bValid[bValid] = dbDates[dateIndexes[bValid]] == dates[bValid]
+                    entData = { k: values[bValid, i] for i, k in enumerate(self.dataKeys) }
+                    entDB.add_data_block(entCode, dateIndexes[bValid], entData, entName, entTypeId)
+                    st.count('dates', numpy.count_nonzero(bValid))
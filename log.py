@@ -0,0 +1,133 @@
+# Logging of messages with levels
+# HanishKVC, 2021
+# GPL
+
+"""
+Print the messages of the program based on their level, so that the chatty
+messages (which can themselves take a noticable amount of time, when working
+with large amounts of data) can be suppressed.
+
+The messages are printed in the usual LEVEL:Tag:Message format, where LEVEL is
+one of DBUG, INFO, WARN, ERRR.
+
+Usage
+    log.set_level('WARN')
+    log.dbug("Ops:PivotPoints", "{} {}", dataDst, dataSrc)
+    log.agg("IndiaMFDS:Load4Date:NoData", dateInt)
+    log.flush()
+
+The logics which would otherwise print a message wrt each day/file/entity, can
+use agg to aggregate them. Only the 1st gAggShow messages wrt a given tag are
+printed, while the rest are counted and inturn shown as a single summary line
+when flush is called. As the aggregation is wrt the tag, include the kind of the
+message in the tag (like Load4Date:NoData above), so that unrelated messages
+dont share (and fill up) the same summary.
+"""
+
+import threading
+
+
+DBUG = 10
+INFO = 20
+WARN = 30
+ERRR = 40
+LEVELS = { 'DBUG': DBUG, 'INFO': INFO, 'WARN': WARN, 'ERRR': ERRR }
+LEVELNAMES = { v: k for k, v in LEVELS.items() }
+
+# Messages below this level are not printed
+gLevel = INFO
+# Number of individual messages shown wrt each aggregated tag, before only counting them
+gAggShow = 2
+# Number of items retained wrt each aggregated tag, for the summary
+gAggItems = 8
+gAgg = {}
+gLock = threading.Lock()
+
+
+
+def set_level(level='INFO'):
+    """
+    Set the minimum level of the messages to be printed.
+    level: could be one of 'DBUG', 'INFO', 'WARN', 'ERRR' (or log.DBUG, ...)
+    """
+    global gLevel
+    if type(level) == str:
+        level = LEVELS[level.upper()[:4].replace('DEBU', 'DBUG').replace('ERRO', 'ERRR')]
+    gLevel = level
+    return LEVELNAMES.get(gLevel, gLevel)
+
+
+def enabled(level):
+    """
+    Check if messages of the given level will be printed.
+    """
+    return level >= gLevel
+
+
+def log(level, tag, msg, *args):
+    """
+    Print the given message, if its level is enabled.
+    The msg is formatted using args only if it is going to be printed.
+    """
+    if level < gLevel:
+        return
+    if len(args) > 0:
+        msg = msg.format(*args)
+    print("{}:{}:{}".format(LEVELNAMES.get(level, level), tag, msg))
+
+
+def dbug(tag, msg, *args):
+    log(DBUG, tag, msg, *args)
+
+
+def info(tag, msg, *args):
+    log(INFO, tag, msg, *args)
+
+
+def warn(tag, msg, *args):
+    log(WARN, tag, msg, *args)
+
+
+def errr(tag, msg, *args):
+    log(ERRR, tag, msg, *args)
+
+
+def agg(tag, item, msg=None, level=WARN):
+    """
+    Aggregate the repeated messages wrt the given tag.
+
+    The 1st gAggShow occurances are printed (msg if given, else the item), after which
+    they are only counted. The summary is printed when flush is called.
+    """
+    with gLock:
+        aggData = gAgg.get(tag, None)
+        if aggData == None:
+            aggData = [level, 0, []]
+            gAgg[tag] = aggData
+        aggData[1] += 1
+        if len(aggData[2]) < gAggItems:
+            aggData[2].append(item)
+        cnt = aggData[1]
+    if cnt <= gAggShow:
+        if msg == None:
+            msg = item
+        log(level, tag, "{}", msg)
+        if cnt == gAggShow:
+            log(level, tag, "Further occurances will be summarised")
+
+
+def flush(tagTmpl=None):
+    """
+    Print a summary line wrt each aggregated tag (or only those starting with tagTmpl),
+    which occured more than gAggShow times, and clear them.
+    """
+    with gLock:
+        tags = [ t for t in gAgg if (tagTmpl == None) or t.startswith(tagTmpl) ]
+        aggs = [ (t, gAgg.pop(t)) for t in tags ]
+    for tag, (level, cnt, items) in aggs:
+        if cnt <= gAggShow:
+            continue
+        sMore = ""
+        if cnt > len(items):
+            sMore = ", ..."
+        log(level, tag, "{} occurances: {}{}", cnt, ", ".join([ str(i) for i in items ]), sMore)
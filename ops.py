@@ -3,16 +3,25 @@
 # GPL
 
 
+import os
 import numpy
+import concurrent.futures
 import edb
 import plot as eplot
 import hlpr
+import log
+import enttypes
 
 
 # By default returns data is stored as percentage and not float
 gbRetDataAsFloat = False
 # The Default MinRetPA assumed/checked wrt
 gfMinRetPA = 4.0
+# The number of entities (rows) processed at a time by the row independent ops.
+# If 0, the full matrix is processed at once.
+gChunkSize = 0
+# The number of threads used to process the chunks in parallel.
+gChunkThreads = os.cpu_count()
 
 
 def _entDB(entDB=None):
@@ -21,6 +30,107 @@ def _entDB(entDB=None):
     return entDB
 
 
+class _RowsData(dict):
+    """
+    The data dictionary of a _RowsView. Keys set by the op are maintained locally,
+    while other keys are got from the parent entities db, limited to the chunk rows.
+    """
+
+    def __init__(self, parentData, rowStart, rowEnd):
+        super().__init__()
+        self.parentData = parentData
+        self.rowStart = rowStart
+        self.rowEnd = rowEnd
+
+
+    def __missing__(self, key):
+        return self.parentData[key][self.rowStart:self.rowEnd]
+
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (key in self.parentData)
+
+
+class _RowsView:
+    """
+    A view of a chunk of rows (entities) of a entities db, which provides the members
+    used by the row independent ops.
+    """
+
+    def __init__(self, entDB, rowStart, rowEnd):
+        self.parent = entDB
+        self.data = _RowsData(entDB.data, rowStart, rowEnd)
+        self.meta = {}
+        for key in entDB.meta:
+            value = entDB.meta[key]
+            if isinstance(value, numpy.ndarray) and (len(value) == entDB.nxtEntIndex):
+                value = value[rowStart:rowEnd]
+            self.meta[key] = value
+        self.nxtEntIndex = rowEnd - rowStart
+        self.nxtDateIndex = entDB.nxtDateIndex
+        self.bSkipWeekends = entDB.bSkipWeekends
+        self.dates = entDB.dates
+        self.datesD = entDB.datesD
+
+
+    def daterange2index(self, startDate, endDate):
+        return self.parent.daterange2index(startDate, endDate)
+
+
+def _chunkable(entDB):
+    """
+    Check if the op should be run chunk wise wrt the given entDB.
+    """
+    if (gChunkSize <= 0) or isinstance(entDB, _RowsView):
+        return False
+    return entDB.nxtEntIndex > gChunkSize
+
+
+def _chunked(opFunc, entDB, *args):
+    """
+    Run the given row independent op, over chunks of gChunkSize entities at a time,
+    using a pool of gChunkThreads threads. The results are bit identical to running
+    the op over the full matrix at once.
+
+    The 1st chunk is run first, to find the data keys generated by the op. Inturn
+    full sized destination arrays are preallocated for them, into which the results
+    of each chunk are copied, as they complete. List data (like MetaLabel) are joined
+    in chunk order, while other data (like MetaType) are taken from the 1st chunk.
+    """
+    eCnt = entDB.nxtEntIndex
+    rowStarts = list(range(0, eCnt, gChunkSize))
+    def run_chunk(rowStart):
+        rowEnd = min(rowStart+gChunkSize, eCnt)
+        view = _RowsView(entDB, rowStart, rowEnd)
+        opFunc(*args, entDB=view)
+        return rowStart, rowEnd, dict(view.data)
+    rowStart, rowEnd, results = run_chunk(rowStarts[0])
+    dsts = {}
+    lists = {}
+    for key, value in results.items():
+        if isinstance(value, numpy.ndarray) and (value.shape[0] == rowEnd-rowStart):
+            dstShape = (eCnt,) + value.shape[1:]
+            if hasattr(entDB.data, 'zeros') and (value.dtype != object):
+                dsts[key] = entDB.data.zeros(dstShape, value.dtype)
+            else:
+                dsts[key] = numpy.empty(dstShape, dtype=value.dtype)
+            dsts[key][rowStart:rowEnd] = value
+        elif isinstance(value, list):
+            lists[key] = [ value ]
+        else:
+            entDB.data[key] = value
+    with concurrent.futures.ThreadPoolExecutor(gChunkThreads) as tpe:
+        for rowStart, rowEnd, chunkResults in tpe.map(run_chunk, rowStarts[1:]):
+            for key in dsts:
+                dsts[key][rowStart:rowEnd] = chunkResults[key]
+            for key in lists:
+                lists[key].append(chunkResults[key])
+    for key in dsts:
+        entDB.data[key] = dsts[key]
+    for key in lists:
+        entDB.data[key] = [ x for chunkList in lists[key] for x in chunkList ]
+
+
 # 1D, 1W, 1M, 3M, 6M, 1Y, 3Y, 5Y, 10Y
 gHistoricGapsWithWeekends = numpy.array([1, 7, 30, 91, 182, 365, 1095, 1825, 3650])
 gHistoricGapsNoWeekends =   numpy.array([1, 5, 21, 65, 130, 260, 782, 1303, 2607])
@@ -68,7 +178,7 @@ def pivotpoints(dataDst, srcKeyNameTmpl="{}", date=-1, dateIndex=None, entDB=Non
     if not dateIndex:
         dummyDateIndex, dateIndex = entDB.daterange2index(date, date)
     highKey, lowKey, closeKey = hlpr.derive_keys(['high', 'low', 'close'], srcKeyNameTmpl)
-    print("DBUG:Ops:PivotPoints:", dataDst, highKey, lowKey, closeKey)
+    log.dbug("Ops:PivotPoints", "{} {} {} {}", dataDst, highKey, lowKey, closeKey)
     high = entDB.data[highKey][:,dateIndex]
     low = entDB.data[lowKey][:,dateIndex]
     close = entDB.data[closeKey][:,dateIndex]
@@ -101,6 +211,53 @@ def plot_pivotpoints(dataKey, entCode, plotRange=10, date=-1, entDB=None, axes=N
         axes.plot([dateIndex-plotRange*2, dateIndex], [p, p], color=c, alpha=0.5, linestyle='dashed')
 
 
+gPivotLevels = ['S2', 'S1', 'P', 'R1', 'R2']
+def pivotpoints_full(dataDst, period='D', srcKeyNameTmpl="{}", entDB=None):
+    """
+    Calculate the pivot points for all the entities, for each date in the entities db,
+    based on the high, low and close of the previous calendar period (D|W|M).
+    The series of each of the pivot levels is stored in <dataDst>.S2, <dataDst>.S1,
+    <dataDst>.P, <dataDst>.R1 and <dataDst>.R2. The dates belonging to the 1st period
+    will have NaN, as there is no previous period wrt them.
+    The pivot points for the period following the last date (i.e calculated using the
+    latest period, which may be partial) is stored at dataDst, as [S2,S1,P,R1,R2] wrt
+    each entity, so that print_pivotpoints and plot_pivotpoints can be used with it.
+    period: 'D' for daily, 'W' for weekly and 'M' for monthly pivot points.
+    srcKeyNameTmpl: Is used to get the high, low and close keys. If the resultant
+        high/low keys are not in the entities db, then close key is used for them.
+    """
+    entDB = _entDB(entDB)
+    highKey, lowKey, closeKey = hlpr.derive_keys(['high', 'low', 'close'], srcKeyNameTmpl)
+    if highKey not in entDB.data:
+        highKey = closeKey
+    if lowKey not in entDB.data:
+        lowKey = closeKey
+    log.dbug("Ops:PivotPointsFull", "{} {} {} {} {}", dataDst, period, highKey, lowKey, closeKey)
+    periodIds = hlpr.dateints2periodids(entDB.dates[:entDB.nxtDateIndex], period)
+    bNewPeriod = numpy.ones(len(periodIds), dtype=bool)
+    bNewPeriod[1:] = periodIds[1:] != periodIds[:-1]
+    pStarts = numpy.nonzero(bNewPeriod)[0]
+    pEnds = numpy.append(pStarts[1:], len(periodIds)) - 1
+    # Get the high, low and close wrt each period
+    tDatas = []
+    for dataKey in [highKey, lowKey, closeKey]:
+        tData = entDB.data[dataKey][:,:entDB.nxtDateIndex]
+        tDatas.append(numpy.where(tData > 0, tData, numpy.nan))
+    with numpy.errstate(invalid='ignore'):
+        high = numpy.fmax.reduceat(tDatas[0], pStarts, axis=1)
+        low = numpy.fmin.reduceat(tDatas[1], pStarts, axis=1)
+    close = tDatas[2][:,pEnds]
+    tP = (high + low + close)/3
+    tLevels = [ tP - (high - low), (tP*2) - high, tP, (tP*2) - low, tP + (high - low) ]
+    # Apply the pivot points of each period to the dates of its next period
+    datePeriods = numpy.cumsum(bNewPeriod) - 1
+    for level, tLevel in zip(gPivotLevels, tLevels):
+        tDst = numpy.ones(tDatas[0].shape)*numpy.nan
+        tDst[:, datePeriods > 0] = tLevel[:, datePeriods[datePeriods > 0]-1]
+        entDB.data["{}.{}".format(dataDst, level)] = tDst
+    entDB.data[dataDst] = numpy.vstack([ x[:,-1] for x in tLevels ]).transpose()
+
+
 def _blocky_view(dataSrcs, modes, blockDays, destKeyNameTmpl, entDB=None):
     """
     Generate data(s) which provide a blocks based view of the passed source data(s).
@@ -176,8 +333,10 @@ def rsi_sma(dataDst, dataSrc, lookBackDays=14, bEMASmooth=False, entDB=None):
     lookBack period.
     NOTE: This uses a simple moving average wrt Gain and Loss.
     """
-    print("DBUG:Ops:MaRSI:", dataDst, dataSrc, lookBackDays)
     entDB = _entDB(entDB)
+    if _chunkable(entDB):
+        return _chunked(rsi_sma, entDB, dataDst, dataSrc, lookBackDays, bEMASmooth)
+    log.dbug("Ops:MaRSI", "{} {} {}", dataDst, dataSrc, lookBackDays)
     tData = entDB.data[dataSrc][:,1:]
     tPrev = entDB.data[dataSrc][:,:-1]
     #tData = ((tData/tPrev)-1)*100
@@ -214,8 +373,10 @@ def rsi_jww(dataDst, dataSrc, lookBackDays=14, entDB=None):
     for the full date range of data available, with the given
     lookBack period.
     """
-    print("DBUG:Ops:JwwRSI:", dataDst, dataSrc, lookBackDays)
     entDB = _entDB(entDB)
+    if _chunkable(entDB):
+        return _chunked(rsi_jww, entDB, dataDst, dataSrc, lookBackDays)
+    log.dbug("Ops:JwwRSI", "{} {} {}", dataDst, dataSrc, lookBackDays)
     tData = entDB.data[dataSrc][:,1:]
     tPrev = entDB.data[dataSrc][:,:-1]
     tData = tData - tPrev
@@ -347,6 +508,8 @@ def movavg(dataDst, dataSrc, maDays, mode='s', entDB=None):
     """
     dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
     entDB = _entDB(entDB)
+    if _chunkable(entDB):
+        return _chunked(movavg, entDB, dataDst, dataSrc, maDays, mode)
     entDB.data[dataDstMT] = 'movavg'
     xMA = _movavg_init(maDays, mode)
     _movavg(xMA, dataDst, dataSrc, entDB)
@@ -373,6 +536,9 @@ def reton(dataDst, dataSrc, retOnDateIndex, retOnType, historicGaps=None, entDB=
     # Get generic things required
     dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
     entDB = _entDB(entDB)
+    # NOTE: retOnType other than absret/retpa depends on the number of entities
+    if _chunkable(entDB) and (retOnType in [ 'absret', 'retpa' ]):
+        return _chunked(reton, entDB, dataDst, dataSrc, retOnDateIndex, retOnType, historicGaps)
     entDB.data[dataDstMT] = 'reton'
     daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
     startDateIndex, endDateIndex = entDB.daterange2index(-1, -1)
@@ -425,6 +591,8 @@ def relto(dataDst, dataSrc, baseDate, entDB=None):
     # Get generic things required
     dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
     entDB = _entDB(entDB)
+    if _chunkable(entDB):
+        return _chunked(relto, entDB, dataDst, dataSrc, baseDate)
     entDB.data[dataDstMT] = 'relto'
     daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
     startDateIndex, endDateIndex = entDB.daterange2index(-1, -1)
@@ -474,6 +642,8 @@ def blockstats(dataDst, dataSrc, blockDays, entDB=None):
     # Get generic things required
     dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
     entDB = _entDB(entDB)
+    if _chunkable(entDB):
+        return _chunked(blockstats, entDB, dataDst, dataSrc, blockDays)
     entDB.data[dataDstMT] = 'blockstats'
     daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
     startDateIndex, endDateIndex = entDB.daterange2index(-1, -1)
@@ -537,6 +707,8 @@ def rollret(dataDst, dataSrc, rollDays, rollType, entDB=None):
     # Get generic things required
     dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
     entDB = _entDB(entDB)
+    if _chunkable(entDB):
+        return _chunked(rollret, entDB, dataDst, dataSrc, rollDays, rollType)
     entDB.data[dataDstMT] = 'rollret'
     daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
     startDateIndex, endDateIndex = entDB.daterange2index(-1, -1)
@@ -550,7 +722,16 @@ def rollret(dataDst, dataSrc, rollDays, rollType, entDB=None):
         tResult = (tResult - 1)*100
     tResult[:,:rollDays] = numpy.nan
     entDB.data[dataDst] = tResult
-    # Create the meta datas
+    _rollret_md(dataDst, tResult, entDB)
+
+
+def _rollret_md(dataDst, tResult, entDB):
+    """
+    Create the rollret MetaData and MetaLabel wrt the given rolling returns.
+    MetaData = Avg, Std, BelowMinRetPA%, MaSharpeMinT, YearsAlive
+    """
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
     entDB.data[dataDstMD] = numpy.zeros([entDB.nxtEntIndex, 5])
     trValid = numpy.ma.masked_invalid(tResult)
     # The Avgs
@@ -581,6 +762,123 @@ def rollret(dataDst, dataSrc, rollDays, rollType, entDB=None):
         entDB.data[dataDstML].append(rollret_md2str(md))
 
 
+gSIPBlockSize = 4*1000*1000
+def _sip_grid(entDB, dayOfMonth):
+    """
+    Get the date indexes of the monthly SIP installment dates, i.e the 1st date in the
+    entities db on or after the given dayOfMonth, wrt each month. Months where there is
+    no such date within a week of it, are skipped.
+    Returns the date indexes and the corresponding dates (as numpy datetime64 days).
+    """
+    dbDates = entDB.dates[:entDB.nxtDateIndex].astype(int)
+    months = numpy.unique(dbDates//100)
+    dbDays = hlpr.dateints2periodids(dbDates, 'D')
+    # Day of month beyond the month length, gets normalised to the next month by datetime64
+    tgtDays = (months//100-1970)*12 + months%100 - 1
+    tgtDays = tgtDays.astype('datetime64[M]').astype('datetime64[D]').astype(int) + dayOfMonth - 1
+    gIdx = numpy.searchsorted(dbDays, tgtDays)
+    bOk = gIdx < len(dbDays)
+    gIdx = gIdx[bOk]
+    bOk = (dbDays[gIdx] - tgtDays[bOk]) < 7
+    gIdx = numpy.unique(gIdx[bOk])
+    return gIdx, dbDays[gIdx]
+
+
+def _sip_months(sDuration):
+    """
+    Get the number of monthly installments in the given SIP duration (?M or ?Y or ?).
+    """
+    sDuration = str(sDuration)
+    if sDuration[-1].upper() == 'Y':
+        return int(sDuration[:-1])*12
+    if sDuration[-1].upper() == 'M':
+        return int(sDuration[:-1])
+    return int(sDuration)
+
+
+def _xirr_fv(tFV, tTimes, numIters=64, fTol=1e-10):
+    """
+    Solve for the annual rate r (returned as x = log(1+r)) wrt many SIPs at once, such that
+    the future value (at the valuation date) of a unit installment paid at each of the given
+    times equals tFV. i.e sum_j exp(x*tTimes[s,j]) = tFV[e,s]
+    tFV: [entities, sips], tTimes: [sips, installments] years from each installment to the
+    valuation date. This uses newton's method, which converges monotonically here, as the
+    function is increasing and convex wrt x.
+    Each element stops being updated once it has converged, so that its result doesnt depend
+    on the other elements in the block (required for chunked evaluation to be identical).
+    """
+    numInst = tTimes.shape[1]
+    tAvgTime = numpy.mean(tTimes, axis=1)
+    with numpy.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        x = numpy.log(tFV/numInst)/tAvgTime
+        x[~numpy.isfinite(x)] = 0
+        bActive = numpy.ones(x.shape, dtype=bool)
+        for i in range(numIters):
+            tExp = numpy.exp(x[:,:,numpy.newaxis]*tTimes[numpy.newaxis,:,:])
+            g = numpy.sum(tExp, axis=2) - tFV
+            gd = numpy.sum(tExp*tTimes[numpy.newaxis,:,:], axis=2)
+            dx = g/gd
+            x = numpy.where(bActive, numpy.clip(x - dx, -20, 20), x)
+            bActive = bActive & (numpy.abs(dx) > fTol)
+            if not numpy.any(bActive):
+                break
+    return x
+
+
+def sip(dataDst, dataSrc, sipDuration, dayOfMonth=1, startEvery=1, entDB=None):
+    """
+    Simulate monthly SIPs of the given duration (number of installments as ?M or ?Y),
+    with installments on the given dayOfMonth (or the next date with data), starting in
+    every startEvery'th month in the date range, wrt all entities, and calculate the XIRR
+    of each of them (as on the date of the installment after the last one).
+
+    As the installment amount is constant, XIRR is independent of it. The final value of
+    all SIPs is got from the cumulative sum of units bought (1/price) over the installment
+    dates, and the XIRRs are solved using newton's method in one go, wrt all the entities
+    and SIP start dates (in blocks of entities, to bound the memory used).
+
+    The XIRR (%) is saved on the valuation date of each SIP (NaN on other dates), so its
+    a rolling SIP XIRR. MetaData is same as rollret (so anal_simple roll_avg works).
+    """
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    if _chunkable(entDB):
+        return _chunked(sip, entDB, dataDst, dataSrc, sipDuration, dayOfMonth, startEvery)
+    entDB.data[dataDstMT] = 'rollret'
+    numInst = _sip_months(sipDuration)
+    gIdx, gDays = _sip_grid(entDB, dayOfMonth)
+    starts = numpy.arange(0, len(gIdx)-numInst, startEvery)
+    tResult = numpy.ones([entDB.nxtEntIndex, entDB.nxtDateIndex])*numpy.nan
+    if len(starts) > 0:
+        # Units bought and bad prices (if any) over the installments and the valuation date
+        tPrices = entDB.data[dataSrc][:, gIdx]
+        bBad = ~(tPrices > 0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            tUnits = numpy.where(bBad, 0, 1/tPrices)
+        cumUnits = numpy.zeros([tPrices.shape[0], tPrices.shape[1]+1])
+        cumUnits[:, 1:] = numpy.cumsum(tUnits, axis=1)
+        cumBad = numpy.zeros(cumUnits.shape, dtype=int)
+        cumBad[:, 1:] = numpy.cumsum(bBad, axis=1)
+        ends = starts + numInst
+        tFV = tPrices[:, ends]*(cumUnits[:, ends] - cumUnits[:, starts])
+        bValid = (cumBad[:, ends+1] - cumBad[:, starts]) == 0
+        tFV[~bValid] = numpy.nan
+        # Years from each installment to the valuation date
+        tTimes = (gDays[ends][:, numpy.newaxis] - gDays[starts[:, numpy.newaxis] + numpy.arange(numInst)])/365
+        tX = numpy.zeros(tFV.shape)
+        rowsBlock = max(gSIPBlockSize//tTimes.size, 1)
+        for r in range(0, tFV.shape[0], rowsBlock):
+            tX[r:r+rowsBlock] = _xirr_fv(tFV[r:r+rowsBlock], tTimes)
+        tX[~bValid] = numpy.nan
+        tXIRR = numpy.exp(tX)
+        if not gbRetDataAsFloat:
+            tXIRR = (tXIRR - 1)*100
+        tResult[:, gIdx[ends]] = tXIRR
+    entDB.data[dataDst] = tResult
+    _rollret_md(dataDst, tResult, entDB)
+
+
 def srel_mdhdr():
     theHdr = "{:>7}% {:>7}%pa {:4}Yrs : {:>10} - {:>10}".format("AbsRet", "Ret", "Aliv", "StartVal", "EndVal")
     return theHdr
@@ -602,6 +900,8 @@ def srel(dataDst, dataSrc, entDB):
     # Get generic things required
     dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
     entDB = _entDB(entDB)
+    if _chunkable(entDB):
+        return _chunked(srel, entDB, dataDst, dataSrc)
     entDB.data[dataDstMT] = 'srel'
     daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
     startDateIndex, endDateIndex = entDB.daterange2index(-1, -1)
@@ -632,12 +932,636 @@ def srel(dataDst, dataSrc, entDB):
         entDB.data[dataDstML].append(srel_md2str(md))
 
 
+def rank_mdhdr():
+    theHdr = "{:>7} {:>7} {:>7} {:>7} {:>7}".format("Last", "Avg", "Std", "Best", "Worst")
+    return theHdr
+
+
+def rank_md2str(entMD):
+    theStr = "{:7.2f} {:7.2f} {:7.2f} {:7.2f} {:7.2f}".format(entMD[0], entMD[1], entMD[2], entMD[3], entMD[4])
+    return theStr
+
+
+def _rank_cols(tData):
+    """
+    Rank the values in each col (i.e wrt each date) of the passed array, across its rows.
+    Returns the 0 based rank (0 for the smallest value) of each of the values, as well as
+    the number of valid values wrt each col.
+    NOTE: Non finite values are not ranked and get NaN as their rank.
+    NOTE: Equal values (ties) share the average of the ranks they span.
+    """
+    tValid = numpy.isfinite(tData)
+    tVals = numpy.where(tValid, tData, numpy.inf)
+    tOrder = numpy.argsort(tVals, axis=0, kind='stable')
+    tSorted = numpy.take_along_axis(tVals, tOrder, axis=0)
+    # Find the runs of equal values in the sorted cols, and their first and last positions
+    nRows = tData.shape[0]
+    tPos = numpy.broadcast_to(numpy.arange(nRows).reshape(-1,1), tData.shape)
+    bStart = numpy.ones(tData.shape, dtype=bool)
+    bStart[1:] = tSorted[1:] != tSorted[:-1]
+    bEnd = numpy.ones(tData.shape, dtype=bool)
+    bEnd[:-1] = bStart[1:]
+    tFirst = numpy.maximum.accumulate(numpy.where(bStart, tPos, 0), axis=0)
+    tLast = numpy.minimum.accumulate(numpy.where(bEnd, tPos, nRows)[::-1], axis=0)[::-1]
+    tRank = numpy.empty(tData.shape)
+    numpy.put_along_axis(tRank, tOrder, (tFirst+tLast)/2, axis=0)
+    tRank[~tValid] = numpy.nan
+    return tRank, numpy.count_nonzero(tValid, axis=0)
+
+
+def rank(dataDst, dataSrc, rankType='pct', groupBy='all', entCodes=None, entDB=None):
+    """
+    Rank the entities wrt each other, for each date in the database, based on their values
+    in the given dataSrc.
+    rankType: Whether to keep the percentile rank or the numeric rank.
+        'pct': 100 for the entity with the highest value and 0 for the lowest one.
+        'num': 1 for the entity with the highest value, 2 for the next and so on.
+    groupBy: Decides the set of entities, within which each entity is ranked.
+        'all': rank across all the entities in the database.
+        'type': rank within the entType to which each entity belongs.
+    entCodes: If a list of entCodes is given, then only these entities are ranked,
+        relative to each other. Other entities will have NaN as their rank.
+    NOTE: The dates before a entity was first seen as well as non finite values are not
+        ranked and get NaN as their rank.
+    """
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    entDB.data[dataDstMT] = 'rank'
+    tSrc = entDB.data[dataSrc].astype(float)
+    eCnt, dCnt = tSrc.shape
+    tAlive = numpy.arange(dCnt).reshape(1,-1) >= entDB.meta['firstSeenDI'][:eCnt].reshape(-1,1)
+    tSrc = numpy.where(tAlive, tSrc, numpy.nan)
+    # Identify the groups of entities
+    if entCodes != None:
+        lGroups = [ numpy.array([entDB.meta['codeD'][entCode] for entCode in entCodes], dtype=int) ]
+    elif groupBy == 'type':
+        typeIds = entDB.meta['typeId'][:eCnt].astype(int)
+        lGroups = [ numpy.nonzero(typeIds == typeId)[0] for typeId in numpy.unique(typeIds) ]
+    else:
+        lGroups = [ numpy.arange(eCnt) ]
+    # Rank within each group
+    tResult = numpy.ones(tSrc.shape)*numpy.nan
+    for rows in lGroups:
+        tRank, tValidCnt = _rank_cols(tSrc[rows])
+        if rankType == 'num':
+            tRank = tValidCnt - tRank
+        else:
+            tRank = (tRank/numpy.maximum(tValidCnt-1, 1))*100
+        tResult[rows] = tRank
+    entDB.data[dataDst] = tResult
+    # Create the meta datas
+    trValid = numpy.ma.masked_invalid(tResult)
+    entDB.data[dataDstMD] = numpy.zeros([eCnt, 5])
+    entDB.data[dataDstMD][:,0] = tResult[:,-1]
+    for i, trStat in enumerate([numpy.mean(trValid, axis=1), numpy.std(trValid, axis=1)]):
+        trStat.set_fill_value(numpy.nan)
+        entDB.data[dataDstMD][:,i+1] = trStat.filled()
+    if rankType == 'num':
+        lBestWorst = [ numpy.min(trValid, axis=1), numpy.max(trValid, axis=1) ]
+    else:
+        lBestWorst = [ numpy.max(trValid, axis=1), numpy.min(trValid, axis=1) ]
+    for i, trStat in enumerate(lBestWorst):
+        trStat.set_fill_value(numpy.nan)
+        entDB.data[dataDstMD][:,i+3] = trStat.filled()
+    entDB.data[dataDstML] = []
+    for md in entDB.data[dataDstMD]:
+        entDB.data[dataDstML].append(rank_md2str(md))
+
+
+def _cat_groups(entDB, eCnt):
+    """
+    Get the member entity indexes of all the entTypes concatenated together (grouped by
+    entType), along with the typeId and the start offset (within the concatenated indexes)
+    wrt each group. As a entity can be a member of multiple entTypes (ex: a stock is a member
+    of its industry as well as of the indexes it is part of), it can appear in more than
+    one group. EntTypes without any members are skipped.
+    Also returns the primary typeId of each entity (-1 if none).
+    """
+    typeIds = entDB.meta['typeId'][:eCnt]
+    typeIds = numpy.where(typeIds == None, -1, typeIds).astype(int)
+    lIndexes = []
+    gTypeIds = []
+    for typeId, entType in enumerate(entDB.typesL):
+        tIndexes = enttypes._type_indexes(entDB, entType)
+        tIndexes = tIndexes[tIndexes < eCnt]
+        if len(tIndexes) == 0:
+            continue
+        lIndexes.append(tIndexes)
+        gTypeIds.append(typeId)
+    if len(lIndexes) == 0:
+        return typeIds, numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+    gStarts = numpy.cumsum([0] + [ len(x) for x in lIndexes[:-1] ])
+    return typeIds, numpy.concatenate(lIndexes), numpy.array(gTypeIds, dtype=int), gStarts
+
+
+def catagg(dataDst, dataSrc, aggType='median', entDB=None):
+    """
+    Aggregate the values in dataSrc across the entities belonging to each entType (category),
+    for each date in the database.
+    aggType:
+        'mean': the mean across the members of the category.
+        'median': the median across the members of the category.
+        'p<NN>': the NNth percentile across the members of the category, ex p25, p75.
+        'index': a equal weighted index of the members of the category, starting at 100,
+            based on the mean of the daily returns of its members.
+        'disp': the dispersion (std) across the members of the category.
+    The categories are got from the members of each entType (typeMembers), so entTypes
+    added through load_ftypes/add_type_member (ex: industries, indexes) are aggregated
+    as well, with a entity contributing to each entType it is a member of.
+    The series wrt each category is stored in <dataDst>.Cat, indexed by typeId. dataDst
+    inturn contains wrt each entity, the series of its primary category (typeId), so
+    that the entities can be compared with their category.
+    NOTE: The dates before a entity was first seen as well as non finite values are not
+        used for the aggregate. The mean, index and disp are calculated for all the
+        categories in one go, while median and percentiles are calculated per category.
+    """
+    if aggType == 'median':
+        q = 50
+    elif aggType.startswith('p'):
+        try:
+            q = float(aggType[1:])
+        except ValueError:
+            q = -1
+        if not (0 <= q <= 100):
+            raise ValueError("ops:catagg:Invalid percentile aggType [{}], should be p0 to p100".format(aggType))
+    elif aggType not in [ 'mean', 'index', 'disp' ]:
+        raise ValueError("ops:catagg:Unknown aggType [{}], should be one of mean, median, p<NN>, index, disp".format(aggType))
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    entDB.data[dataDstMT] = 'catagg'
+    tSrc = entDB.data[dataSrc].astype(float)
+    eCnt, dCnt = tSrc.shape
+    tAlive = numpy.arange(dCnt).reshape(1,-1) >= entDB.meta['firstSeenDI'][:eCnt].reshape(-1,1)
+    tSrc = numpy.where(tAlive & numpy.isfinite(tSrc), tSrc, numpy.nan)
+    typeIds, tOrder, gTypeIds, gStarts = _cat_groups(entDB, eCnt)
+    tCat = numpy.ones([entDB.nxtTypeIndex, dCnt])*numpy.nan
+    if len(gTypeIds) > 0:
+        tSorted = tSrc[tOrder]
+        if aggType == 'index':
+            tRet = numpy.zeros(tSorted.shape)*numpy.nan
+            tRet[:,1:] = tSorted[:,1:]/tSorted[:,:-1] - 1
+            tSorted = numpy.where(numpy.isfinite(tRet), tRet, numpy.nan)
+        tValid = numpy.isfinite(tSorted)
+        tCnt = numpy.add.reduceat(tValid, gStarts, axis=0)
+        tSum = numpy.add.reduceat(numpy.where(tValid, tSorted, 0), gStarts, axis=0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            tMean = tSum/tCnt
+            if aggType == 'mean':
+                tResult = tMean
+            elif aggType == 'index':
+                tResult = 100*numpy.cumprod(1+numpy.where(tCnt > 0, tMean, 0), axis=1)
+            elif aggType == 'disp':
+                tSumSq = numpy.add.reduceat(numpy.where(tValid, tSorted*tSorted, 0), gStarts, axis=0)
+                tResult = numpy.sqrt(numpy.maximum(tSumSq/tCnt - tMean*tMean, 0))
+            else:
+                tResult = numpy.ones(tMean.shape)*numpy.nan
+                gEnds = numpy.append(gStarts[1:], len(tOrder))
+                for i, (s, e) in enumerate(zip(gStarts, gEnds)):
+                    bCols = tCnt[i] > 0
+                    tResult[i, bCols] = numpy.nanpercentile(tSorted[s:e, bCols], q, axis=0)
+        if aggType != 'index':
+            tResult[tCnt == 0] = numpy.nan
+        tCat[gTypeIds] = tResult
+    entDB.data["{}.Cat".format(dataDst)] = tCat
+    tResult = numpy.ones(tSrc.shape)*numpy.nan
+    bTyped = typeIds >= 0
+    tResult[bTyped] = tCat[typeIds[bTyped]]
+    entDB.data[dataDst] = tResult
+    # Create the meta datas
+    trValid = numpy.ma.masked_invalid(tResult)
+    entDB.data[dataDstMD] = numpy.zeros([eCnt, 5])
+    entDB.data[dataDstMD][:,0] = tResult[:,-1]
+    for i, trStat in enumerate([numpy.mean(trValid, axis=1), numpy.std(trValid, axis=1),
+                                numpy.max(trValid, axis=1), numpy.min(trValid, axis=1)]):
+        trStat.set_fill_value(numpy.nan)
+        entDB.data[dataDstMD][:,i+1] = trStat.filled()
+    entDB.data[dataDstML] = []
+    for md in entDB.data[dataDstMD]:
+        entDB.data[dataDstML].append(rank_md2str(md))
+
+
+def print_catagg(dataKey, entTypeTmpls=enttypes.TYPE_MATCH_ALL, theDate=None, entDB=None):
+    """
+    Print the value of the given category aggregate data key (generated by the
+    cat<Agg> ops) wrt each of the matching categories, sorted by the value, as on
+    theDate (defaults to the last date).
+    """
+    entDB = _entDB(entDB)
+    tCat = entDB.data["{}.Cat".format(dataKey)]
+    if theDate == None:
+        dummyDateIndex, dateIndex = entDB.daterange2index(-1, -1)
+    else:
+        dateIndex = entDB.datesD[theDate]
+    cats = []
+    for entType in enttypes._list(entDB, entTypeTmpls):
+        typeId = entDB.typesD[entType]
+        cats.append([tCat[typeId, dateIndex], entType])
+    cats.sort(key=lambda x: x[0] if numpy.isfinite(x[0]) else -numpy.inf, reverse=True)
+    print("INFO:CatAgg:{}:{}".format(dataKey, int(entDB.dates[dateIndex])))
+    for value, entType in cats:
+        print("\t{:10.2f} {}".format(value, entType))
+    return cats
+
+
+def _ref_index(refCode, entDB):
+    """
+    Get the entIndex corresponding to the given refCode.
+    If refCode was got from a string (like a op spec), which is not found as is,
+    then it is tried as a int code (which is what MF codes are) also.
+    """
+    entIndex = entDB.meta['codeD'].get(refCode, None)
+    if (entIndex == None) and (type(refCode) == str) and refCode.isnumeric():
+        entIndex = entDB.meta['codeD'].get(int(refCode), None)
+    if entIndex == None:
+        raise KeyError("ops:RefCode [{}] not in entities db".format(refCode))
+    return entIndex
+
+
+def _winsum(tData, winDays):
+    """
+    Sum the values in a sliding window of winDays, along the dates axis,
+    using a cumulative sum. The 1st winDays-1 cols will be NaN.
+    """
+    tResult = numpy.ones(tData.shape)*numpy.nan
+    if winDays > tData.shape[1]:
+        return tResult
+    tCum = numpy.cumsum(tData, axis=1)
+    tResult[:, winDays-1] = tCum[:, winDays-1]
+    tResult[:, winDays:] = tCum[:, winDays:] - tCum[:, :-winDays]
+    return tResult
+
+
+def _beta_sums(tData, tRef, winDays=None):
+    """
+    Calculate the sums required to get the covariance, variance, beta and correlation
+    of the entities in tData wrt the reference data in tRef.
+    Only dates which have finite values wrt both the entity and the reference are
+    used (i.e the data is aligned and NaN masked wrt each pair).
+    If winDays is given, then the sums are calculated over a sliding window of winDays,
+    for each date, else over the full date range.
+    Returns cov, varData, varRef and the count of valid dates.
+    """
+    tRef = tRef.reshape(1,-1)
+    tValid = numpy.isfinite(tData) & numpy.isfinite(tRef)
+    tX = numpy.where(tValid, tData, 0)
+    tR = numpy.where(tValid, tRef, 0)
+    lSums = []
+    for tSum in [ tValid.astype(float), tX, tR, tX*tR, tX*tX, tR*tR ]:
+        if winDays == None:
+            lSums.append(numpy.sum(tSum, axis=1))
+        else:
+            lSums.append(_winsum(tSum, winDays))
+    sN, sX, sR, sXR, sXX, sRR = lSums
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sN = numpy.where(sN > 2, sN, numpy.nan)
+        tCov = sXR/sN - (sX/sN)*(sR/sN)
+        tVarX = sXX/sN - (sX/sN)**2
+        tVarR = sRR/sN - (sR/sN)**2
+    return tCov, tVarX, tVarR, sN
+
+
+def beta(dataSrc, refCode, entCodes=None, startDate=-1, endDate=-1, entDB=None):
+    """
+    Calculate the beta, correlation and covariance of the given entities wrt the refCode
+    entity, based on the values in dataSrc over the given date range.
+    If entCodes is None, then its calculated for all entities in the entities db.
+    NOTE: When dataSrc is a returns data (like roll1_absret), the beta is also called MaBeta.
+    NOTE: The dates are aligned, and only dates with finite values wrt both the entity
+        and the refCode entity are used, for each entity.
+    Returns beta, corr and cov arrays.
+    """
+    entDB = _entDB(entDB)
+    startDateIndex, endDateIndex = entDB.daterange2index(startDate, endDate)
+    refIndex = _ref_index(refCode, entDB)
+    tData = entDB.data[dataSrc]
+    if entCodes != None:
+        tData = tData[[entDB.meta['codeD'][entCode] for entCode in entCodes]]
+    tData = tData[:, startDateIndex:endDateIndex+1]
+    tRef = entDB.data[dataSrc][refIndex, startDateIndex:endDateIndex+1]
+    tCov, tVarX, tVarR, sN = _beta_sums(tData, tRef)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        tBeta = tCov/tVarR
+        tCorr = tCov/numpy.sqrt(tVarX*tVarR)
+    return tBeta, tCorr, tCov
+
+
+def corr_matrix(dataSrc, entCodes=None, corrType='corr', startDate=-1, endDate=-1, entDB=None):
+    """
+    Calculate the full pairwise correlation matrix of the given entities, based on
+    the values in dataSrc over the given date range.
+    If entCodes is None, then its calculated for all entities in the entities db.
+    corrType: 'corr' | 'cov' | 'beta'
+        beta: [i,j] gives the beta of entity i wrt entity j.
+    NOTE: For each pair of entities, only dates which have finite values wrt both of
+        them are used. This is achieved using matrix products of the NaN masked data
+        and its valid mask, so all the pairs are calculated together.
+    """
+    entDB = _entDB(entDB)
+    startDateIndex, endDateIndex = entDB.daterange2index(startDate, endDate)
+    tData = entDB.data[dataSrc]
+    if entCodes != None:
+        tData = tData[[entDB.meta['codeD'][entCode] for entCode in entCodes]]
+    tData = tData[:, startDateIndex:endDateIndex+1]
+    tValid = numpy.isfinite(tData)
+    tM = tValid.astype(float)
+    tX = numpy.where(tValid, tData, 0)
+    sN = tM @ tM.T
+    sX = tX @ tM.T
+    sXX = (tX*tX) @ tM.T
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sN[sN <= 2] = numpy.nan
+        tMeanX = sX/sN
+        tCov = (tX @ tX.T)/sN - tMeanX*tMeanX.T
+        tVar = sXX/sN - tMeanX**2
+        if corrType == 'cov':
+            return tCov
+        if corrType == 'beta':
+            return tCov/tVar.T
+        return tCov/numpy.sqrt(tVar*tVar.T)
+
+
+def rollbeta_mdhdr():
+    theHdr = "{:>7} {:>7} {:>7} {:>7} {:>7}".format("Beta", "AvgBeta", "Corr", "AvgCorr", "AllBeta")
+    return theHdr
+
+
+def rollbeta_md2str(entMD):
+    theStr = "{:7.2f} {:7.2f} {:7.2f} {:7.2f} {:7.2f}".format(entMD[0], entMD[1], entMD[2], entMD[3], entMD[4])
+    return theStr
+
+
+def rollbeta(dataDst, dataSrc, refCode, rollDays, entDB=None):
+    """
+    Calculate the beta wrt the refCode entity, over a rolling window of rollDays,
+    for each day in the database, for all the entities.
+    The rolling correlation is stored in <dataDst>Corr.
+    NOTE: dataSrc is expected to be a returns data, like the one from roll1_absret.
+    """
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    entDB.data[dataDstMT] = 'rollbeta'
+    dataDstCorr = "{}Corr".format(dataDst)
+    refIndex = _ref_index(refCode, entDB)
+    tData = entDB.data[dataSrc]
+    tCov, tVarX, tVarR, sN = _beta_sums(tData, tData[refIndex], rollDays)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        entDB.data[dataDst] = tCov/tVarR
+        entDB.data[dataDstCorr] = tCov/numpy.sqrt(tVarX*tVarR)
+    # Create the meta datas
+    entDB.data[dataDstMD] = numpy.zeros([tData.shape[0], 5])
+    for i, tSeries in enumerate([entDB.data[dataDst], entDB.data[dataDstCorr]]):
+        entDB.data[dataDstMD][:,i*2] = tSeries[:,-1]
+        trAvg = numpy.mean(numpy.ma.masked_invalid(tSeries), axis=1)
+        trAvg.set_fill_value(numpy.nan)
+        entDB.data[dataDstMD][:,i*2+1] = trAvg.filled()
+    tCov, tVarX, tVarR, sN = _beta_sums(tData, tData[refIndex])
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        entDB.data[dataDstMD][:,4] = tCov/tVarR
+    entDB.data[dataDstML] = []
+    for md in entDB.data[dataDstMD]:
+        entDB.data[dataDstML].append(rollbeta_md2str(md))
+
+
+def _winmin(tData, winDays):
+    """
+    Find the min value in a sliding window of winDays, along the dates axis.
+    This uses a doubling logic, so that the full matrix is worked on in log2(winDays)
+    passes, independent of the size of the window. NaNs are ignored where possible.
+    The 1st winDays-1 cols will be NaN.
+    """
+    tMin = tData.copy()
+    curDays = 1
+    while curDays*2 <= winDays:
+        tMin[:, curDays:] = numpy.fmin(tMin[:, curDays:], tMin[:, :-curDays])
+        curDays *= 2
+    tResult = tMin.copy()
+    remDays = winDays - curDays
+    if remDays > 0:
+        tResult[:, remDays:] = numpy.fmin(tMin[:, remDays:], tMin[:, :-remDays])
+    tResult[:, :winDays-1] = numpy.nan
+    return tResult
+
+
+def _dailyret(tData):
+    """
+    Get the daily returns (as float) wrt the given data.
+    Dates where either the current or the previous value is not a valid (finite and
+    positive) value, will have NaN as their return. The 1st col will be NaN.
+    """
+    tValid = numpy.isfinite(tData) & (tData > 0)
+    tResult = numpy.ones(tData.shape)*numpy.nan
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        tResult[:, 1:] = tData[:, 1:]/tData[:, :-1] - 1
+    tResult[:, 1:][~(tValid[:, 1:] & tValid[:, :-1])] = numpy.nan
+    return tResult
+
+
+def _drawdown(tData):
+    """
+    Get the drawdown (as float, 0 or negative) wrt the running peak value till
+    each date, as well as the number of days since the running peak was seen.
+    """
+    tValid = numpy.isfinite(tData) & (tData > 0)
+    tData = numpy.where(tValid, tData, numpy.nan)
+    tPeak = numpy.fmax.accumulate(tData, axis=1)
+    tDD = tData/tPeak - 1
+    dateIndexes = numpy.arange(tData.shape[1]).reshape(1,-1)
+    tPeakIndex = numpy.maximum.accumulate(numpy.where(tDD >= 0, dateIndexes, -1), axis=1)
+    tDDDays = numpy.where(tPeakIndex >= 0, dateIndexes - tPeakIndex, numpy.nan)
+    return tDD, tDDDays
+
+
+def seriesstats_mdhdr():
+    theHdr = "{:>7} {:>7} {:>7} {:>7} {:>7}".format("Last", "Avg", "Std", "Min", "Max")
+    return theHdr
+
+
+def seriesstats_md2str(entMD):
+    theStr = "{:7.2f} {:7.2f} {:7.2f} {:7.2f} {:7.2f}".format(entMD[0], entMD[1], entMD[2], entMD[3], entMD[4])
+    return theStr
+
+
+def _seriesstats_md(dataDst, entDB):
+    """
+    Create the meta data containing Last, Avg, Std, Min and Max wrt each entity,
+    for the given dataDst.
+    """
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    tResult = entDB.data[dataDst]
+    trValid = numpy.ma.masked_invalid(tResult)
+    entDB.data[dataDstMD] = numpy.zeros([tResult.shape[0], 5])
+    entDB.data[dataDstMD][:,0] = tResult[:,-1]
+    for i, trStat in enumerate([numpy.mean(trValid, axis=1), numpy.std(trValid, axis=1),
+                                    numpy.min(trValid, axis=1), numpy.max(trValid, axis=1)]):
+        trStat.set_fill_value(numpy.nan)
+        entDB.data[dataDstMD][:,i+1] = trStat.filled()
+    entDB.data[dataDstML] = []
+    for md in entDB.data[dataDstMD]:
+        entDB.data[dataDstML].append(seriesstats_md2str(md))
+
+
+def rollvol(dataDst, dataSrc, rollDays, entDB=None):
+    """
+    Calculate the annualised volatility (std of daily returns) over a rolling window
+    of rollDays, for each day in the database, for all the entities.
+    The volatility is stored as a percentage.
+    MetaData = Last, Avg, Std, Min, Max
+    """
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    entDB.data[dataDstMT] = 'seriesstats'
+    daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
+    # Rolling volatility using windowed sums of the returns and their squares
+    tRet = _dailyret(entDB.data[dataSrc])
+    tValid = numpy.isfinite(tRet)
+    tRet = numpy.where(tValid, tRet, 0)
+    sN = _winsum(tValid.astype(float), rollDays)
+    sR = _winsum(tRet, rollDays)
+    sRR = _winsum(tRet*tRet, rollDays)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sN[sN < 2] = numpy.nan
+        tVar = numpy.maximum((sRR - (sR*sR)/sN)/(sN-1), 0)
+        entDB.data[dataDst] = numpy.sqrt(tVar*daysInAYear)*100
+    _seriesstats_md(dataDst, entDB)
+
+
+def drawdown_mdhdr():
+    theHdr = "{:>7}% {:>7}% {:>6}Yrs {:>6}Yrs".format("MaxDD", "CurDD", "MaxDur", "CurDur")
+    return theHdr
+
+
+def drawdown_md2str(entMD):
+    theStr = "{:7.2f}% {:7.2f}% {:6.2f}Yrs {:6.2f}Yrs".format(entMD[0], entMD[1], entMD[2], entMD[3])
+    return theStr
+
+
+def drawdown(dataDst, dataSrc, entDB=None):
+    """
+    Calculate the drawdown (as a percentage) wrt the running peak value, for each day
+    in the database, for all the entities.
+    The number of days since the running peak (i.e the drawdown duration) is stored
+    in <dataDst>Days.
+    MetaData = MaxDrawdown, CurrentDrawdown, LongestDrawdownDuration(Yrs), CurrentDrawdownDuration(Yrs)
+    """
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    entDB.data[dataDstMT] = 'drawdown'
+    dataDstDays = "{}Days".format(dataDst)
+    # The drawdown and its duration
+    tDD, tDDDays = _drawdown(entDB.data[dataSrc])
+    entDB.data[dataDst] = tDD*100
+    entDB.data[dataDstDays] = tDDDays
+    # Create the meta datas
+    entDB.data[dataDstMD] = numpy.zeros([tDD.shape[0], 4])
+    for i, trStat in enumerate([numpy.min(numpy.ma.masked_invalid(tDD*100), axis=1),
+                                    numpy.max(numpy.ma.masked_invalid(tDDDays), axis=1)]):
+        trStat.set_fill_value(numpy.nan)
+        entDB.data[dataDstMD][:,i*2] = trStat.filled()
+    entDB.data[dataDstMD][:,1] = tDD[:,-1]*100
+    entDB.data[dataDstMD][:,3] = tDDDays[:,-1]
+    entDB.data[dataDstMD][:,2:] = hlpr.days2year(entDB.data[dataDstMD][:,2:], entDB.bSkipWeekends)
+    entDB.data[dataDstML] = []
+    for md in entDB.data[dataDstMD]:
+        entDB.data[dataDstML].append(drawdown_md2str(md))
+
+
+def sortino(dataDst, dataSrc, rollDays, entDB=None):
+    """
+    Calculate the sortino ratio over a rolling window of rollDays, for each day in the
+    database, for all the entities.
+        Sortino = (ReturnPerAnnum - MinRetPA) / DownsideDeviationPerAnnum
+    The downside deviation only accounts for the daily returns below the daily equivalent
+    of gfMinRetPA.
+    MetaData = Last, Avg, Std, Min, Max
+    """
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    entDB.data[dataDstMT] = 'seriesstats'
+    daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
+    fMinRet = gfMinRetPA/100
+    fMinRetDaily = (1+fMinRet)**(1/daysInAYear) - 1
+    # Downside deviation using windowed sums
+    tData = entDB.data[dataSrc]
+    tRet = _dailyret(tData)
+    tValid = numpy.isfinite(tRet)
+    tDown = numpy.where(tValid, numpy.minimum(tRet - fMinRetDaily, 0), 0)
+    sN = _winsum(tValid.astype(float), rollDays)
+    sDD = _winsum(tDown*tDown, rollDays)
+    tResult = numpy.ones(tData.shape)*numpy.nan
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sN[sN < 2] = numpy.nan
+        tDownDev = numpy.sqrt((sDD/sN)*daysInAYear)
+        tRetPA = (tData[:, rollDays:]/tData[:, :-rollDays])**(daysInAYear/rollDays) - 1
+        tResult[:, rollDays:] = (tRetPA - fMinRet)/tDownDev[:, rollDays:]
+    tResult[~numpy.isfinite(tResult)] = numpy.nan
+    entDB.data[dataDst] = tResult
+    _seriesstats_md(dataDst, entDB)
+
+
+def calmar(dataDst, dataSrc, rollDays, entDB=None):
+    """
+    Calculate the calmar ratio over a rolling window of rollDays, for each day in the
+    database, for all the entities.
+        Calmar = ReturnPerAnnum / abs(MaxDrawdownWithinWindow)
+    NOTE: The drawdown is measured wrt the running peak since the entity was first seen,
+        and the worst of it within the window is used.
+    MetaData = Last, Avg, Std, Min, Max
+    """
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    entDB.data[dataDstMT] = 'seriesstats'
+    daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
+    tData = entDB.data[dataSrc]
+    tDD, tDDDays = _drawdown(tData)
+    tMaxDD = _winmin(tDD, rollDays+1)
+    tResult = numpy.ones(tData.shape)*numpy.nan
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        tRetPA = (tData[:, rollDays:]/tData[:, :-rollDays])**(daysInAYear/rollDays) - 1
+        tResult[:, rollDays:] = tRetPA/numpy.abs(tMaxDD[:, rollDays:])
+    tResult[~numpy.isfinite(tResult)] = numpy.nan
+    entDB.data[dataDst] = tResult
+    _seriesstats_md(dataDst, entDB)
+
+
+def ulcer(dataDst, dataSrc, rollDays, entDB=None):
+    """
+    Calculate the ulcer index (root mean square of the percentage drawdowns) over a
+    rolling window of rollDays, for each day in the database, for all the entities.
+    NOTE: The drawdown is measured wrt the running peak since the entity was first seen.
+    MetaData = Last, Avg, Std, Min, Max
+    """
+    # Get generic things required
+    dataDstMT, dataDstMD, dataDstML = hlpr.data_metakeys(dataDst)
+    entDB = _entDB(entDB)
+    entDB.data[dataDstMT] = 'seriesstats'
+    tDD, tDDDays = _drawdown(entDB.data[dataSrc])
+    tValid = numpy.isfinite(tDD)
+    tDD = numpy.where(tValid, tDD*100, 0)
+    sN = _winsum(tValid.astype(float), rollDays)
+    sDD = _winsum(tDD*tDD, rollDays)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sN[sN < 1] = numpy.nan
+        entDB.data[dataDst] = numpy.sqrt(sDD/sN)
+    _seriesstats_md(dataDst, entDB)
+
+
 MDStrX = {
     'srel': srel_md2str,
     'relto': relto_md2str,
     'reton': reton_md2str,
     'rollret': rollret_md2str,
     'blockstats': blockstats_md2str,
+    'rank': rank_md2str,
+    'rollbeta': rollbeta_md2str,
+    'seriesstats': seriesstats_md2str,
+    'drawdown': drawdown_md2str,
     }
 def _md_str(dataSrc, entIndex, entDB):
     """
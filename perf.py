@@ -0,0 +1,218 @@
+# Lightweight instrumentation of the hot paths
+# HanishKVC, 2021
+# GPL
+
+"""
+Collect counters, timings and peak array bytes, wrt the different stages of the
+program, like loading a date's data, inserting it into the entities db, the
+individual ops, fetching of files, etc.
+
+Usage
+    perf.enable()
+    edb.load(2018, 2020)
+    procedb.ops(['roll1Y=roll1Y(data)'])
+    perf.summary()
+    perf.reset()
+
+The logics to be instrumented use
+
+    with perf.stage("StageName") as st:
+        ...
+        st.count("things", numOfThings)
+        st.bytes(numOfBytes)
+
+When instrumentation is disabled (the default), stage returns a shared dummy
+object, whose methods do nothing, so the cost is a function call and a check.
+"""
+
+import time
+import threading
+
+
+gbEnabled = False
+gStats = {}
+gLock = threading.Lock()
+
+
+
+class Stat:
+    """
+    The statistics wrt a given stage.
+    """
+
+    __slots__ = ('calls', 'totalTime', 'minTime', 'maxTime', 'peakBytes', 'counters')
+
+    def __init__(self):
+        self.calls = 0
+        self.totalTime = 0.0
+        self.minTime = float('inf')
+        self.maxTime = 0.0
+        self.peakBytes = 0
+        self.counters = {}
+
+
+    def avg_time(self):
+        if self.calls == 0:
+            return 0.0
+        return self.totalTime/self.calls
+
+
+
+class _Stage:
+    """
+    Time a stage of the program, as well as accumulate its counters and peak bytes.
+    """
+
+    __slots__ = ('name', 'startTime', 'counters', 'peakBytes')
+    bOn = True
+
+    def __init__(self, name):
+        self.name = name
+        self.counters = {}
+        self.peakBytes = 0
+
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+        return self
+
+
+    def __exit__(self, excType, excValue, excTB):
+        _record(self.name, time.perf_counter()-self.startTime, self.counters, self.peakBytes)
+        return False
+
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+
+    def bytes(self, nBytes):
+        if nBytes > self.peakBytes:
+            self.peakBytes = nBytes
+
+
+
+class _NoStage:
+    """
+    The dummy stage used when instrumentation is disabled.
+    """
+
+    __slots__ = ()
+    bOn = False
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, excTB):
+        return False
+
+
+    def count(self, counter, n=1):
+        pass
+
+
+    def bytes(self, nBytes):
+        pass
+
+
+gNoStage = _NoStage()
+
+
+
+def enable(bEnable=True):
+    """
+    Enable or disable the instrumentation.
+    """
+    global gbEnabled
+    gbEnabled = bEnable
+    return gbEnabled
+
+
+def reset():
+    """
+    Clear the statistics collected till now.
+    """
+    with gLock:
+        gStats.clear()
+
+
+def stage(name):
+    """
+    Return a context manager to instrument the given named stage.
+    """
+    if not gbEnabled:
+        return gNoStage
+    return _Stage(name)
+
+
+def count(name, counter, n=1):
+    """
+    Update a counter wrt the given stage, outside of a timed block.
+    """
+    if not gbEnabled:
+        return
+    _record(name, None, { counter: n }, 0)
+
+
+def _record(name, timeTaken, counters, peakBytes):
+    with gLock:
+        stat = gStats.get(name, None)
+        if stat == None:
+            stat = Stat()
+            gStats[name] = stat
+        if timeTaken != None:
+            stat.calls += 1
+            stat.totalTime += timeTaken
+            if timeTaken < stat.minTime:
+                stat.minTime = timeTaken
+            if timeTaken > stat.maxTime:
+                stat.maxTime = timeTaken
+        if peakBytes > stat.peakBytes:
+            stat.peakBytes = peakBytes
+        for counter in counters:
+            stat.counters[counter] = stat.counters.get(counter, 0) + counters[counter]
+
+
+def stats():
+    """
+    Return the collected statistics as a dictionary of dictionaries, keyed by stage name.
+    """
+    dStats = {}
+    with gLock:
+        for name, stat in gStats.items():
+            dStats[name] = { 'calls': stat.calls, 'totalTime': stat.totalTime, 'avgTime': stat.avg_time(),
+                    'minTime': stat.minTime if stat.calls > 0 else 0.0, 'maxTime': stat.maxTime,
+                    'peakBytes': stat.peakBytes, 'counters': dict(stat.counters) }
+    return dStats
+
+
+def _human_bytes(nBytes):
+    for unit in [ 'B', 'K', 'M', 'G' ]:
+        if nBytes < 1024:
+            return "{:.0f}{}".format(nBytes, unit)
+        nBytes /= 1024
+    return "{:.1f}T".format(nBytes)
+
+
+def summary(sortBy='totalTime', nameTmpl=None):
+    """
+    Print a summary table of the statistics collected till now.
+
+    sortBy: could be one of 'totalTime', 'calls', 'avgTime', 'maxTime', 'peakBytes' or 'name'.
+    nameTmpl: if specified, only stages whose name starts with it are shown.
+    """
+    dStats = stats()
+    names = [ n for n in dStats if (nameTmpl == None) or n.startswith(nameTmpl) ]
+    if sortBy == 'name':
+        names.sort()
+    else:
+        names.sort(key=lambda n: dStats[n][sortBy], reverse=True)
+    if not gbEnabled:
+        print("INFO:Perf:Summary: Instrumentation is disabled, use perf.enable() to enable")
+    print("{:40} {:>8} {:>10} {:>10} {:>10} {:>8}  {}".format("Stage", "Calls", "Total(s)", "Avg(ms)", "Max(ms)", "PeakMem", "Counters"))
+    for n in names:
+        s = dStats[n]
+        sCounters = ", ".join([ "{}={}".format(k, v) for k, v in s['counters'].items() ])
+        print("{:40} {:8} {:10.4f} {:10.3f} {:10.3f} {:>8}  {}".format(n[:40], s['calls'], s['totalTime'],
+            s['avgTime']*1000, s['maxTime']*1000, _human_bytes(s['peakBytes']), sCounters))
@@ -3,17 +3,26 @@
 # GPL
 
 import numpy
-import scipy
-from scipy import stats
-import matplotlib
-import matplotlib.pyplot as plt
 import hlpr
+import log
 import edb
 
 
+# matplotlib and scipy are imported only when they are used 1st time
+plt = hlpr.LazyModule('matplotlib.pyplot')
+ticker = hlpr.LazyModule('matplotlib.ticker')
+mcollections = hlpr.LazyModule('matplotlib.collections')
+stats = hlpr.LazyModule('scipy.stats')
+interpolate = hlpr.LazyModule('scipy.interpolate')
+
+
 giLabelNameChopLen = 36
 giLabelCodeChopLen = 16
 
+# Plot only the min and max points wrt each pixel of the axes width, when a series has more
+# points than can be shown. The visible range is re-decimated when zooming/panning.
+gbDecimate = True
+
 
 def _entDB(entDB=None):
     """
@@ -59,6 +68,110 @@ def inset_axes(bounds, sTitle=None, bTransparent=True, bShareXAxis=True, bYTicks
     return iaxes
 
 
+def _decimate(x, y, numBins):
+    """
+    Reduce the given series to the min and max points (in their original order) wrt each
+    of numBins equal sized bins, so that the peaks and troughs are retained, while plotting
+    only around 2 points per bin. Bins with only nan values retain a nan, so gaps are kept.
+    """
+    n = len(y)
+    if (numBins <= 0) or (n <= 2*numBins):
+        return x, y
+    binSize = -(-n//numBins)
+    numBins = -(-n//binSize)
+    yB = numpy.full(numBins*binSize, numpy.nan)
+    yB[:n] = y
+    yB = yB.reshape(numBins, binSize)
+    bNaN = numpy.isnan(yB)
+    iMin = numpy.where(bNaN, numpy.inf, yB).argmin(axis=1)
+    iMax = numpy.where(bNaN, -numpy.inf, yB).argmax(axis=1)
+    iBase = numpy.arange(numBins)*binSize
+    indexes = numpy.empty(numBins*2, dtype=int)
+    indexes[0::2] = iBase + numpy.minimum(iMin, iMax)
+    indexes[1::2] = iBase + numpy.maximum(iMin, iMax)
+    return x[indexes], y[indexes]
+
+
+def _visible(x, y, xMin, xMax):
+    """
+    Return the part of the series within the given x range, along with a point on either side.
+    """
+    iStart = max(numpy.searchsorted(x, xMin)-1, 0)
+    iEnd = numpy.searchsorted(x, xMax, side='right')+1
+    return x[iStart:iEnd], y[iStart:iEnd]
+
+
+def _pixels(axes):
+    """
+    The width of the axes in pixels.
+    """
+    return int(axes.get_window_extent().width)
+
+
+def _redecimate(axes):
+    """
+    Decimate the visible part of the series plotted in the given axes (and the axes
+    sharing its x-axis), wrt its current x limits.
+    Called when the x limits change due to zooming/panning.
+    """
+    xMin, xMax = axes.get_xlim()
+    for ax in axes.get_shared_x_axes().get_siblings(axes):
+        numBins = _pixels(ax)
+        for artist in list(ax.lines) + list(ax.collections):
+            full = getattr(artist, 'ffeFull', None)
+            if full == None:
+                continue
+            if type(full) == list:
+                artist.set_segments([ numpy.column_stack(_decimate(*_visible(x, y, xMin, xMax), numBins)) for x, y in full ])
+            else:
+                artist.set_data(*_decimate(*_visible(full[0], full[1], xMin, xMax), numBins))
+
+
+def _watch_xlim(axes):
+    """
+    Setup the axes to re-decimate its series, when its x limits change.
+    """
+    if getattr(axes, 'ffeDecimateCId', None) == None:
+        axes.ffeDecimateCId = axes.callbacks.connect('xlim_changed', _redecimate)
+
+
+def _decimated(axes, x, y):
+    """
+    Return the decimated series to plot wrt the given axes, if decimation is enabled.
+    """
+    if not gbDecimate:
+        return x, y
+    _watch_xlim(axes)
+    return _decimate(x, y, _pixels(axes))
+
+
+def _line(axes, gid, x, y, label, plotFunc=None, **kwargs):
+    """
+    Plot the given series as a line in axes, reusing the line plotted previously with the
+    same gid (if any), by updating its data, instead of creating a new line.
+    Returns True if a existing line was reused.
+    """
+    lines = getattr(axes, 'ffeLines', None)
+    if lines == None:
+        lines = {}
+        axes.ffeLines = lines
+    xD, yD = _decimated(axes, x, y)
+    line = lines.get(gid, None)
+    if (line != None) and (line.axes == axes):
+        line.set_data(xD, yD)
+        line.set_label(label)
+        bReused = True
+    else:
+        if plotFunc == None:
+            plotFunc = axes.plot
+        line = plotFunc(xD, yD, label=label, gid=gid, **kwargs)[0]
+        lines[gid] = line
+        bReused = False
+    if gbDecimate:
+        line.ffeFull = (x, y)
+    return bReused
+
+
 def _bar(dataKey, entCode, startDate=-1, endDate=-1, entDB=None, axes=None):
     """
     Bar plot the dataKey's data for the specified entCode, over the given date range.
@@ -81,10 +194,37 @@ def _step(dataKey, entCode, startDate=-1, endDate=-1, where='mid', entDB=None, a
     startDateIndex, endDateIndex = entDB.daterange2index(startDate, endDate)
     x = numpy.arange(startDateIndex, endDateIndex+1)
     index = entDB.meta['codeD'][entCode]
-    axes.step(x, entDB.data[dataKey][index,startDateIndex:endDateIndex+1], where=where)
+    y = entDB.data[dataKey][index,startDateIndex:endDateIndex+1]
+    if _line(axes, "step:{}:{}".format(dataKey, entCode), x, y, None, axes.step, where=where):
+        axes.relim()
+        axes.autoscale_view()
 
 
-def _data(dataKeys, entCodes, startDate=-1, endDate=-1, entDB=None, axes=None):
+def _collection(dataKey, entCodes, x, startDateIndex, endDateIndex, entDB, axes):
+    """
+    Plot the dataKey's data wrt all the given entCodes, as a single LineCollection,
+    which is much faster to draw than a line per entity, when there are many entities.
+    """
+    full = []
+    for entCode in entCodes:
+        index = entDB.meta['codeD'][entCode]
+        full.append((x, entDB.data[dataKey][index, startDateIndex:endDateIndex+1]))
+    numBins = 0
+    if gbDecimate:
+        _watch_xlim(axes)
+        numBins = _pixels(axes)
+    segments = [ numpy.column_stack(_decimate(xS, yS, numBins)) for xS, yS in full ]
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    label = "{:<{cwidth}}:{:{width}}: {:16} : {}".format("*", "{} entities".format(len(entCodes)), dataKey, "",
+            cwidth=giLabelCodeChopLen, width=giLabelNameChopLen)
+    lc = mcollections.LineCollection(segments, colors=colors, label=label)
+    if gbDecimate:
+        lc.ffeFull = full
+    axes.add_collection(lc)
+    axes.autoscale_view()
+
+
+def _data(dataKeys, entCodes, startDate=-1, endDate=-1, entDB=None, axes=None, bCollection=False):
     """
     Plot specified datas for the specified entities from entDB, over the specified
     date range.
@@ -93,6 +233,13 @@ def _data(dataKeys, entCodes, startDate=-1, endDate=-1, entDB=None, axes=None):
     entCodes: Is a entCode or a list of entCodes.
     startDate and endDate: specify the date range over which the data should be
         retreived and plotted.
+    bCollection: If True, the data of all the entCodes wrt each dataKey is plotted as a
+        single LineCollection with a single legend entry, which is faster when plotting
+        many entities.
+
+    If the same dataKey-entCode was already plotted in the axes, its line is updated.
+    If plot.gbDecimate is set (the default), series longer than the axes width (in pixels)
+    are decimated, retaining the min and max wrt each pixel.
 
     Remember to call show func, when you want to see plots, accumulated till then.
     """
@@ -104,8 +251,12 @@ def _data(dataKeys, entCodes, startDate=-1, endDate=-1, entDB=None, axes=None):
         dataKeys = [ dataKeys ]
     if (type(entCodes) == int) or (type(entCodes) == str):
         entCodes = [ entCodes]
+    bReused = False
     for dataKey in dataKeys:
-        print("DBUG:plot_data:{}".format(dataKey))
+        log.dbug("plot_data", "{}", dataKey)
+        if bCollection:
+            _collection(dataKey, entCodes, x, startDateIndex, endDateIndex, entDB, axes)
+            continue
         dataKeyMetaType, dataKeyMetaData, dataKeyMetaLabel = hlpr.data_metakeys(dataKey)
         for entCode in entCodes:
             index = entDB.meta['codeD'][entCode]
@@ -115,12 +266,16 @@ def _data(dataKeys, entCodes, startDate=-1, endDate=-1, entDB=None, axes=None):
             except:
                 dataLabel = ""
             label = "{:<{cwidth}}:{:{width}}: {}".format(entCode, name, dataLabel, cwidth=giLabelCodeChopLen, width=giLabelNameChopLen)
-            print("\t{}:{}".format(label, index))
+            log.dbug("plot_data", "\t{}:{}", label, index)
             label = "{:<{cwidth}}:{:{width}}: {:16} : {}".format(entCode, name, dataKey, dataLabel, cwidth=giLabelCodeChopLen, width=giLabelNameChopLen)
-            axes.plot(x, entDB.data[dataKey][index, startDateIndex:endDateIndex+1], label=label)
+            y = entDB.data[dataKey][index, startDateIndex:endDateIndex+1]
+            bReused |= _line(axes, "{}:{}".format(dataKey, entCode), x, y, label)
+    if bReused:
+        axes.relim()
+        axes.autoscale_view()
 
 
-def data(dataKeys, entTypeTmpls, entNameTmpls, startDate=-1, endDate=-1, entDB=None, axes=None):
+def data(dataKeys, entTypeTmpls, entNameTmpls, startDate=-1, endDate=-1, entDB=None, axes=None, bCollection=False):
     """
     Plot specified datas for the specified entities from entDB, over the specified
     date range.
@@ -130,12 +285,13 @@ def data(dataKeys, entTypeTmpls, entNameTmpls, startDate=-1, endDate=-1, entDB=N
     entNameTmpls: matching templates used to identify entities within selected entTypes.
     startDate and endDate: specify the date range over which the data should be
         retreived and plotted.
+    bCollection: If True, the matching entities are plotted as a single LineCollection.
 
     Remember to call show func, when you want to see plots, accumulated till then.
     """
     entDB = _entDB(entDB)
     entCodes = entDB.list_type_members(entTypeTmpls, entNameTmpls)
-    _data(dataKeys, entCodes, startDate, endDate, entDB, axes)
+    _data(dataKeys, entCodes, startDate, endDate, entDB, axes, bCollection)
 
 
 def _fit(dataKeys, entCodes, startDate=-1, endDate=-1, fitType='linregress', entDB=None, axes=None):
@@ -211,12 +367,12 @@ def _spline(entCode, entName, x, y, axes):
     """
     axes = _axes(axes)
     numDays = len(x)
-    spl = scipy.interpolate.splrep(x,y, k=3)
+    spl = interpolate.splrep(x,y, k=3)
     label = "{}:{}:Data:{}days".format(entCode, entName, numDays)
     axes.plot(x, y*1.01, label=label)
     label = "{}:{}:SplineFit".format(entCode, entName)
     x = numpy.append(x, numpy.arange(x[-1],x[-1]+2))
-    ySpl = scipy.interpolate.splev(x, spl)
+    ySpl = interpolate.splev(x, spl)
     axes.plot(x, ySpl, label=label)
 
 
@@ -226,13 +382,16 @@ gFits = {
     }
 
 
-def _show(entDB, axes=None):
+def _show(entDB, axes=None, legendLoc='best'):
     """
     Show the data plotted till now.
+    legendLoc: A fixed location (like 'upper left') avoids the search for the best
+        location, when rendering many charts.
     """
     axes = _axes(axes)
-    leg = axes.legend()
-    plt.setp(leg.texts, family='monospace')
+    leg = axes.legend(loc=legendLoc)
+    for text in leg.texts:
+        text.set_family('monospace')
     for line in leg.get_lines():
         line.set_linewidth(8)
     axes.grid(True)
@@ -245,7 +404,19 @@ def _show(entDB, axes=None):
     xTickLabels = numpy.array(curDates)[xTicks]
     plt.xticks(xTicks, xTickLabels, rotation='vertical')
     """
-    axes.xaxis.set_major_formatter(matplotlib.ticker.IndexFormatter(curDates))
+    axes.xaxis.set_major_formatter(_dates_formatter(curDates))
+
+
+def _dates_formatter(dates):
+    """
+    Return a tick formatter which shows the date corresponding to the date index.
+    """
+    def date_at(x, pos=None):
+        i = int(round(x))
+        if (i < 0) or (i >= len(dates)):
+            return ''
+        return str(dates[i])
+    return ticker.FuncFormatter(date_at)
 
 
 def show(entDB=None, axes=None):
@@ -0,0 +1,143 @@
+# Weighted portfolios (baskets) of entities, maintained as pseudo entities
+# HanishKVC, 2021
+# GPL
+
+import numpy
+import edb
+import hlpr
+import log
+
+
+ENTTYPE = 'Portfolio'
+ENTCODE_TMPL = "PF:{}"
+# The value of a portfolio on its start date
+gfBaseValue = 100.0
+
+
+def _entDB(entDB=None):
+    if entDB == None:
+        return edb.gEntDB
+    return entDB
+
+
+def _periods(rebalance, entDB):
+    """
+    Get the date indexes at which the portfolios are rebalanced (to their target weights).
+    rebalance: None (no rebalancing, i.e buy and hold), 'D', 'W', 'M', 'Q', 'Y' to rebalance
+        at the start of each calendar day/week/month/quarter/year, or a number of days.
+    """
+    dates = entDB.dates[:entDB.nxtDateIndex].astype(int)
+    if rebalance == None:
+        return numpy.zeros(1, dtype=int)
+    if type(rebalance) != str:
+        return numpy.arange(0, len(dates), int(rebalance))
+    if rebalance == 'Y':
+        pids = dates//10000
+    elif rebalance == 'Q':
+        pids = (dates//10000)*4 + ((dates//100)%100-1)//3
+    else:
+        pids = hlpr.dateints2periodids(dates, rebalance)
+    return numpy.flatnonzero(numpy.diff(pids, prepend=pids[0]-1))
+
+
+def _values(tW, tData, rebalIdx, startDateIndex=0):
+    """
+    Calculate the value of each portfolio, for all the dates, in one go.
+
+    tW: the target weights matrix [portfolios, entities]
+    tData: the price matrix [entities, dates]
+    rebalIdx: the date indexes at which the portfolios get rebalanced.
+
+    At each rebalance date, the weights of the members which have data on that date are
+    normalised and converted into units (weight/price). The value of all the portfolios
+    over the following period is then got by multiplying the units matrix with the prices
+    of that period. If none of its members have data on a rebalance date, a portfolio
+    which is already alive is held in cash, else it is not yet alive (value 0).
+    Returns the values matrix [portfolios, dates]
+    """
+    numPFs = tW.shape[0]
+    numDates = tData.shape[1]
+    bValid = tData > 0
+    tPrices = numpy.where(bValid, tData, 0)
+    tValues = numpy.zeros([numPFs, numDates])
+    vStart = numpy.ones(numPFs)*gfBaseValue
+    bAlive = numpy.zeros(numPFs, dtype=bool)
+    rebalIdx = rebalIdx[rebalIdx >= startDateIndex]
+    if (len(rebalIdx) == 0) or (rebalIdx[0] != startDateIndex):
+        rebalIdx = numpy.concatenate([[startDateIndex], rebalIdx])
+    for k, s in enumerate(rebalIdx):
+        e = rebalIdx[k+1] if (k+1) < len(rebalIdx) else numDates-1
+        tWk = tW*bValid[:, s]
+        tTot = numpy.sum(tWk, axis=1)
+        bOk = tTot > 0
+        tUnits = tWk/numpy.where(bOk, tTot, 1).reshape(-1,1)/numpy.where(bValid[:, s], tData[:, s], 1)
+        tRel = tUnits @ tPrices[:, s:e+1]
+        tRel[~bOk] = 1
+        bAlive = bAlive | bOk
+        tValues[:, s:e+1] = numpy.where(bAlive.reshape(-1,1), vStart.reshape(-1,1)*tRel, 0)
+        vStart = numpy.where(bAlive, tValues[:, e], vStart)
+    return tValues
+
+
+def weights_matrix(portfolios, entDB=None):
+    """
+    Convert the given portfolios into a target weights matrix [portfolios, entities].
+
+    portfolios: a dict of portfolioName: members, where members is either
+        a dict of entCode: weight, or
+        a list of entCodes (equal weights).
+    Members not in the entities db are ignored (with a warning).
+    """
+    entDB = _entDB(entDB)
+    tW = numpy.zeros([len(portfolios), entDB.nxtEntIndex])
+    for i, name in enumerate(portfolios):
+        members = portfolios[name]
+        if type(members) != dict:
+            members = { entCode: 1 for entCode in members }
+        for entCode, weight in members.items():
+            entIndex = entDB.meta['codeD'].get(entCode, None)
+            if entIndex == None:
+                log.warn("Portfolio", "{}: Unknown member {}, ignoring", name, entCode)
+                continue
+            tW[i, entIndex] = weight
+    return tW
+
+
+def values(tW, rebalance='M', dataKey='data', startDate=-1, entDB=None):
+    """
+    Calculate the value (starting at gfBaseValue on startDate) of all the portfolios given
+    by the weights matrix tW [portfolios, entities], for all the dates. Hundreds of candidate
+    portfolios can be evaluated at once, by passing them as rows of tW.
+    rebalance: look at _periods.
+    """
+    entDB = _entDB(entDB)
+    startDateIndex, endDateIndex = entDB.daterange2index(startDate, -1)
+    tData = entDB.data[dataKey][:entDB.nxtEntIndex, :entDB.nxtDateIndex]
+    return _values(tW, tData, _periods(rebalance, entDB), startDateIndex)
+
+
+def add(portfolios, rebalance='M', dataKey='data', startDate=-1, entDB=None):
+    """
+    Create the given portfolios as pseudo entities (of entType Portfolio) in the entities
+    db, with their value in dataKey. Their entCode is PF:<portfolioName>. So all the ops,
+    anal_simple, plot, ... can be used with them, like any other entity.
+
+    portfolios: look at weights_matrix.
+    rebalance: look at _periods.
+
+    NOTE: Portfolios are not used as members of other portfolios being added.
+    NOTE: Run the ops again, after adding portfolios, to get their derived data.
+
+    Returns the entCodes of the portfolios.
+    """
+    entDB = _entDB(entDB)
+    tW = weights_matrix(portfolios, entDB)
+    tW[:, entDB.type_indexes(ENTTYPE)] = 0
+    tValues = values(tW, rebalance, dataKey, startDate, entDB)
+    entCodes = [ ENTCODE_TMPL.format(name) for name in portfolios ]
+    entNames = [ "Portfolio {} [{}]".format(name, rebalance) for name in portfolios ]
+    entTypeId = entDB.add_type(ENTTYPE)
+    entDB.add_ents_data(entCodes, entNames, entTypeId, { dataKey: tValues })
+    log.info("Portfolio", "Added {} portfolios", len(entCodes))
+    return entCodes
+
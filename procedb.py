@@ -6,19 +6,27 @@
 import sys
 import os
 import numpy
-import matplotlib.pyplot as plt
 import time
 import traceback
 import readline
 import warnings
+import concurrent.futures
 import hlpr
 import enttypes
 import indexes
 import entities
 import edb
+import perf
+import log
 import ops as theOps
 
 
+plt = hlpr.LazyModule('matplotlib.pyplot')
+
+# The number of threads used by ops, to run independent operations in parallel.
+# If 1, the operations are run one after the other.
+gOpsThreads = os.cpu_count()
+
 
 def _entDB(entDB=None):
     """
@@ -50,7 +58,7 @@ def _ops(curOp, startDate, endDate, entDB):
     dataSrc = dataSrc[:-1]
     if dataDst == '':
         dataDst = "{}({}[{}:{}])".format(op, dataSrc, startDate, endDate)
-    print("DBUG:ops:op[{}]:dst[{}]".format(curOpFull, dataDst))
+    log.dbug("ops", "op[{}]:dst[{}]", curOpFull, dataDst)
     #### Op specific things to do before getting into individual records
     if op == 'srel':
         theOps.srel(dataDst, dataSrc, entDB)
@@ -89,6 +97,44 @@ def _ops(curOp, startDate, endDate, entDB):
             retonDate = int(retonT[5:])
             retonDateIndex = entDB.datesD[retonDate]
         theOps.reton(dataDst, dataSrc, retonDateIndex, retonType, None, entDB)
+    elif op.startswith("rank") or op.startswith("pctrank"):
+        if op.startswith("rank"):
+            rankType = 'num'
+        else:
+            rankType = 'pct'
+        if op.endswith("_type"):
+            groupBy = 'type'
+        else:
+            groupBy = 'all'
+        theOps.rank(dataDst, dataSrc, rankType, groupBy, None, entDB)
+    elif op.startswith("beta"):
+        rollDays, refCode = op[4:].split('_', 1)
+        rollDays = hlpr.days_in(rollDays, entDB.bSkipWeekends)
+        theOps.rollbeta(dataDst, dataSrc, refCode, rollDays, entDB)
+    elif op == "mdd":
+        theOps.drawdown(dataDst, dataSrc, entDB)
+    elif op.startswith("vol"):
+        rollDays = hlpr.days_in(op[3:], entDB.bSkipWeekends)
+        theOps.rollvol(dataDst, dataSrc, rollDays, entDB)
+    elif op.startswith("sortino"):
+        rollDays = hlpr.days_in(op[7:], entDB.bSkipWeekends)
+        theOps.sortino(dataDst, dataSrc, rollDays, entDB)
+    elif op.startswith("calmar"):
+        rollDays = hlpr.days_in(op[6:], entDB.bSkipWeekends)
+        theOps.calmar(dataDst, dataSrc, rollDays, entDB)
+    elif op.startswith("ulcer"):
+        rollDays = hlpr.days_in(op[5:], entDB.bSkipWeekends)
+        theOps.ulcer(dataDst, dataSrc, rollDays, entDB)
+    elif op.startswith("cat"):
+        theOps.catagg(dataDst, dataSrc, op[3:], entDB)
+    elif op.startswith("sip"):
+        sipArgs = op[3:].split('_')
+        theOps.sip(dataDst, dataSrc, sipArgs[0], *[ int(x) for x in sipArgs[1:] ], entDB=entDB)
+    elif op.startswith("pivot"):
+        period = op[5:]
+        if period == '':
+            period = 'D'
+        theOps.pivotpoints_full(dataDst, period, dataSrc.replace('close', '{}'), entDB)
     update_metas(op, dataSrc, dataDst)
 
 
@@ -154,6 +200,12 @@ def ops(opsList, startDate=-1, endDate=-1, bDebug=False, entDB=None):
                 MetaLabel = RollRetAvg, RollRetStd, RollRetBelowMinThreshold, MaSharpeMinT, YearsActive
                 NOTE: MaSharpeMinT = (RollRetAvg-MinThreshold)/RollRetStd
 
+        "sip<Duration>[_<DayOfMonth>[_<StartEveryMonths>]]": Simulate monthly SIPs of the given
+                duration (?M or ?Y installments), with installments on the given DayOfMonth, started
+                every StartEveryMonths months, and calculate their XIRR. The XIRR is set on the date
+                of the installment following the last one, and NaN on other dates.
+                MetaData and MetaLabel are same as that of roll.
+
         "block<BlockDaysInt>: Divide the given dataSrc content into multiple blocks, where each
                 block corresponds to the BlockDays specified. Inturn for each of the block,
                 calculate the following
@@ -163,6 +215,56 @@ def ops(opsList, startDate=-1, endDate=-1, bDebug=False, entDB=None):
                 MetaData = BlockAvgs, BlockStds
                 MetaLabel = BlockAvgs, AvgBlockAvgs, AvgBlockStds
 
+        "pctrank[_type]": Calculate the percentile rank of each entity wrt all other entities, for
+                each date in the full date range. The entity with the highest value on a given date
+                gets 100 and the one with the lowest value gets 0.
+                If _type is specified, then each entity is ranked only wrt other entities belonging
+                to the same entType as itself.
+                Dates before a entity was first seen and non finite values are set to NaN.
+                MetaData  = LastRank, AvgRank, StdRank, BestRank, WorstRank
+                MetaLabel = LastRank, AvgRank, StdRank, BestRank, WorstRank
+
+        "rank[_type]": Similar to pctrank, but calculates the numeric rank, with the entity having
+                the highest value on a given date getting rank 1, the next one rank 2 and so on.
+
+        "beta<DAYSInINT>_<RefEntCode>": Calculate the beta of each entity wrt the RefEntCode entity,
+                over a rolling window of DAYSInINT, for each date in the full date range. The dataSrc
+                should be a returns data, like the one generated by roll1_absret.
+                Only dates which have valid data wrt both the entity and RefEntCode are used.
+                The rolling correlation is stored in <dataDst>Corr.
+                MetaData  = LastBeta, AvgBeta, LastCorr, AvgCorr, BetaOverFullDateRange
+                MetaLabel = LastBeta, AvgBeta, LastCorr, AvgCorr, BetaOverFullDateRange
+
+        "vol<DAYSInINT>": Calculate the annualised volatility (std of daily returns) as a percentage,
+                over a rolling window of DAYSInINT, for each date in the full date range.
+                MetaData  = Last, Avg, Std, Min, Max
+
+        "mdd": Calculate the drawdown as a percentage wrt the running peak, for each date in the full
+                date range. The drawdown duration in days is stored in <dataDst>Days.
+                MetaData  = MaxDrawdown, CurDrawdown, LongestDrawdownYrs, CurDrawdownYrs
+
+        "sortino<DAYSInINT>": Calculate the sortino ratio over a rolling window of DAYSInINT.
+                i.e (RetPA - MinRetPA)/DownsideDeviationPA
+                MetaData  = Last, Avg, Std, Min, Max
+
+        "calmar<DAYSInINT>": Calculate the calmar ratio over a rolling window of DAYSInINT.
+                i.e RetPA/abs(MaxDrawdownWithinWindow)
+                MetaData  = Last, Avg, Std, Min, Max
+
+        "ulcer<DAYSInINT>": Calculate the ulcer index (root mean square of percentage drawdowns)
+                over a rolling window of DAYSInINT.
+                MetaData  = Last, Avg, Std, Min, Max
+
+                NOTE: The risk ops' MetaData can be used to rank the entities using anal_simple, ex:
+                    anal_simple('vol1Y.MetaData', 'normal', 'bottom', theIndex=1)
+
+        "pivot[D|W|M]": Calculate the daily/weekly/monthly pivot points, for each date in the full date
+                range, based on the high, low and close of the previous calendar day/week/month.
+                The srcDataKey should be a close key (ex close or w.close), the corresponding high and
+                low keys are derived from it. If srcDataKey is not a close key, its used for all three.
+                The series of the pivot levels are stored in <dataDst>.S2|S1|P|R1|R2, while the pivot
+                levels wrt the period following the last date, is stored in <dataDst>.
+
     NOTE: NaN is used, because plot will ignore those data points and keep the corresponding
     verticals blank.
 
@@ -172,35 +274,148 @@ def ops(opsList, startDate=-1, endDate=-1, bDebug=False, entDB=None):
 
     TODO: Currently dont change startDate and endDate from their default, because many operations
     dont account for them being different from the default.
+
+    NOTE: Operations in opsList, which dont depend on each other, are run in parallel, using
+    gOpsThreads threads. Look at _ops_waves for how the dependencies are identified.
     """
     entDB = _entDB(entDB)
     if type(opsList) == str:
         opsList = [ opsList ]
-    for curOp in opsList:
+    if (gOpsThreads == None) or (gOpsThreads <= 1) or (len(opsList) <= 1):
+        for curOp in opsList:
+            _ops_safe(curOp, startDate, endDate, entDB)
+        return
+    prevKeys = set(entDB.data.keys())
+    for wave in _ops_waves(opsList, entDB):
+        if len(wave) == 1:
+            _ops_safe(wave[0], startDate, endDate, entDB)
+            continue
+        with concurrent.futures.ThreadPoolExecutor(min(gOpsThreads, len(wave))) as tpe:
+            list(tpe.map(lambda curOp: _ops_safe(curOp, startDate, endDate, entDB), wave))
+    _ops_orderkeys(opsList, prevKeys, entDB)
+
+
+def _ops_safe(curOp, startDate, endDate, entDB):
+    """
+    Run the given op, logging any exception, so that the remaining ops can continue.
+    """
+    with perf.stage("ops:{}".format(curOp.split('=')[-1].split('(')[0])) as st:
         try:
             _ops(curOp, startDate, endDate, entDB)
         except:
             traceback.print_exc()
             print("DBUG:ProcEDB:Ops:Exception processing {}, skipping to next".format(curOp))
+            st.count('errors')
+        if st.bOn and ('=' in curOp):
+            st.bytes(_ops_bytes(curOp, entDB))
+
+
+def _ops_bytes(curOp, entDB):
+    """
+    Get the bytes used by the numeric arrays generated by the given op.
+    """
+    dataDst, dataSrcs = _ops_keys(curOp, entDB)
+    nBytes = 0
+    for key in list(entDB.data.keys()):
+        if not key.startswith(dataDst):
+            continue
+        value = entDB.data[key]
+        if isinstance(value, numpy.ndarray):
+            nBytes += value.nbytes
+    return nBytes
+
+
+def _ops_keys(curOp, entDB):
+    """
+    Get the dataDst and list of dataSrcs wrt the given op.
+    Aliases are mapped to the data key they are alias of.
+    """
+    if '=' in curOp:
+        dataDst, curOp = curOp.split('=')
+    else:
+        dataDst = curOp
+    op, dataSrc = curOp.split('(', 1)
+    dataSrc = dataSrc[:-1]
+    dataSrcs = [ dataSrc ]
+    if op.startswith("pivot"):
+        dataSrcs.extend([ dataSrc.replace('close', 'high'), dataSrc.replace('close', 'low') ])
+    aliases = getattr(entDB, 'aliases', None)
+    if aliases != None:
+        for key in aliases:
+            dataSrcs = [ key if k in aliases[key] else k for k in dataSrcs ]
+            if dataDst in aliases[key]:
+                dataDst = key
+    return dataDst, dataSrcs
+
+
+def _keys_related(keyA, keyB):
+    """
+    Check if the keys could refer to the same data, or data derived from the other.
+    """
+    return keyA.startswith(keyB) or keyB.startswith(keyA)
+
+
+def _ops_waves(opsList, entDB):
+    """
+    Group the ops in opsList into waves, such that the ops in a wave dont depend on each
+    other and can be run in parallel, while the waves need to be run one after the other.
+
+    A op depends on a earlier op in the list, if
+        it reads data written by the earlier op, OR
+        it writes data read or written by the earlier op.
+    As ops also write derived data (ex <dataDst>.MetaData, <dataDst>Corr, ...), keys
+    are considered to refer to the same data, if one key starts with the other key.
+    """
+    opKeys = [ _ops_keys(curOp, entDB) for curOp in opsList ]
+    opWaves = []
+    for j, (dstJ, srcsJ) in enumerate(opKeys):
+        waveJ = 0
+        for i in range(j):
+            dstI, srcsI = opKeys[i]
+            bDepends = _keys_related(dstI, dstJ)
+            for src in srcsJ:
+                bDepends = bDepends or _keys_related(dstI, src)
+            for src in srcsI:
+                bDepends = bDepends or _keys_related(dstJ, src)
+            if bDepends:
+                waveJ = max(waveJ, opWaves[i]+1)
+        opWaves.append(waveJ)
+    waves = []
+    for curOp, waveJ in zip(opsList, opWaves):
+        if waveJ >= len(waves):
+            waves.extend([ [] for i in range(waveJ-len(waves)+1) ])
+        waves[waveJ].append(curOp)
+    return waves
+
+
+def _ops_orderkeys(opsList, prevKeys, entDB):
+    """
+    Reorder the data keys added by the ops in opsList, so that they are in the same
+    order, as they would be, had the ops been run one after the other.
+    Each new key is mapped to the op with the longest dataDst, which it starts with.
+    """
+    opDsts = [ _ops_keys(curOp, entDB)[0] for curOp in opsList ]
+    newKeys = [ k for k in entDB.data.keys() if k not in prevKeys ]
+    keyOwners = []
+    for key in newKeys:
+        owner = len(opDsts)
+        for i, dataDst in enumerate(opDsts):
+            if key.startswith(dataDst) and ((owner == len(opDsts)) or (len(dataDst) > len(opDsts[owner]))):
+                owner = i
+        keyOwners.append(owner)
+    for i in sorted(range(len(newKeys)), key=lambda i: keyOwners[i]):
+        entDB.data[newKeys[i]] = entDB.data.pop(newKeys[i])
 
 
 def _mabeta(dataSrc, refCode, entCodes, entDB=None):
     """
     Get the slope of the entCodes wrt refCode.
     When the passed dataSrc is rollingRet, this is also called MaBeta.
+    NOTE: Only dates which have valid data wrt both the entity and refCode are used.
     """
     entDB = _entDB(entDB)
-    refIndex = entDB.meta['codeD'][refCode]
-    refValid = entDB.data[dataSrc][refIndex][numpy.isfinite(entDB.data[dataSrc][refIndex])]
-    refAvg = numpy.mean(refValid)
-    maBeta = []
-    for entCode in entCodes:
-        entIndex = entDB.meta['codeD'][entCode]
-        entValid = entDB.data[dataSrc][entIndex][numpy.isfinite(entDB.data[dataSrc][entIndex])]
-        entAvg = numpy.mean(entValid)
-        entMaBeta = numpy.sum((entValid-entAvg)*(refValid-refAvg))/numpy.sum((refValid-refAvg)**2)
-        maBeta.append(entMaBeta)
-    return maBeta
+    maBeta, maCorr, maCov = theOps.beta(dataSrc, refCode, entCodes, entDB=entDB)
+    return list(maBeta)
 
 
 def mabeta(dataSrc, refCode, entCodes, entDB=None):
@@ -216,8 +431,35 @@ def mabeta(dataSrc, refCode, entCodes, entDB=None):
     Value lower than 0 - Both entities move in dissimilar/oppositive manner.
     '''
     entDB = _entDB(entDB)
-    ops('i.roll1Abs=roll1_absret({})'.format(dataSrc))
-    return _mabeta('i.roll1Abs', refCode, entCodes)
+    ops('i.roll1Abs=roll1_absret({})'.format(dataSrc), entDB=entDB)
+    return _mabeta('i.roll1Abs', refCode, entCodes, entDB)
+
+
+def correlation(entTypeTmpls, entNameTmpls=[], dataSrc='data', corrType='corr', numPairs=20, entDB=None):
+    """
+    Calculate the pairwise correlation (of the daily returns) across all the members of
+    the matching entTypes (which inturn match entNameTmpls, if any), in one go.
+    The top numPairs most similar pairs of entities are printed.
+
+    corrType: 'corr' | 'cov' | 'beta' (look at ops.corr_matrix)
+
+    Returns the list of entCodes and the correlation matrix wrt them.
+    """
+    entDB = _entDB(entDB)
+    entCodes = enttypes._members(entDB, entTypeTmpls, entNameTmpls)
+    ops('i.roll1Abs=roll1_absret({})'.format(dataSrc), entDB=entDB)
+    tCorr = theOps.corr_matrix('i.roll1Abs', entCodes, corrType, entDB=entDB)
+    tSane = hlpr.sane_array(tCorr, -numpy.inf)
+    tSane[numpy.tril_indices(len(entCodes))] = -numpy.inf
+    print("INFO:Correlation:{}:Top {} pairs".format(corrType, numPairs))
+    for i in numpy.argsort(tSane, axis=None)[::-1][:numPairs]:
+        r, c = numpy.unravel_index(i, tSane.shape)
+        if tSane[r,c] == -numpy.inf:
+            break
+        print("\t{:7.3f} : {:<16} {:32} : {:<16} {:32}".format(tCorr[r,c],
+            str(entCodes[r]), entDB.meta['name'][entDB.meta['codeD'][entCodes[r]]][:32],
+            str(entCodes[c]), entDB.meta['name'][entDB.meta['codeD'][entCodes[c]]][:32]))
+    return entCodes, tCorr
 
 
 def _forceval_entities(data, entCodes, forcedValue, entSelectType='normal', entDB=None):
@@ -227,11 +469,18 @@ def _forceval_entities(data, entCodes, forcedValue, entSelectType='normal', entD
     The locations is specified using a combination of entCodes and entSelectType.
         'normal': for locations corresponding to the specified entCodes,
         'invert': for locations not specified in entCodes.
+    entCodes could also be a boolean mask or a array of indexes over the entities
+        (as got from entDB.type_mask/type_indexes).
     """
     entDB = _entDB(entDB)
-    if entCodes == None:
+    if entCodes is None:
         return data
-    indexes = [entDB.meta['codeD'][code] for code in entCodes]
+    if isinstance(entCodes, numpy.ndarray) and (entCodes.dtype == bool):
+        indexes = numpy.nonzero(entCodes)[0]
+    elif isinstance(entCodes, numpy.ndarray):
+        indexes = entCodes
+    else:
+        indexes = [entDB.meta['codeD'][code] for code in entCodes]
     if entSelectType == 'normal':
         mask = numpy.zeros(data.size, dtype=bool)
         mask[indexes] = True
@@ -312,6 +561,8 @@ def anal_simple(dataSrc, analType='normal', order="top", theDate=None, theIndex=
     entCodes: One can restrict the logic to look at data belonging to
         the specified list of entities. If None, then all entities
         in the loaded dataset will be considered, for ranking.
+        It could also be a boolean mask over the entities, like the one
+        got using edb.enttype_mask('open equity large').
 
     minDataYears: This sorting logic will ignore entities for which the
         available data duration in the entities database is less than
@@ -386,7 +637,7 @@ def anal_simple(dataSrc, analType='normal', order="top", theDate=None, theIndex=
             printHdr.extend(['RetPA'])
             theSaneArray = entDB.data[dataSrcMetaData][:,1].copy()
         else:
-            input("ERRR:AnalSimple:{}:dataSrc[{}]: unknown srel anal subType, returning...".format(theAnal, dataSrc))
+            hlpr.prompt("ERRR:AnalSimple:{}:dataSrc[{}]: unknown srel anal subType, returning...".format(theAnal, dataSrc))
             return None
     elif analType.startswith("roll"):
         dataSrcMetaType, dataSrcMetaData, dataSrcMetaLabel = hlpr.data_metakeys(dataSrc)
@@ -431,7 +682,7 @@ def anal_simple(dataSrc, analType='normal', order="top", theDate=None, theIndex=
         tNumBlocks = tNumBlocks - iValidBlockAtBegin
         theSaneArray = theRankArray[:,tNumBlocks]
     else:
-        input("ERRR:AnalSimple:{}:dataSrc[{}]: unknown analType, returning...".format(theAnal, dataSrc))
+        hlpr.prompt("ERRR:AnalSimple:{}:dataSrc[{}]: unknown analType, returning...".format(theAnal, dataSrc))
         return None
     if type(theSaneArray) == type(None):
         print("WARN:DBUG:AnalSimple:{}:{}: No SaneArray????".format(theAnal, dataSrc))
@@ -512,12 +763,12 @@ def infoset1_prep(entDB=None):
     entDB = _entDB(entDB)
     daysInAYear = hlpr.days_in('1Y', entDB.bSkipWeekends)
     warnings.filterwarnings('ignore')
-    ops(['srel=srel(data)', 'mas50Srel=mas50(srel)'], entDB=entDB)
-    ops(['roabs=reton_absret(data)', 'rosaf=reton(data)'], entDB=entDB)
-    ops(['roll3Y=roll3Y(data)', 'mas50Roll3Y=mas50(roll3Y)'], entDB=entDB)
-    ops(['roll5Y=roll5Y(data)', 'mas50Roll5Y=mas50(roll5Y)'], entDB=entDB)
     blockDays = int((entDB.nxtDateIndex-daysInAYear*3)/5)
-    ops(['blockNRoll3Y=block{}(roll3Y)'.format(blockDays)], entDB=entDB)
+    ops(['srel=srel(data)', 'mas50Srel=mas50(srel)',
+            'roabs=reton_absret(data)', 'rosaf=reton(data)',
+            'roll3Y=roll3Y(data)', 'mas50Roll3Y=mas50(roll3Y)',
+            'roll5Y=roll5Y(data)', 'mas50Roll5Y=mas50(roll5Y)',
+            'blockNRoll3Y=block{}(roll3Y)'.format(blockDays)], entDB=entDB)
     warnings.filterwarnings('default')
 
 
@@ -603,7 +854,7 @@ def infoset1_result1_entcodes(entCodes, bPrompt=False, numEntities=-1, entDB=Non
             plt.ylabel('RollRet StD')
             plt.show()
         if bPrompt:
-            input("Press any key to continue...")
+            hlpr.prompt("Press any key to continue...")
 
 
 def infoset1_result2_entcodes(entCodes=None, bPrompt=True, numEntities=20, entDB=None):
@@ -627,7 +878,7 @@ def infoset1_result2_entcodes(entCodes=None, bPrompt=True, numEntities=20, entDB
         for tEnt in [x[0] for x in b]:
             lBot.add(tEnt)
         if bPrompt:
-            input('INFO:Press any key to continue...')
+            hlpr.prompt('INFO:Press any key to continue...')
     lAll = list(lTop.union(lBot))
     infoset1_result1_entcodes(lAll, bPrompt, len(lAll), entDB=entDB)
 
@@ -0,0 +1,298 @@
+# Screen entities using conditions specified as expressions over the data keys
+# HanishKVC, 2021
+# GPL
+
+import ast
+import numpy
+import edb
+
+
+#
+# Some predefined conditions, which can be used directly or as part of other expressions.
+# The user can add more conditions to this dictionary.
+#
+gConds = {
+        'breakout20': 'close > max(high, 20)',
+        'breakdown20': 'close < min(low, 20)',
+        'goldencross': 'crossabove(mas50, mas200)',
+        'deathcross': 'crossbelow(mas50, mas200)',
+        'rsiOverSold': 'rsi < 30',
+        'rsiOverBought': 'rsi > 70',
+        'volSpike': 'volume > 2*prev(mas10Vol)',
+        'ppR1Break': 'crossabove(close, pp.R1)',
+        'ppS1Break': 'crossbelow(close, pp.S1)',
+        }
+
+# The compiled expressions, cached wrt the expression string.
+gCompiled = {}
+
+
+def _entDB(entDB=None):
+    if entDB == None:
+        return edb.gEntDB
+    return entDB
+
+
+def _prepend_nan(arr, n):
+    """
+    Prepend n columns of nan to the given 2D array, dropping as many columns at its end.
+    """
+    out = numpy.full(arr.shape, numpy.nan)
+    if n < arr.shape[1]:
+        out[:,n:] = arr[:,:arr.shape[1]-n]
+    return out
+
+
+def _window(x, n, func):
+    """
+    Apply func over the previous n days (excluding the current day) wrt each day.
+    """
+    x = numpy.asarray(x, dtype=float)
+    if x.shape[1] <= n:
+        return numpy.full(x.shape, numpy.nan)
+    win = numpy.lib.stride_tricks.sliding_window_view(x[:,:-1], n, axis=1)
+    out = numpy.full(x.shape, numpy.nan)
+    out[:,n:] = func(win, axis=-1)
+    return out
+
+
+def _cross(a, b, bAbove):
+    a = numpy.asarray(a, dtype=float)
+    b = numpy.broadcast_to(numpy.asarray(b, dtype=float), a.shape)
+    if bAbove:
+        return (_prepend_nan(a, 1) <= _prepend_nan(b, 1)) & (a > b)
+    return (_prepend_nan(a, 1) >= _prepend_nan(b, 1)) & (a < b)
+
+
+#
+# The functions supported in the expressions, along with the lookback (in days) they need.
+# The windowed functions work over the previous n days, excluding the current day, so that
+# breakouts can be checked for, like close > max(high, 20).
+# The lookback functions are passed the constant arguments (if any) of the call.
+#
+gFuncs = {
+        'max': [ lambda x, n: _window(x, n, numpy.max), lambda n, *args: n ],
+        'min': [ lambda x, n: _window(x, n, numpy.min), lambda n, *args: n ],
+        'mean': [ lambda x, n: _window(x, n, numpy.mean), lambda n, *args: n ],
+        'prev': [ lambda x, n=1: _prepend_nan(numpy.asarray(x, dtype=float), n), lambda n=1, *args: n ],
+        'crossabove': [ lambda a, b: _cross(a, b, True), lambda *args: 1 ],
+        'crossbelow': [ lambda a, b: _cross(a, b, False), lambda *args: 1 ],
+        'abs': [ numpy.abs, lambda *args: 0 ],
+        }
+
+gBinOps = {
+        ast.Add: numpy.add, ast.Sub: numpy.subtract, ast.Mult: numpy.multiply, ast.Div: numpy.divide,
+        ast.BitAnd: numpy.logical_and, ast.BitOr: numpy.logical_or,
+        }
+
+gCmpOps = {
+        ast.Lt: numpy.less, ast.LtE: numpy.less_equal, ast.Gt: numpy.greater, ast.GtE: numpy.greater_equal,
+        ast.Eq: numpy.equal, ast.NotEq: numpy.not_equal,
+        }
+
+
+def _dotted_name(node):
+    """
+    Get the data key corresponding to a name or dotted name (ex: pp.R1) node.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return "{}.{}".format(_dotted_name(node.value), node.attr)
+    raise ValueError("Screener:Not a data key:{}".format(ast.dump(node)))
+
+
+def _build(node, expr, expanding):
+    """
+    Build a function which evaluates the given expression node, wrt a evaluation context.
+    Returns [func, lookback], where lookback is the number of days prior to the date range
+    being evaluated, which are required to evaluate it.
+    expanding: the names of the predefined conditions being expanded (to catch cycles).
+    """
+    if isinstance(node, ast.Constant):
+        return [ lambda ctx: node.value, 0 ]
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        key = _dotted_name(node)
+        if (key in gConds) and (gConds[key] != expr):
+            sub = _compile(key, expanding)
+            return [ sub['func'], sub['lookback'] ]
+        return [ lambda ctx: ctx['get'](key), 0 ]
+    if isinstance(node, ast.BinOp):
+        op = gBinOps.get(type(node.op), None)
+        if op == None:
+            raise ValueError("Screener:Unsupported operator:{}".format(ast.dump(node.op)))
+        l, lL = _build(node.left, expr, expanding)
+        r, rL = _build(node.right, expr, expanding)
+        return [ lambda ctx: op(l(ctx), r(ctx)), max(lL, rL) ]
+    if isinstance(node, ast.BoolOp):
+        op = numpy.logical_and if isinstance(node.op, ast.And) else numpy.logical_or
+        vals = [ _build(v, expr, expanding) for v in node.values ]
+        def _boolop(ctx):
+            res = vals[0][0](ctx)
+            for v in vals[1:]:
+                res = op(res, v[0](ctx))
+            return res
+        return [ _boolop, max([ v[1] for v in vals ]) ]
+    if isinstance(node, ast.UnaryOp):
+        o, oL = _build(node.operand, expr, expanding)
+        if isinstance(node.op, (ast.Not, ast.Invert)):
+            return [ lambda ctx: numpy.logical_not(o(ctx)), oL ]
+        if isinstance(node.op, ast.USub):
+            return [ lambda ctx: numpy.negative(o(ctx)), oL ]
+        raise ValueError("Screener:Unsupported operator:{}".format(ast.dump(node.op)))
+    if isinstance(node, ast.Compare):
+        ops = [ gCmpOps[type(o)] for o in node.ops ]
+        vals = [ _build(v, expr, expanding) for v in [node.left] + node.comparators ]
+        def _compare(ctx):
+            left = vals[0][0](ctx)
+            res = True
+            for op, v in zip(ops, vals[1:]):
+                right = v[0](ctx)
+                res = numpy.logical_and(res, op(left, right))
+                left = right
+            return res
+        return [ _compare, max([ v[1] for v in vals ]) ]
+    if isinstance(node, ast.Call):
+        fName = _dotted_name(node.func)
+        if fName not in gFuncs:
+            raise ValueError("Screener:Unknown function:{}".format(fName))
+        func, funcLookback = gFuncs[fName]
+        args = [ _build(a, expr, expanding) for a in node.args ]
+        consts = [ a.value for a in node.args if isinstance(a, ast.Constant) ]
+        lookback = funcLookback(*consts) + max([ a[1] for a in args ])
+        return [ lambda ctx: func(*[ a[0](ctx) for a in args ]), lookback ]
+    raise ValueError("Screener:Unsupported expression:{}".format(ast.dump(node)))
+
+
+def _compile(expr, expanding=()):
+    """
+    Compile the given condition expression (or the name of a predefined condition).
+    expanding: the names of the predefined conditions already being expanded.
+    Returns a dict containing the expr, func and lookback.
+    """
+    if expr in gConds:
+        if expr in expanding:
+            raise ValueError("Screener:Cyclic condition:{}".format(" -> ".join(expanding + (expr,))))
+        expanding = expanding + (expr,)
+        expr = gConds[expr]
+    compiled = gCompiled.get(expr, None)
+    if compiled == None:
+        func, lookback = _build(ast.parse(expr, mode='eval').body, expr, expanding)
+        compiled = { 'expr': expr, 'func': func, 'lookback': lookback }
+        gCompiled[expr] = compiled
+    return compiled
+
+
+def _eval(entDB, compiledL, bAnd, entIndexes, startDateIndex, endDateIndex):
+    """
+    Evaluate the compiled conditions wrt the given entities and date range (inclusive),
+    and combine them (AND or OR).
+    Returns a boolean array of shape [len(entIndexes), dates in range].
+    """
+    numDates = endDateIndex - startDateIndex + 1
+    lookback = max([ c['lookback'] for c in compiledL ])
+    s = max(startDateIndex - lookback, 0)
+    e = endDateIndex + 1
+    rows = slice(None) if entIndexes is None else entIndexes
+    cache = {}
+    def _get(key):
+        if key not in cache:
+            if key not in entDB.data:
+                raise KeyError("Screener:Unknown data key:{}".format(key))
+            cache[key] = entDB.data[key][rows, s:e]
+        return cache[key]
+    ctx = { 'get': _get }
+    nEnts = entDB.nxtEntIndex if entIndexes is None else len(entIndexes)
+    bMask = None
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        for c in compiledL:
+            res = numpy.asarray(c['func'](ctx))
+            if res.dtype != bool:
+                res = numpy.isfinite(res) & (res != 0)
+            res = numpy.broadcast_to(res, (nEnts, e-s))[:, -numDates:]
+            if bMask is None:
+                bMask = res
+            elif bAnd:
+                bMask = bMask & res
+            else:
+                bMask = bMask | res
+    return bMask
+
+
+def masks(conds, entTypeTmpls=None, startDate=-1, endDate=-1, op='and', entDB=None):
+    """
+    Evaluate the given conditions across all the selected entities and all the dates in
+    the given date range, in one go.
+
+    conds: a condition expression or a list of them, which are combined using op ('and'
+        or 'or'). The expressions work with the data keys in the entities db (ex: close,
+        mas50, pp.R1) and can use
+            arithmetic (+ - * /) and comparison (< <= > >= == !=) operators,
+            & | ~ or and/or/not to combine conditions,
+            max(x,n), min(x,n), mean(x,n): over the previous n days, excluding current day,
+            prev(x,n=1): the value n days before,
+            crossabove(a,b), crossbelow(a,b): a crossed b, on that day,
+            abs(x),
+            the names of predefined conditions in gConds.
+    entTypeTmpls: If given, only the members of the matching entTypes are evaluated.
+    startDate, endDate: the date range (YYYYMMDD or -1), as in daterange2index.
+
+    Returns bMask, entIndexes, dateIndexes
+        bMask: boolean array of shape [len(entIndexes), len(dateIndexes)]
+    """
+    entDB = _entDB(entDB)
+    if type(conds) == str:
+        conds = [ conds ]
+    compiledL = [ _compile(c) for c in conds ]
+    if entTypeTmpls == None:
+        entIndexes = None
+    else:
+        entIndexes = entDB.type_indexes(entTypeTmpls)
+    startDateIndex, endDateIndex = entDB.daterange2index(startDate, endDate)
+    bMask = _eval(entDB, compiledL, op == 'and', entIndexes, startDateIndex, endDateIndex)
+    if entIndexes is None:
+        entIndexes = numpy.arange(entDB.nxtEntIndex)
+    return bMask, entIndexes, numpy.arange(startDateIndex, endDateIndex+1)
+
+
+def screen(conds, entTypeTmpls=None, date=-1, op='and', entDB=None):
+    """
+    Find entities which satisfy the given conditions on the given date (YYYYMMDD or -1 for
+    the last date loaded). Look at masks for the details about the arguments.
+
+    ex: screen('breakout20', 'nse nifty 500')
+    ex: screen(['close > mas200', 'rsi < 30'])
+
+    Returns a list of (entCode, entName) wrt the matching entities.
+    """
+    entDB = _entDB(entDB)
+    bMask, entIndexes, dateIndexes = masks(conds, entTypeTmpls, date, date, op, entDB)
+    tSel = entIndexes[bMask[:,-1]]
+    return list(zip(entDB.meta['codeL'][tSel], entDB.meta['name'][tSel]))
+
+
+def backfill(conds, entTypeTmpls=None, startDate=-1, endDate=-1, op='and', dataDst=None, entDB=None):
+    """
+    Find when the given conditions were satisfied, over the given date range (by default
+    the full date range loaded), in one pass. Look at masks for the details about the
+    arguments.
+
+    dataDst: If given, the signal is also saved into the entities db as this data key
+        (1 on the dates it fired, else 0), so that it can be plotted or processed further.
+
+    Returns a list of (entCode, entName, [dates on which it fired]) wrt the entities, for
+    which the signal fired atleast once.
+    """
+    entDB = _entDB(entDB)
+    bMask, entIndexes, dateIndexes = masks(conds, entTypeTmpls, startDate, endDate, op, entDB)
+    if dataDst != None:
+        tDst = numpy.zeros([entDB.nxtEntIndex, entDB.nxtDateIndex])
+        tDst[numpy.ix_(entIndexes, dateIndexes)] = bMask
+        entDB.data[dataDst] = tDst
+    tDates = entDB.dates[dateIndexes].astype(int)
+    tFired = []
+    for i in numpy.flatnonzero(numpy.any(bMask, axis=1)):
+        entIndex = entIndexes[i]
+        tFired.append((entDB.meta['codeL'][entIndex], entDB.meta['name'][entIndex], tDates[bMask[i]].tolist()))
+    return tFired
+
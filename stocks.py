@@ -4,12 +4,15 @@
 
 
 
+import os
 import time
+import concurrent.futures
 import edb
 import plot as eplot
 import procedb
 import ops
 import hlpr
+import log
 
 
 
@@ -34,14 +37,10 @@ def _plot_prep(opts):
         'bRSIJWW': If True, Jww RSI will be shown by plot, by default.
             else SMA based RSI.
     """
-    procedb.ops(['mas50=mas50(data)', 'mas200=mas200(data)'])
-    procedb.ops(['mae9=mae9(data)', 'mae26=mae26(data)', 'mae50=mae50(data)'])
-    procedb.ops(['mas10Vol=mas10(volume)'])
-    ops.weekly_view(['open','high','low','close','volume'], ['s','M','m','e','a'], "w.{}")
-    ops.monthly_view(['open','high','low','close','volume'], ['s','M','m','e','a'], "m.{}")
-    ops.pivotpoints('pp')
-    ops.pivotpoints('ppW', "w.{}", dateIndex=-1)
-    ops.pivotpoints('ppM', "m.{}", dateIndex=-1)
+    procedb.ops(['mas50=mas50(data)', 'mas200=mas200(data)',
+                'mae9=mae9(data)', 'mae26=mae26(data)', 'mae50=mae50(data)',
+                'mas10Vol=mas10(volume)',
+                'pp=pivotD(close)', 'ppW=pivotW(close)', 'ppM=pivotM(close)'])
     ops.rsi_jww('rsiJWW', 'data')
     ops.rsi_sma('rsiSMA', 'data')
     bRSIJWW = opts.get('bRSIJWW', False)
@@ -52,8 +51,9 @@ def _plot_prep(opts):
 
 
 gbPlotVolumeBar=True
-def _plot_volume(dataKeyVol, dataKeyVolMA, entCode, insetId=0):
-    ia = eplot.inset_axes([0,0.1*insetId,1,0.1], sTitle="Volumes")
+def _plot_volume(dataKeyVol, dataKeyVolMA, entCode, insetId=0, ia=None):
+    if ia == None:
+        ia = eplot.inset_axes([0,0.1*insetId,1,0.1], sTitle="Volumes")
     if gbPlotVolumeBar:
         eplot._step(dataKeyVol, entCode, axes=ia)
         eplot._data(dataKeyVolMA, entCode, axes=ia)
@@ -61,12 +61,29 @@ def _plot_volume(dataKeyVol, dataKeyVolMA, entCode, insetId=0):
         eplot._data([dataKeyVol, dataKeyVolMA], entCode, axes=ia)
 
 
-def _plot_rsi(dataKey, entCode, insetId=0):
-    ia = eplot.inset_axes([0,0.1*insetId,1,0.1], sTitle="RSI")
+def _plot_rsi(dataKey, entCode, insetId=0, ia=None):
+    if ia == None:
+        ia = eplot.inset_axes([0,0.1*insetId,1,0.1], sTitle="RSI")
     ops.plot_rsi(dataKey, entCode, axes=ia)
 
 
-def _plot(entCodes, bPivotPoints=True, bVolumes=True, bRSI=True, bLinRegress=False):
+def _plot_axes(bVolumes=True, bRSI=True, axes=None):
+    """
+    Create the axes used by _plot, ie the main axes along with the volume and rsi insets,
+    so that they can be reused across entities.
+    Returns [axes, volumeInsetAxes, rsiInsetAxes]
+    """
+    axes = eplot._axes(axes)
+    iaVol = None
+    iaRSI = None
+    if bVolumes:
+        iaVol = eplot.inset_axes([0,0.1,1,0.1], sTitle="Volumes", axes=axes)
+    if bRSI:
+        iaRSI = eplot.inset_axes([0,0,1,0.1], sTitle="RSI", axes=axes)
+    return [axes, iaVol, iaRSI]
+
+
+def _plot(entCodes, bPivotPoints=True, bVolumes=True, bRSI=True, bLinRegress=False, axesL=None):
     """
     Plot data related to the given set of entCodes.
 
@@ -83,20 +100,26 @@ def _plot(entCodes, bPivotPoints=True, bVolumes=True, bRSI=True, bLinRegress=Fal
     Even thou entCodes can be passed as a list, passing a single
     entCode may be more practically useful. Also plot_pivotpoints
     currently supports a single entCode only.
+
+    axesL: The [axes, volumeInsetAxes, rsiInsetAxes] to plot into, as returned by
+        _plot_axes. If not given, the insets are created in the current axes.
     """
     entDB = edb.gEntDB
+    if axesL == None:
+        axesL = [ eplot._axes(), None, None ]
+    axes, iaVol, iaRSI = axesL
     weekDays = hlpr.days_in('1W', entDB.bSkipWeekends)
-    eplot._data(['data', 'mas200', 'mae9', 'mae26', 'mae50'], entCodes)
+    eplot._data(['data', 'mas200', 'mae9', 'mae26', 'mae50'], entCodes, axes=axes)
     if bPivotPoints:
-        ops.plot_pivotpoints('pp', entCodes, plotRange=weekDays, axes=eplot._axes())
-        ops.plot_pivotpoints('ppW', entCodes, plotRange=weekDays*3, axes=eplot._axes())
-        ops.plot_pivotpoints('ppM', entCodes, plotRange=weekDays*6, axes=eplot._axes())
+        ops.plot_pivotpoints('pp', entCodes, plotRange=weekDays, axes=axes)
+        ops.plot_pivotpoints('ppW', entCodes, plotRange=weekDays*3, axes=axes)
+        ops.plot_pivotpoints('ppM', entCodes, plotRange=weekDays*6, axes=axes)
     if bVolumes:
-        _plot_volume('volume', 'mas10Vol', entCodes, 1)
+        _plot_volume('volume', 'mas10Vol', entCodes, 1, iaVol)
     if bRSI:
-        _plot_rsi('rsi', entCodes, 0)
+        _plot_rsi('rsi', entCodes, 0, iaRSI)
     if bLinRegress:
-        eplot.linregress('data', entCodes, days=['3M','6M','1Y','3Y'])
+        eplot.linregress('data', entCodes, days=['3M','6M','1Y','3Y'], axes=axes)
 
 
 def plot(entCodes, bPivotPoints=True, bVolumes=True, bRSI=True, bLinRegress=False):
@@ -124,6 +147,97 @@ def plot(entCodes, bPivotPoints=True, bVolumes=True, bRSI=True, bLinRegress=Fals
         eplot.show()
 
 
+def _export_clear(axesL):
+    """
+    Remove the data plotted wrt the previous entity from the export template axes,
+    while retaining the axes, insets, their titles and tick setup.
+    """
+    for axes in axesL:
+        if axes == None:
+            continue
+        for artist in list(axes.lines) + list(axes.texts) + list(axes.collections) + list(axes.patches):
+            artist.remove()
+        if axes.legend_ != None:
+            axes.legend_.remove()
+        axes.ffeLines = {}
+        axes.set_prop_cycle(None)
+        axes.relim()
+        axes.set_autoscale_on(True)
+
+
+def _export(entCodes, outDir, fmt='png', bPivotPoints=True, bVolumes=True, bRSI=True, bLinRegress=False, figSize=(16,9), dpi=100):
+    """
+    Render the _plot chart wrt each of the given entCodes into outDir/<entCode>.<fmt>,
+    using a offscreen (Agg) figure, which is created once and reused across the entities.
+    Returns the number of charts exported.
+    """
+    from matplotlib.figure import Figure
+    entDB = edb.gEntDB
+    fig = Figure(figsize=figSize, dpi=dpi)
+    axesL = _plot_axes(bVolumes, bRSI, fig.add_subplot())
+    numCharts = 0
+    for entCode in entCodes:
+        entIndex = entDB.meta['codeD'].get(entCode, None)
+        if entIndex == None:
+            log.warn("Stocks:Export", "Unknown entCode {}, skipping", entCode)
+            continue
+        _export_clear(axesL)
+        _plot(entCode, bPivotPoints=bPivotPoints, bVolumes=bVolumes, bRSI=bRSI, bLinRegress=bLinRegress, axesL=axesL)
+        axesL[0].set_title("{}: {}".format(entCode, entDB.meta['name'][entIndex]))
+        eplot._show(entDB, axesL[0], 'upper left')
+        fName = "{}.{}".format(str(entCode).replace(os.sep, "_").replace(" ", "_"), fmt)
+        fig.savefig(os.path.join(outDir, fName), format=fmt)
+        log.dbug("Stocks:Export", "{}", fName)
+        numCharts += 1
+    return numCharts
+
+
+def _export_worker(basePath, sessionName, entCodes, outDir, fmt, kwargs):
+    """
+    Export the charts wrt the given entCodes, in a worker process, using the shared session.
+    """
+    hlpr.gbInteractive = False
+    log.set_level('WARN')
+    edb.setup(basePath)
+    edb.session_restore(sessionName, mmapMode='r')
+    return _export(entCodes, outDir, fmt, **kwargs)
+
+
+def export(entCodes, outDir, fmt='png', numProcs=1, sessionName=None, **kwargs):
+    """
+    Save the chart generated by plot wrt each entCode in the given list, as a png/svg
+    file in outDir, without showing them. Thus charts can be generated for hundreds of
+    stocks in one go. prep should have been called before this.
+
+    fmt: The image file format, 'png' or 'svg'.
+    numProcs: If more than 1, the charts are generated in parallel by numProcs worker
+        processes. They share the entities db, by memory mapping a saved session.
+    sessionName: The session used by the worker processes. If not given, the current
+        entities db is saved as the session named export.
+    kwargs: bPivotPoints, bVolumes, bRSI, bLinRegress (as in plot), figSize, dpi
+
+    Returns the number of charts exported.
+    """
+    if type(entCodes) == str:
+        entCodes = [ entCodes ]
+    os.makedirs(outDir, exist_ok=True)
+    time1 = time.time()
+    if numProcs <= 1:
+        numCharts = _export(entCodes, outDir, fmt, **kwargs)
+    else:
+        if sessionName == None:
+            sessionName = "export"
+            edb.session_save(sessionName)
+        numProcs = min(numProcs, len(entCodes))
+        numCharts = 0
+        with concurrent.futures.ProcessPoolExecutor(numProcs) as ppe:
+            futures = [ ppe.submit(_export_worker, edb.gBasePath, sessionName, entCodes[i::numProcs], outDir, fmt, kwargs) for i in range(numProcs) ]
+            for fut in futures:
+                numCharts += fut.result()
+    log.info("Stocks:Export", "Saved {} charts into {}, took {:.2f} seconds", numCharts, outDir, time.time()-time1)
+    return numCharts
+
+
 def prep(bRSIJWW=True):
     """
     Process available entity raw datasets to generated useful processed data.
@@ -136,7 +250,7 @@ def prep(bRSIJWW=True):
 
 def topbottom():
     for sType in [ 'nse nifty 50', 'nse nifty 100' ]:
-        input("About to look at Top and Bottom N stocks wrt {}".format(sType))
+        hlpr.prompt("About to look at Top and Bottom N stocks wrt {}".format(sType))
         procedb.infoset1_result(sType, resultType='result2', bPrompt=True)
 
 
@@ -7,16 +7,21 @@ import readline
 
 gMeta = None
 L1 = [ "edb.load", "edb.fetch", "edb.search", "edb.load_mfs", "edb.load_stocks",
-        "edb.enttypes", "edb.enttype_members",
-        "procedb.ops", "procedb.mabeta", "procedb.anal_simple",
+        "edb.enttypes", "edb.enttype_members", "edb.enttype_mask", "ops.print_catagg", "edb.use_memmap",
+        "procedb.ops", "procedb.mabeta", "procedb.correlation", "procedb.anal_simple",
         "plot.data", "plot.show", "plot.linregress",
         "loadfilters.setup", "loadfilters.list", "loadfilters.get", "loadfilters.activate", "loadfilters.copy",
         "session_save", "session_restore",
         "procedb.infoset1_prep", "procedb.infoset1_result",
-        "stocks.load", "stocks.prep", "stocks._plot", "stocks.plot", "stocks.topbottom",
-        "crazy.above_ndays", "crazy.below_ndays",
-        "ops.pivotpoints", "ops.print_pivotpoints", "ops.weekly_view", "ops.monthly_view",
+        "stocks.load", "stocks.prep", "stocks._plot", "stocks.plot", "stocks.export", "stocks.topbottom",
+        "crazy.above_ndays", "crazy.below_ndays", "crazy.pivot_cross",
+        "screener.screen", "screener.backfill", "screener.masks",
+        "backtest.forward_returns", "backtest.print_forward_returns", "backtest.equity_curve", "backtest.print_equity_curve",
+        "portfolio.add", "portfolio.values", "portfolio.weights_matrix",
+        "ops.pivotpoints", "ops.pivotpoints_full", "ops.print_pivotpoints", "ops.weekly_view", "ops.monthly_view",
         "ops.rsi_jww", "ops.rsi_sma",
+        "bench.run", "bench.compare", "perf.enable", "perf.summary", "perf.reset",
+        "log.set_level", "log.flush", "batch.run",
         "hlpr.print_list",
         "quit"
         ]
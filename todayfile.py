@@ -2,17 +2,333 @@
 # HanishKVC, 2021
 
 
+import os
+import json
+import time
+import numpy
 import hlpr
 import loadfilters
+import perf
+import log
 
 
 TODAY_MARKER = "TODAYFILEKVC_V92"
+TODAYFRAME_MARKER = "TODAYFRAMEKVC_V01"
+NAMEDICT_MARKER = "NAMEDICTKVC_V01"
+# Enable this to create and save new today data as TodayFrame (npz) instead of
+# today dictionary (pickle). Loading supports both the formats irrespective.
+gbTodayFrame = True
 
 
-def init(date, dataKeys):
+def _strs2buf(lStrs):
     """
-    Initialise a today dictionary.
+    Pack a list of strings into a utf-8 byte buffer, with strings separated by null.
     """
+    return numpy.frombuffer("\0".join(lStrs).encode('utf-8'), dtype=numpy.uint8)
+
+
+def _buf2strs(theBuf):
+    """
+    Unpack a list of strings from a byte buffer created by _strs2buf.
+    """
+    if len(theBuf) == 0:
+        return []
+    return theBuf.tobytes().decode('utf-8').split("\0")
+
+
+class NameDict:
+    """
+    A persistent dictionary of entity names, shared across the per day TodayFrames
+    of a DataSrc. Each unique name gets a stable integer id (its index), so that
+    the TodayFrames need to store only the name ids.
+
+    The raw names are saved into <fName>.npz, while the cleaned up name wrt each
+    id is generated only once, when its first needed.
+    uid: identifies this name dictionary, so that TodayFrames created wrt a
+        different (say recreated) name dictionary are not misinterpreted.
+    """
+
+    __slots__ = ('fName', 'uid', 'names', 'namesD', 'cleanNames', 'cleanupMap', 'bDirty')
+
+    def __init__(self, fName):
+        self.fName = fName
+        self.uid = "{:x}".format(time.time_ns())
+        self.names = []
+        self.namesD = {}
+        self.cleanNames = {}
+        self.cleanupMap = None
+        self.bDirty = False
+        if fName != None:
+            self.load()
+
+
+    def intern(self, name):
+        """
+        Get the id associated with the given name, adding it if required.
+        """
+        nameId = self.namesD.get(name, -1)
+        if nameId == -1:
+            nameId = len(self.names)
+            self.names.append(name)
+            self.namesD[name] = nameId
+            self.bDirty = True
+        return nameId
+
+
+    def clean_name(self, nameId, nameCleanupMap):
+        """
+        Get the cleaned up name wrt the given id.
+        """
+        if self.cleanupMap is not nameCleanupMap:
+            self.cleanNames = {}
+            self.cleanupMap = nameCleanupMap
+        name = self.cleanNames.get(nameId, None)
+        if name == None:
+            name = self.names[nameId]
+            if nameCleanupMap != None:
+                name = hlpr.string_cleanup(name, nameCleanupMap)
+            self.cleanNames[nameId] = name
+        return name
+
+
+    def load(self):
+        fName = "{}.npz".format(self.fName)
+        if not os.path.exists(fName):
+            return
+        try:
+            with numpy.load(fName, allow_pickle=False) as npz:
+                hdr = npz['hdr']
+                if hdr[0] != NAMEDICT_MARKER:
+                    print("WARN:NameDict:Load:Invalid marker in", fName)
+                    return
+                self.uid = str(hdr[1])
+                self.names = _buf2strs(npz['names'])
+        except:
+            print("WARN:NameDict:Load:Failed for", fName)
+            return
+        self.namesD = { n: i for i, n in enumerate(self.names) }
+        self.cleanNames = {}
+        self.bDirty = False
+
+
+    def save(self, msgTag='NameDict'):
+        """
+        Save the name dictionary into <fName>.npz, if it has changed.
+        """
+        if (not self.bDirty) or (self.fName == None):
+            return
+        fName = "{}.npz".format(self.fName)
+        log.dbug(msgTag, "SaveNameDict:{}:{}", fName, len(self.names))
+        f = open(fName, 'wb+')
+        numpy.savez(f, hdr = numpy.array([NAMEDICT_MARKER, self.uid]), names = _strs2buf(self.names))
+        f.close()
+        self.bDirty = False
+
+
+class TodayFrame:
+    """
+    A compact representation of the data of all the entities wrt a given date.
+
+    All the strings (names, entTypes and string codes) are interned into a shared
+    string table, and the entities are maintained as parallel arrays of
+        codes: the entCode or its index in the string table, if codes are strings.
+        names: the index of the entName in the string table.
+        typeIds: the index of the entType in typeNames.
+        values: a matrix of entities x dataKeys.
+    While being built (add_ent) these are python lists, and inturn they are
+    converted into numpy arrays when saved or loaded.
+
+    It gets saved as a npz file containing only numpy arrays, with the more
+    categories stored as a json string. So no object pickling is involved.
+
+    If a NameDict is passed, then the entity names are interned into it rather
+    than the frame's own string table, so that only the name ids are saved.
+
+    For compatibility with code written for today dictionary, the header fields
+    can be accessed like a dictionary, ex: today['bUpToDate'].
+    """
+
+    __slots__ = ('marker', 'date', 'bUpToDate', 'dataKeys', 'more',
+                    'strs', 'strsD', 'bStrCodes', 'typeNames', 'typesD',
+                    'codes', 'names', 'typeIds', 'values', 'nameDict')
+
+    def __init__(self, date, dataKeys, nameDict=None):
+        self.marker = TODAYFRAME_MARKER
+        self.date = date
+        self.bUpToDate = True
+        self.dataKeys = list(dataKeys)
+        self.more = {}
+        self.strs = []
+        self.strsD = {}
+        self.bStrCodes = None
+        self.typeNames = []
+        self.typesD = {}
+        self.codes = []
+        self.names = []
+        self.typeIds = []
+        self.values = []
+        self.nameDict = nameDict
+
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+
+    def _intern(self, theStr):
+        """
+        Get the index of the given string in the string table, adding it if required.
+        """
+        strIndex = self.strsD.get(theStr, -1)
+        if strIndex == -1:
+            strIndex = len(self.strs)
+            self.strs.append(theStr)
+            self.strsD[theStr] = strIndex
+        return strIndex
+
+
+    def add_ent(self, entCode, entName, entValues, entType):
+        typeId = self.typesD.get(entType, -1)
+        if typeId == -1:
+            typeId = len(self.typeNames)
+            self.typeNames.append(entType)
+            self.typesD[entType] = typeId
+        if self.bStrCodes == None:
+            self.bStrCodes = (type(entCode) == str)
+        if self.bStrCodes:
+            entCode = self._intern(entCode)
+        self.codes.append(entCode)
+        if self.nameDict != None:
+            self.names.append(self.nameDict.intern(entName))
+        else:
+            self.names.append(self._intern(entName))
+        self.typeIds.append(typeId)
+        self.values.append(entValues)
+
+
+    def entname(self, nameIndex, nameCleanupMap=None):
+        """
+        Return the (cleaned up) entName corresponding to the given index in names.
+        """
+        if self.nameDict != None:
+            return self.nameDict.clean_name(nameIndex, nameCleanupMap)
+        name = self.strs[nameIndex]
+        if nameCleanupMap != None:
+            name = hlpr.string_cleanup(name, nameCleanupMap)
+        return name
+
+
+    def entcodes(self):
+        """
+        Return the list of entCodes in this frame.
+        """
+        codes = numpy.asarray(self.codes, dtype=numpy.int64)
+        if self.bStrCodes:
+            return [ self.strs[i] for i in codes ]
+        return codes.tolist()
+
+
+    def _more2json(self):
+        """
+        Convert more categories into json. Dictionary categories are stored as
+        a list of [key, value] pairs, so that non string keys are retained.
+        """
+        lMore = []
+        for cat in self.more:
+            theCat = self.more[cat]
+            if type(theCat) == dict:
+                lMore.append([cat, 'dict', [ [k, theCat[k]] for k in theCat ]])
+            else:
+                lMore.append([cat, 'list', theCat])
+        return json.dumps(lMore)
+
+
+    def _json2more(self, sMore):
+        self.more = {}
+        for cat, catType, catData in json.loads(sMore):
+            if catType == 'dict':
+                self.more[cat] = { k: v for k, v in catData }
+            else:
+                self.more[cat] = catData
+
+
+    def save(self, fName, msgTag='TodayFrame'):
+        """
+        Save the frame into <fName>.npz
+        """
+        fName = "{}.npz".format(fName)
+        log.dbug(msgTag, "SaveTodayFrame:{}", fName)
+        nameDictUid = ''
+        if self.nameDict != None:
+            self.nameDict.save(msgTag)
+            nameDictUid = self.nameDict.uid
+        values = numpy.zeros([len(self.codes), len(self.dataKeys)])
+        if len(self.values) > 0:
+            values = numpy.asarray(self.values, dtype=float).reshape(values.shape)
+        f = open(fName, 'wb+')
+        numpy.savez(f,
+            hdr = numpy.array([self.marker, str(self.date), str(self.bUpToDate), str(self.bStrCodes), nameDictUid]),
+            dataKeys = numpy.array(self.dataKeys, dtype=str),
+            strs = _strs2buf(self.strs),
+            typeNames = _strs2buf(self.typeNames),
+            codes = numpy.asarray(self.codes, dtype=numpy.int64),
+            names = numpy.asarray(self.names, dtype=numpy.int32),
+            typeIds = numpy.asarray(self.typeIds, dtype=numpy.int32),
+            values = values,
+            more = numpy.array(self._more2json()))
+        f.close()
+
+
+    @classmethod
+    def load(cls, fName, nameDict=None):
+        """
+        Load a frame from <fName>.npz
+        Returns None, if there is no valid frame.
+        If the frame was saved wrt a NameDict, the same needs to be passed.
+        """
+        fName = "{}.npz".format(fName)
+        if not os.path.exists(fName):
+            return None
+        try:
+            with numpy.load(fName, allow_pickle=False) as npz:
+                hdr = npz['hdr']
+                if hdr[0] != TODAYFRAME_MARKER:
+                    return None
+                today = cls(int(hdr[1]), npz['dataKeys'].tolist())
+                today.marker = str(hdr[0])
+                today.bUpToDate = (hdr[2] == 'True')
+                today.bStrCodes = (hdr[3] == 'True')
+                today.strs = _buf2strs(npz['strs'])
+                today.typeNames = _buf2strs(npz['typeNames'])
+                today.codes = npz['codes']
+                today.names = npz['names']
+                today.typeIds = npz['typeIds']
+                today.values = npz['values']
+                today._json2more(str(npz['more']))
+                if (len(hdr) > 4) and (hdr[4] != ''):
+                    if (nameDict == None) or (nameDict.uid != hdr[4]) or \
+                            ((len(today.names) > 0) and (numpy.max(today.names) >= len(nameDict.names))):
+                        print("WARN:TodayFrame:Load:NameDict mismatch for", fName)
+                        return None
+                    today.nameDict = nameDict
+        except:
+            log.dbug("TodayFrame", "Load:Failed for {}", fName)
+            return None
+        today.strsD = { s: i for i, s in enumerate(today.strs) }
+        today.typesD = { t: i for i, t in enumerate(today.typeNames) }
+        return today
+
+
+def init(date, dataKeys, nameDict=None):
+    """
+    Initialise a today dictionary OR a TodayFrame, based on gbTodayFrame.
+    nameDict: the NameDict to use wrt entity names, in case of TodayFrame.
+    """
+    if gbTodayFrame:
+        return TodayFrame(date, dataKeys, nameDict)
     today = {
         'marker': TODAY_MARKER,
         'date': date,
@@ -43,6 +359,11 @@ def add_ent(today, entCode, entName, entValues, entType, date):
     Add given entity and its entityType to today.
     It also updates the bUpToDate flag in today.
     """
+    if isinstance(today, TodayFrame):
+        today.add_ent(entCode, entName, entValues, entType)
+        if today.date != date:
+            today.bUpToDate = False
+        return
     typeMembers = add_enttype(today, entType)
     typeMembers.append(entCode)
     entIndex = len(today['data'])
@@ -53,6 +374,15 @@ def add_ent(today, entCode, entName, entValues, entType, date):
         today['bUpToDate'] = False
 
 
+def num_ents(today):
+    """
+    Return the number of entities in the given today dictionary or TodayFrame.
+    """
+    if isinstance(today, TodayFrame):
+        return len(today.codes)
+    return len(today['data'])
+
+
 def add_morecat(today, cat, catType=list):
     """
     Create a category in more dictionary to store any additional meta/related data
@@ -81,9 +411,11 @@ def add_morecat_data(today, cat, data, key=None):
 
 def valid_today(today):
     """
-    Check passed today dictionary contains a valid marker.
+    Check passed today dictionary or TodayFrame contains a valid marker.
     Also give the UpToDate status stored in it.
     """
+    if isinstance(today, TodayFrame):
+        return (today.marker == TODAYFRAME_MARKER), today.bUpToDate
     if 'marker' in today:
         bMarker = (today['marker'] == TODAY_MARKER)
         return bMarker, today['bUpToDate']
@@ -91,9 +423,153 @@ def valid_today(today):
         return False, False
 
 
+def save(fName, today, msgTag="TodayFile"):
+    """
+    Save the passed today dictionary (as a pickle) or TodayFrame (as a npz).
+    """
+    if isinstance(today, TodayFrame):
+        today.save(fName, msgTag)
+    else:
+        hlpr.save_pickle(fName, today, [], msgTag)
+
+
+def load(fName, nameDict=None):
+    """
+    Load the today data saved for the given fName. A TodayFrame (npz) is
+    preferred, if available, else a today dictionary (pickle) is tried.
+    Returns: bOk, today
+    """
+    today = TodayFrame.load(fName, nameDict)
+    if today != None:
+        return True, today
+    if hlpr.pickle_ok(fName, 64):
+        bOk, today, temp = hlpr.load_pickle(fName)
+        if bOk:
+            return True, today
+    return False, None
+
+
+def _skip_enttype(entType, loadFilters):
+    """
+    Check if the given entType is filtered out by the loadFilters.
+    """
+    if loadFilters['whiteListEntTypes'] == None:
+        return False
+    fm,pm = hlpr.matches_templates(entType, loadFilters['whiteListEntTypes'])
+    return (len(fm) == 0)
+
+
+def _skip_entname(entName, loadFilters):
+    """
+    Check if the given entName is filtered out by the loadFilters.
+    """
+    if (loadFilters['whiteListEntNames'] != None):
+        fm, pm = hlpr.matches_templates(entName, loadFilters['whiteListEntNames'])
+        if len(fm) == 0:
+            return True
+    if (loadFilters['blackListEntNames'] != None):
+        fm, pm = hlpr.matches_templates(entName, loadFilters['blackListEntNames'])
+        if len(fm) > 0:
+            return True
+    return False
+
+
+def _load2edb_dict(today, entDB, loadFilters, nameCleanupMap, caller):
+    """
+    Load the entities data in the passed today dictionary into entDB.
+    """
+    for curEntType in today['entTypes']:
+        entCodes = today['entTypes'][curEntType]
+        curEntTypeId = entDB.add_type(curEntType)
+        if _skip_enttype(curEntType, loadFilters):
+            continue
+        # Handle entities
+        for entCode in entCodes:
+            entIndex = today['codeD'][entCode]
+            code, name, values = today['data'][entIndex]
+            if nameCleanupMap != None:
+                name = hlpr.string_cleanup(name, nameCleanupMap)
+            if (entCode != code):
+                hlpr.prompt("DBUG:{}:_LoadData: Code[{}] NotMatchExpected [{}], skipping".format(caller, code, entCode))
+                continue
+            if _skip_entname(name, loadFilters):
+                continue
+            datas = {}
+            for i in range(len(today['dataKeys'])):
+                dataKey = today['dataKeys'][i]
+                datas[dataKey] = values[i]
+            entDB.add_data(entCode, datas, name, curEntTypeId)
+
+
+def _load2edb_frame(today, entDB, loadFilters, nameCleanupMap):
+    """
+    Load the entities data in the passed TodayFrame into entDB.
+
+    The entType and entName filtering and name cleanup is done once wrt each unique
+    string in the string table, and the values are copied into entDB in bulk.
+    If the frame uses a NameDict, then the name id wrt each entity is tracked in
+    entDB.meta['nameId'], so that get_entindex's name check (and rename warning)
+    happens only when the name id wrt a entity changes.
+    Entities are added to entDB in the same order as done wrt today dictionary.
+    """
+    typeIds = numpy.asarray(today.typeIds, dtype=numpy.int32)
+    names = numpy.asarray(today.names, dtype=numpy.int32)
+    values = numpy.asarray(today.values, dtype=float).reshape(len(typeIds), len(today.dataKeys))
+    entCodes = today.entcodes()
+    bSkipTypes = numpy.zeros(len(today.typeNames), dtype=bool)
+    entTypeIds = []
+    for i, entType in enumerate(today.typeNames):
+        entTypeIds.append(entDB.add_type(entType))
+        bSkipTypes[i] = _skip_enttype(entType, loadFilters)
+    # If names are ids wrt a NameDict, then the name check/update wrt a entity
+    # already in entDB is required only if its name id has changed.
+    entNameIds = None
+    if today.nameDict != None:
+        entNameIds = entDB.meta.get('nameId', None)
+    entCodeD = entDB.meta['codeD']
+    bSkipNames = {}
+    entIndexes = []
+    srcIndexes = []
+    with perf.stage("load2edb:filter") as st:
+        for i in numpy.argsort(typeIds, kind='stable'):
+            if bSkipTypes[typeIds[i]]:
+                continue
+            nameIndex = names[i]
+            bSkipName = bSkipNames.get(nameIndex, None)
+            if bSkipName == None:
+                bSkipName = _skip_entname(today.entname(nameIndex, nameCleanupMap), loadFilters)
+                bSkipNames[nameIndex] = bSkipName
+            if bSkipName:
+                continue
+            entIndex = entCodeD.get(entCodes[i], -1)
+            if (entNameIds is None) or (entIndex == -1) or (entNameIds[entIndex] != nameIndex):
+                name = today.entname(nameIndex, nameCleanupMap)
+                entIndex = entDB.get_entindex(entCodes[i], name, entTypeIds[typeIds[i]])
+                if entNameIds is not None:
+                    entNameIds[entIndex] = nameIndex
+            entIndexes.append(entIndex)
+            srcIndexes.append(i)
+        st.count('skipped', len(typeIds)-len(entIndexes))
+    if len(entIndexes) == 0:
+        return
+    if entDB.nxtDateIndex == 0:
+        hlpr.prompt("DBUG:TodayFile:Load2EDBFrame: Trying to add entity data, before date is specified")
+        return
+    with perf.stage("load2edb:insert") as st:
+        entIndexes = numpy.array(entIndexes)
+        dateIndex = entDB.nxtDateIndex-1
+        bFirst = entDB.meta['firstSeenDI'][entIndexes] == -1
+        entDB.meta['firstSeenDI'][entIndexes[bFirst]] = dateIndex
+        entDB.meta['lastSeenDI'][entIndexes] = dateIndex
+        for i, dataKey in enumerate(today.dataKeys):
+            entDB.data[dataKey][entIndexes, dateIndex] = values[srcIndexes, i]
+        st.count('ents', len(entIndexes))
+        st.bytes(values.nbytes)
+
+
 def load2edb(today, entDB, loadFilters=None, nameCleanupMap=None, filterName=None, caller="TodayFile"):
     """
-    Load data in today dictionary into the given entities db (entDB).
+    Load data in today dictionary or TodayFrame into the given entities db (entDB).
 
     Apply the specified filters if any wrt entType or entName. Inturn the
     filtered data which passes the check will only be loaded into entDB.
@@ -127,43 +603,12 @@ def load2edb(today, entDB, loadFilters=None, nameCleanupMap=None, filterName=Non
     """
     loadFilters = loadfilters.get(filterName, loadFilters)
     # Handle entTypes and their entities
-    for curEntType in today['entTypes']:
-        entCodes = today['entTypes'][curEntType]
-        curEntTypeId = entDB.add_type(curEntType)
-        if loadFilters['whiteListEntTypes'] == None:
-            bSkipCurType = False
+    with perf.stage("load2edb") as st:
+        if isinstance(today, TodayFrame):
+            _load2edb_frame(today, entDB, loadFilters, nameCleanupMap)
         else:
-            fm,pm = hlpr.matches_templates(curEntType, loadFilters['whiteListEntTypes'])
-            if len(fm) == 0:
-                bSkipCurType = True
-            else:
-                bSkipCurType = False
-        if bSkipCurType:
-            continue
-        # Handle entities
-        for entCode in entCodes:
-            entIndex = today['codeD'][entCode]
-            code, name, values = today['data'][entIndex]
-            if nameCleanupMap != None:
-                name = hlpr.string_cleanup(name, nameCleanupMap)
-            if (entCode != code):
-                input("DBUG:{}:_LoadData: Code[{}] NotMatchExpected [{}], skipping".format(caller, code, entCode))
-                continue
-            if (loadFilters['whiteListEntNames'] != None):
-                fm, pm = hlpr.matches_templates(name, loadFilters['whiteListEntNames'])
-                if len(fm) == 0:
-                    #gMeta['skipped'].add(str([code, name]))
-                    continue
-            if (loadFilters['blackListEntNames'] != None):
-                fm, pm = hlpr.matches_templates(name, loadFilters['blackListEntNames'])
-                if len(fm) > 0:
-                    #gMeta['skipped'].add(str([code, name]))
-                    continue
-            datas = {}
-            for i in range(len(today['dataKeys'])):
-                dataKey = today['dataKeys'][i]
-                datas[dataKey] = values[i]
-            entDB.add_data(entCode, datas, name, curEntTypeId)
+            _load2edb_dict(today, entDB, loadFilters, nameCleanupMap, caller)
+        st.count('ents', num_ents(today))
     # Handle the more categories of data, which is blindly copied into entDB
     for cat in today['more']:
         theCat = today['more'][cat]
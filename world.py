@@ -3,12 +3,18 @@
 # HanishKVC, 2021
 # GPL
 #
-# NOTE: This is a initial skeleton for testing only
-#
 
+import os
 import sys
-import time
+import datetime
+import zipfile
+import numpy
 import hlpr
+import datasrc
+import todayfile
+import loadfilters
+import perf
+import log
 
 
 ## From https://fred.stlouisfed.org/graph/fredgraph.csv
@@ -25,6 +31,7 @@ import hlpr
 #COM_UK_SILVER_URL = "https://fred.stlouisfed.org/graph/fredgraph.csv?id=SLVPRUSD&cosd=2017-10-02&coed=2021-03-08"
 WORLD_DATE_URL = "https://fred.stlouisfed.org/graph/fredgraph.csv?id={}&cosd={}-{:02}-{:02}&coed={}-{:02}-{:02}"
 WORLD_FULL_URL = "https://fred.stlouisfed.org/graph/fredgraph.csv?id={}"
+WORLD_FNAMECSV_TMPL = "data/WORLD_{}.csv"
 
 ## Alternate data sources
 ## The datahub.io sources are not uptodate
@@ -44,27 +51,250 @@ DATASETS = [
         [ "COM_UK_SILVER", "SLVPRUSD" ],
         ]
 
+ENTTYPES = {
+        'INDEX': 'World Index',
+        'COM': 'World Commodity',
+        }
+
 
-def fetch(y=None):
+
+class WorldDS(datasrc.DataSrc):
     """
-    Fetch either a given year's data or the full data available from the given source.
+    The historic data of some of the world indexes and commodities, from FRED.
 
-    If year is not specified, then get what ever the server gives when date range is not given.
+    The remote server provides the full history of a series in a single csv file.
+    So each series is fetched fully once, and later refreshes fetch only the dates
+    beyond what is already available locally, and inturn append the new rows.
+    The rows are parsed into a compact columnar npz cache (dates and values) wrt
+    each series, which is used to load a date range in one go.
     """
-    for ds in DATASETS:
-        if y != None:
-            turl = WORLD_DATE_URL.format(ds[1], y,1,1,y,12,31)
-            fName = "{}-{}.csv".format(ds[0], y)
-        else:
-            turl = WORLD_FULL_URL.format(ds[1])
-            fTime = time.strftime("%Y%m%d")
-            fName = "{}-{}.csv".format(ds[0], fTime)
-        hlpr.wget_better(turl, fName)
-
-
-if len(sys.argv) < 2:
-    year = None
-else:
-    year = sys.argv[1]
-fetch(year)
+
+    urlTmpl = WORLD_FULL_URL
+    pathTmpl = WORLD_FNAMECSV_TMPL
+    dataKeys = [ 'close' ]
+    tag = "WorldDS"
+    bSkipWeekEnds = False
+    bDateBlocks = True
+    noDataBlockUnit = "series"
+
+    def __init__(self, basePath="~/", loadFilters=None, nameCleanupMap=None):
+        super().__init__(basePath, loadFilters, nameCleanupMap)
+        self.dataSrcType = datasrc.DSType.World
+        loadfilters.setup(self.tag, None, None, None, loadFilters)
+
+
+    def _valid_remotefile(self, fName):
+        f = open(fName)
+        l = f.readline()
+        f.close()
+        return l.startswith("DATE,") or l.startswith("observation_date,")
+
+
+    def _parse_file(self, fName, today=None):
+        """
+        Parse the given FRED csv file.
+        Returns the dates (as YYYYMMDD ints) and the values wrt each date.
+        Dates without a value (. in the csv) are skipped.
+        """
+        dates = []
+        values = []
+        tFile = open(fName)
+        for l in tFile:
+            la = l.strip().split(',')
+            if (len(la) < 2) or (not la[0][:1].isdigit()):
+                continue
+            try:
+                value = float(la[1])
+            except ValueError:
+                continue
+            dates.append(int(la[0].replace('-','')))
+            values.append(value)
+        tFile.close()
+        return numpy.array(dates, dtype=int), numpy.array(values, dtype=float)
+
+
+    def _load_cache(self, fName):
+        """
+        Load the npz cache of a series.
+        Returns bOk, dates, values, fetchedDate
+        """
+        cacheName = "{}.npz".format(fName)
+        if not os.path.exists(cacheName):
+            return False, None, None, 0
+        try:
+            with numpy.load(cacheName, allow_pickle=False) as npz:
+                return True, npz['dates'], npz['values'], int(npz['fetched'])
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            log.warn(self.tag, "LoadCache:Ignoring invalid cache {}:{}", cacheName, e)
+            return False, None, None, 0
+
+
+    def _save_cache(self, fName, dates, values):
+        """
+        Save the dates and values of a series into its npz cache.
+        """
+        numpy.savez("{}.npz".format(fName), dates=dates, values=values, fetched=hlpr.date2dateint(datetime.date.today()))
+
+
+    def _parse2cache(self, fName, bForceRemote=False, bForceLocal=False):
+        """
+        Parse the local csv file of a series and save it into its npz cache.
+        """
+        try:
+            with perf.stage("parse:{}".format(self.tag)) as st:
+                dates, values = self._parse_file(fName)
+                st.count('dates', len(dates))
+            self._save_cache(fName, dates, values)
+        except:
+            log.agg("{}:Fetch4Series".format(self.tag), fName, "{}:ForceRemote[{}], ForceLocal[{}]:{}".format(fName, bForceRemote, bForceLocal, sys.exc_info()), log.ERRR)
+
+
+    def _fetch_update(self, seriesId, fName, dates, values, endDate):
+        """
+        Fetch the data of the series beyond its last cached date till endDate, and
+        append the new rows to both the local csv file and the cache.
+        """
+        lastDate = hlpr.dateint2date(int(dates[-1])) + datetime.timedelta(1)
+        if lastDate > endDate:
+            return
+        url = WORLD_DATE_URL.format(seriesId, lastDate.year, lastDate.month, lastDate.day, endDate.year, endDate.month, endDate.day)
+        fNameUpd = "{}.update".format(fName)
+        self._fetch_remote(url, fNameUpd)
+        if not os.path.exists(fNameUpd):
+            return
+        try:
+            updDates, updValues = self._parse_file(fNameUpd)
+        finally:
+            os.remove(fNameUpd)
+        bNew = updDates > dates[-1]
+        if not numpy.any(bNew):
+            self._save_cache(fName, dates, values)
+            return
+        updDates = updDates[bNew]
+        updValues = updValues[bNew]
+        with open(fName, "a") as f:
+            for d, v in zip(updDates, updValues):
+                f.write("{}-{:02}-{:02},{}\n".format(d//10000, (d//100)%100, d%100, v))
+        self._save_cache(fName, numpy.concatenate([dates, updDates]), numpy.concatenate([values, updValues]))
+        log.dbug(self.tag, "FetchUpdate:{}: Appended {} rows", seriesId, len(updDates))
+
+
+    def fetch4series(self, seriesId, endDate=None, opts=None):
+        """
+        Fetch and cache the data wrt the given series.
+
+        If the series has not been fetched before, its full history is fetched. Else
+        only the dates beyond what is already cached are fetched, unless it was already
+        refreshed today.
+
+        opts: ForceLocal and ForceRemote, as in fetch4date.
+            ForceRemote: fetch the full history again.
+            ForceLocal: dont fetch, only recreate the cache from the local csv if required.
+        """
+        fName = self.pathTmpl.format(seriesId)
+        if opts == None:
+            opts = {}
+        if endDate == None:
+            endDate = hlpr.not_beyond_today(datetime.date.today())
+        bForceRemote = opts.get('ForceRemote', False)
+        bForceLocal = opts.get('ForceLocal', False)
+        bOk, dates, values, fetched = self._load_cache(fName)
+        if bForceRemote or ((not bOk) and (not bForceLocal)):
+            self._fetch_remote(WORLD_FULL_URL.format(seriesId), fName)
+            self._parse2cache(fName, bForceRemote, bForceLocal)
+        elif not bOk:
+            if not os.path.exists(fName):
+                # Missing series are reported through listNoDataBlocks by the caller
+                log.dbug(self.tag, "Fetch4Series:ForceLocal:No local file {}", fName)
+                return
+            errMsg = "Fetch4Series:{}:Available remote file not valid".format(fName)
+            self.remove_if_invalid(fName, errMsg)
+            self._parse2cache(fName, bForceRemote, bForceLocal)
+        elif (not bForceLocal) and (len(dates) > 0) and (fetched < hlpr.date2dateint(datetime.date.today())):
+            self._fetch_update(seriesId, fName, dates, values, endDate)
+
+
+    def fetch4daterange(self, startDate, endDate, opts=None):
+        """
+        Fetch the data wrt all the series. As the full history of a series is fetched
+        in one go, startDate is not used.
+        """
+        for ds in DATASETS:
+            log.dbug(self.tag, "FetchDateRange:{}", ds[1])
+            self.fetch4series(ds[1], endDate, opts)
+
+
+    def _load4series(self, seriesId, opts):
+        """
+        Get the data wrt the given series from the local cache. If required, it is
+        parsed from the local csv file or else fetched from the remote server (unless
+        LoadLocalOnly).
+        Returns bOk, dates, values
+        """
+        fName = self.pathTmpl.format(seriesId)
+        for i in range(3):
+            bOk, dates, values, fetched = self._load_cache(fName)
+            if bOk:
+                break
+            log.dbug(self.tag, "Load4Series:Try={}: No valid data cache found for {}", i, fName)
+            if i > 0:
+                if opts.get('LoadLocalOnly'):
+                    break
+                optsFD = { 'ForceRemote': True }
+            else:
+                optsFD = { 'ForceLocal': True }
+            self.fetch4series(seriesId, None, optsFD)
+        return bOk, dates, values
+
+
+    def load4daterange(self, startDate, endDate, entDB, opts):
+        """
+        Load the data wrt all the series, for the given date range, into the entities db.
+        The dates should have already been added to the entities db.
+
+        The dates of a series are mapped to the date indexes of the entities db using
+        searchsorted. A date missing in the entities db (ex: a weekend, if they are
+        skipped) maps to the next date in it, and if multiple dates map to the same
+        date index, the latest of them is used. The latest value at or before the
+        start of the date range is used wrt the 1st date. Thus monthly series also
+        get aligned.
+
+        NOTE: This logic wont fill in missing data wrt holidays,
+        you will have to call fillin4holidays explicitly.
+        """
+        loadFilters = loadfilters.get('active', self.loadFilters)
+        dbDates = entDB.dates[:entDB.nxtDateIndex].astype(int)
+        if len(dbDates) == 0:
+            return
+        startInt = max(hlpr.date2dateint(startDate), dbDates[0])
+        endInt = min(hlpr.date2dateint(endDate), dbDates[-1])
+        with perf.stage("load4daterange:{}".format(self.tag)) as st:
+            for entName, seriesId in DATASETS:
+                entType = ENTTYPES[entName.split('_')[0]]
+                entTypeId = entDB.add_type(entType)
+                if todayfile._skip_enttype(entType, loadFilters) or todayfile._skip_entname(entName, loadFilters):
+                    continue
+                bOk, dates, values = self._load4series(seriesId, opts)
+                if not bOk:
+                    self.listNoDataBlocks.append(seriesId)
+                    st.count('nodata')
+                    continue
+                iS = max(numpy.searchsorted(dates, startInt, side='right')-1, 0)
+                iE = numpy.searchsorted(dates, endInt, side='right')
+                dates = dates[iS:iE]
+                values = values[iS:iE]
+                dateIndexes = numpy.searchsorted(dbDates, dates)
+                # Keep the last of the dates which map to the same date index
+                bLast = numpy.ones(len(dateIndexes), dtype=bool)
+                bLast[:-1] = dateIndexes[1:] != dateIndexes[:-1]
+                entDB.add_data_block(seriesId, dateIndexes[bLast], { 'close': values[bLast] }, entName, entTypeId)
+                st.count('dates', numpy.count_nonzero(bLast))
+
+
+
+if __name__ == "__main__":
+    basePath = "~/"
+    if len(sys.argv) > 1:
+        basePath = sys.argv[1]
+    WorldDS(basePath).fetch4daterange(None, hlpr.not_beyond_today(datetime.date.today()))
 